@@ -0,0 +1,419 @@
+# python3.7
+"""Script to benchmark the throughput of the data pipeline.
+
+This script measures how fast a combination of the dataset settings and the
+data loader settings can feed the trainer, WITHOUT launching a training job.
+Synthetic datasets are generated under the working directory (once, and reused
+afterwards) in every supported file format, such that the benchmark runs on CPU
+anywhere, and can be used to gate regressions.
+
+For each combination of file format, number of workers, prefetch factor, and
+transformation config, the script reports
+
+(1) the per-stage time (in milliseconds per sample, or per batch for collating
+    and transferring), i.e., fetching bytes from the file reader, decoding,
+    resizing, normalizing, collating, and transferring to the device (only if
+    CUDA is available), which are profiled within the main process;
+(2) the end-to-end throughput (in images/sec) of the data loader built with
+    `datasets.build_dataset()`, excluding the first batch (i.e., the start-up
+    of the workers).
+
+All results are saved to a JSON report. If a baseline report is given, each
+case is compared with the one with the same settings in the baseline, and the
+script exits with a non-zero code if the throughput drops by more than the
+tolerance.
+
+Example:
+
+python benchmark_data.py --formats dir,zip,lmdb,tar \\
+    --num_workers 0,4 --prefetch_factors 2 --configs sample,batch \\
+    --report work_dirs/data_benchmark/report.json
+"""
+
+import os
+import sys
+import argparse
+import json
+import platform
+import tarfile
+import time
+import zipfile
+import numpy as np
+import cv2
+
+import lmdb
+import torch
+from torch.utils.data._utils.collate import default_collate
+
+from datasets import build_dataset
+from datasets.file_readers.shard_reader import ShardWriter
+from utils.parsing_utils import parse_index
+
+# Supported file formats, and the name of the synthetic dataset for each.
+_DATASET_NAMES = {
+    'dir': 'synthetic_dir',
+    'zip': 'synthetic.zip',
+    'tar': 'synthetic.tar',
+    'lmdb': 'synthetic_lmdb',
+    'shard': 'synthetic_shard'
+}
+
+# Transformation configs, i.e., the keyword arguments for the dataset and those
+# for the data loader, besides the shared ones.
+_TRANSFORM_CONFIGS = {
+    'sample': (dict(), dict(batch_transform=False)),
+    'batch': (dict(), dict(batch_transform=True)),
+    'batch_threads': (dict(decode_threads=4), dict(batch_transform=True)),
+    'shared_memory': (dict(), dict(batch_transform=True,
+                                   shared_memory=True,
+                                   drop_keys=['raw_image']))
+}
+
+
+def parse_args():
+    """Parses arguments."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the throughput of the data pipeline.')
+    parser.add_argument('--work_dir', type=str,
+                        default='work_dirs/data_benchmark',
+                        help='Directory to save the synthetic datasets. '
+                             '(default: %(default)s)')
+    parser.add_argument('--formats', type=str, default='dir,zip,lmdb,tar',
+                        help=f'Comma-separated file formats to benchmark, '
+                             f'selected from {list(_DATASET_NAMES)}. '
+                             f'(default: %(default)s)')
+    parser.add_argument('--num_workers', type=parse_index, default='0,4',
+                        help='Comma-separated numbers of data workers. '
+                             '(default: %(default)s)')
+    parser.add_argument('--prefetch_factors', type=parse_index, default='2',
+                        help='Comma-separated prefetch factors, which only '
+                             'take effect with data workers. '
+                             '(default: %(default)s)')
+    parser.add_argument('--configs', type=str, default='sample,batch',
+                        help=f'Comma-separated transformation configs, '
+                             f'selected from {list(_TRANSFORM_CONFIGS)}. '
+                             f'(default: %(default)s)')
+    parser.add_argument('--num_images', type=int, default=1024,
+                        help='Number of images in each synthetic dataset. '
+                             '(default: %(default)s)')
+    parser.add_argument('--image_size', type=int, default=512,
+                        help='Size of the synthetic images. '
+                             '(default: %(default)s)')
+    parser.add_argument('--codec', type=str, default='jpg',
+                        choices=['jpg', 'png'],
+                        help='Codec of the synthetic images. '
+                             '(default: %(default)s)')
+    parser.add_argument('--resolution', type=int, default=256,
+                        help='Resolution of the images produced by the '
+                             'dataset. (default: %(default)s)')
+    parser.add_argument('--batch_size', type=int, default=32,
+                        help='Batch size of the data loader. '
+                             '(default: %(default)s)')
+    parser.add_argument('--num_batches', type=int, default=20,
+                        help='Number of batches to measure the throughput, '
+                             'excluding the first one. (default: %(default)s)')
+    parser.add_argument('--num_profile_samples', type=int, default=64,
+                        help='Number of samples to profile the per-stage '
+                             'time. (default: %(default)s)')
+    parser.add_argument('--report', type=str, default=None,
+                        help='Path to save the JSON report. If not provided, '
+                             '`report.json` under `work_dir` will be used.')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='Path to a baseline report to compare with. '
+                             '(default: %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Maximum relative drop of the throughput compared '
+                             'to the baseline. (default: %(default)s)')
+    return parser.parse_args()
+
+
+def make_synthetic_images(num_images, image_size, codec, seed=0):
+    """Generates encoded synthetic images.
+
+    Each image is a random smooth gradient with noise, such that the encoded
+    size (and hence the decoding cost) is close to that of a natural image.
+
+    Returns:
+        A list of `(filename, encoded_bytes)`.
+    """
+    rng = np.random.RandomState(seed)
+    grid = np.linspace(0, 1, image_size, dtype=np.float32)
+    images = []
+    for idx in range(num_images):
+        colors = rng.uniform(0, 255, size=(2, 3)).astype(np.float32)
+        ramp = (grid[:, None, None] + grid[None, :, None]) / 2
+        image = colors[0] * (1 - ramp) + colors[1] * ramp
+        image += rng.normal(0, 8, size=image.shape)
+        image = np.clip(image, 0, 255).astype(np.uint8)
+        is_success, buffer = cv2.imencode(f'.{codec}', image)
+        assert is_success, f'Failed to encode image {idx}!'
+        images.append((f'{idx:08d}.{codec}', buffer.tobytes()))
+    return images
+
+
+def make_synthetic_dataset(path, file_format, images):
+    """Saves images as a dataset in `file_format` under `path` if not exists.
+
+    The dataset is written to a temporary path first, and then renamed, such
+    that an interrupted generation never leaves a broken dataset behind.
+    """
+    if os.path.exists(path):
+        return path
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    if file_format == 'dir':
+        os.makedirs(temp_path)
+        for filename, data in images:
+            with open(os.path.join(temp_path, filename), 'wb') as f:
+                f.write(data)
+    elif file_format == 'zip':
+        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_STORED) as f:
+            for filename, data in images:
+                f.writestr(filename, data)
+    elif file_format == 'tar':
+        with tarfile.open(temp_path, 'w:') as f:
+            for filename, data in images:
+                info = tarfile.TarInfo(name=filename)
+                info.size = len(data)
+                f.addfile(info, fileobj=_BytesReader(data))
+    elif file_format == 'lmdb':
+        map_size = sum(len(data) for _, data in images) * 2 + 1024 ** 2
+        env = lmdb.open(temp_path, map_size=map_size)
+        with env.begin(write=True) as txn:
+            for filename, data in images:
+                txn.put(filename.encode('utf-8'), data)
+        env.close()
+    elif file_format == 'shard':
+        writer = ShardWriter(temp_path, shard_size=256 * 1024 ** 2)
+        for filename, data in images:
+            writer.writestr(filename, data)
+        writer.close()
+    else:
+        raise ValueError(f'Invalid file format: `{file_format}`!\n'
+                         f'Formats allowed: {list(_DATASET_NAMES)}.')
+    os.replace(temp_path, path)
+    return path
+
+
+class _BytesReader(object):
+    """Wraps bytes as a file object for `tarfile.TarFile.addfile()`."""
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.data) - self.offset
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return bytes(chunk)
+
+
+def profile_stages(data_loader, num_samples, batch_size):
+    """Profiles the per-stage time within the main process.
+
+    Returns:
+        A dictionary, mapping each stage to the average time in milliseconds.
+    """
+    dataset = data_loader.dataset
+    num_samples = min(num_samples, len(dataset.items))
+    stage_time = dict(fetch=0.0, decode=0.0, resize=0.0, normalize=0.0)
+    for idx in range(num_samples):
+        item = dataset.items[idx]
+        image_path = item[0] if dataset.use_label else item
+        start_time = time.perf_counter()
+        buffer = np.frombuffer(dataset.fetch_file(image_path), dtype=np.uint8)
+        stage_time['fetch'] += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        image = dataset.transforms['decode'](buffer)
+        stage_time['decode'] += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        image = dataset.transforms['resize'](image)
+        stage_time['resize'] += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        dataset.transforms['normalize'](image)
+        stage_time['normalize'] += time.perf_counter() - start_time
+    results = {f'{stage}_ms_per_sample': 1000 * val / num_samples
+               for stage, val in stage_time.items()}
+
+    samples = [dataset[idx % len(dataset)] for idx in range(batch_size)]
+    start_time = time.perf_counter()
+    batch_data = default_collate(samples)
+    results['collate_ms_per_batch'] = 1000 * (time.perf_counter() - start_time)
+    if torch.cuda.is_available():
+        start_time = time.perf_counter()
+        for val in batch_data.values():
+            val.cuda(non_blocking=False)
+        torch.cuda.synchronize()
+        results['transfer_ms_per_batch'] = (
+            1000 * (time.perf_counter() - start_time))
+    else:
+        results['transfer_ms_per_batch'] = None
+    return results
+
+
+def measure_throughput(data_loader, num_batches):
+    """Measures the throughput of the data loader.
+
+    Returns:
+        A dictionary, containing the time to get the first batch (in seconds),
+            the average time to get each of the following batches (in
+            milliseconds), and the throughput (in images/sec).
+    """
+    start_time = time.perf_counter()
+    next(data_loader)
+    first_batch_time = time.perf_counter() - start_time
+
+    num_images = 0
+    start_time = time.perf_counter()
+    for _ in range(num_batches):
+        batch_data = next(data_loader)
+        num_images += len(batch_data['image'])
+    elapsed_time = time.perf_counter() - start_time
+    return {
+        'first_batch_s': first_batch_time,
+        'ms_per_batch': 1000 * elapsed_time / num_batches,
+        'images_per_sec': num_images / elapsed_time
+    }
+
+
+def get_case_key(case):
+    """Gets the key identifying the settings of a benchmark case."""
+    return (case['file_format'], case['num_workers'], case['prefetch_factor'],
+            case['config'])
+
+
+def compare_with_baseline(cases, baseline_path, tolerance):
+    """Compares the throughput with the baseline report.
+
+    Returns:
+        A list of messages, each of which describes a regression.
+    """
+    with open(baseline_path, 'r') as f:
+        baseline = {get_case_key(case): case for case in json.load(f)['cases']}
+    regressions = []
+    for case in cases:
+        ref = baseline.get(get_case_key(case))
+        if ref is None:
+            continue
+        new_val = case['images_per_sec']
+        ref_val = ref['images_per_sec']
+        if new_val < ref_val * (1 - tolerance):
+            regressions.append(f'{get_case_key(case)}: {new_val:.1f} vs. '
+                               f'{ref_val:.1f} images/sec in baseline.')
+    return regressions
+
+
+def main():
+    """Main function."""
+    args = parse_args()
+    formats = [fmt.strip().lower() for fmt in args.formats.split(',')]
+    configs = [cfg.strip() for cfg in args.configs.split(',')]
+    for fmt in formats:
+        if fmt not in _DATASET_NAMES:
+            raise ValueError(f'Invalid file format: `{fmt}`!\n'
+                             f'Formats allowed: {list(_DATASET_NAMES)}.')
+    for cfg in configs:
+        if cfg not in _TRANSFORM_CONFIGS:
+            raise ValueError(f'Invalid transformation config: `{cfg}`!\n'
+                             f'Configs allowed: {list(_TRANSFORM_CONFIGS)}.')
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    data_dir = os.path.join(
+        args.work_dir, f'{args.num_images}x{args.image_size}_{args.codec}')
+    os.makedirs(data_dir, exist_ok=True)
+    images = None
+    dataset_paths = dict()
+    for fmt in formats:
+        path = os.path.join(data_dir, _DATASET_NAMES[fmt])
+        if not os.path.exists(path):
+            if images is None:
+                print(f'Generating {args.num_images} synthetic images ...')
+                images = make_synthetic_images(
+                    args.num_images, args.image_size, args.codec)
+            print(f'Saving synthetic dataset to `{path}` ...')
+        dataset_paths[fmt] = make_synthetic_dataset(path, fmt, images)
+    del images
+
+    cases = []
+    for fmt in formats:
+        for cfg in configs:
+            dataset_extra_kwargs, loader_extra_kwargs = _TRANSFORM_CONFIGS[cfg]
+            for num_workers in args.num_workers:
+                prefetch_factors = args.prefetch_factors if num_workers else [2]
+                for prefetch_factor in prefetch_factors:
+                    dataset_kwargs = dict(
+                        dataset_type='ImageDataset',
+                        root_dir=dataset_paths[fmt],
+                        file_format=fmt,
+                        mirror=False,
+                        transform_kwargs=dict(image_size=args.resolution),
+                        use_label=False,
+                        **dataset_extra_kwargs)
+                    data_loader_kwargs = dict(
+                        data_loader_type='iter',
+                        repeat=1,
+                        seed=0,
+                        num_workers=num_workers,
+                        prefetch_factor=prefetch_factor,
+                        pin_memory=torch.cuda.is_available(),
+                        **loader_extra_kwargs)
+                    data_loader = build_dataset(
+                        for_training=True,
+                        batch_size=args.batch_size,
+                        dataset_kwargs=dataset_kwargs,
+                        data_loader_kwargs=data_loader_kwargs)
+                    case = dict(file_format=fmt,
+                                num_workers=num_workers,
+                                prefetch_factor=prefetch_factor,
+                                config=cfg,
+                                batch_size=args.batch_size)
+                    case.update(profile_stages(data_loader,
+                                               args.num_profile_samples,
+                                               args.batch_size))
+                    case.update(measure_throughput(data_loader,
+                                                   args.num_batches))
+                    del data_loader
+                    cases.append(case)
+                    print(f'[{fmt:>5s}] config: {cfg:>13s}, '
+                          f'workers: {num_workers:2d}, '
+                          f'prefetch: {prefetch_factor:2d}, '
+                          f'{case["images_per_sec"]:9.1f} images/sec '
+                          f'(fetch {case["fetch_ms_per_sample"]:.2f} ms, '
+                          f'decode {case["decode_ms_per_sample"]:.2f} ms, '
+                          f'resize {case["resize_ms_per_sample"]:.2f} ms '
+                          f'per sample)')
+
+    report = dict(
+        environment=dict(platform=platform.platform(),
+                         python=platform.python_version(),
+                         torch=torch.__version__,
+                         opencv=cv2.__version__,
+                         cpu_count=os.cpu_count(),
+                         cuda=torch.cuda.is_available()),
+        settings=dict(num_images=args.num_images,
+                      image_size=args.image_size,
+                      codec=args.codec,
+                      resolution=args.resolution,
+                      batch_size=args.batch_size,
+                      num_batches=args.num_batches),
+        cases=cases)
+    report_path = args.report or os.path.join(args.work_dir, 'report.json')
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f'Report is saved to `{report_path}`.')
+
+    if args.baseline:
+        regressions = compare_with_baseline(cases, args.baseline,
+                                            args.tolerance)
+        if regressions:
+            print(f'Throughput regressions against `{args.baseline}`:')
+            for message in regressions:
+                print(f'    {message}')
+            sys.exit(1)
+        print(f'No throughput regression against `{args.baseline}`.')
+
+
+if __name__ == '__main__':
+    main()
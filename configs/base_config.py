@@ -301,6 +301,14 @@ class BaseConfig(object):
             cls.command_option(
                 '--batch_size', type=cls.int_type, default=1,
                 help='Batch size used for training on each replica.'),
+            cls.command_option(
+                '--batch_gpu', type=cls.int_type, default=0,
+                help='Micro-batch size forwarded at once on each replica. '
+                     'Each phase of the training step is split into '
+                     '`batch_size / batch_gpu` rounds with gradients '
+                     'accumulated, which trades throughput for memory. If '
+                     'not provided, it will be set the same as '
+                     '`batch_size`.'),
             cls.command_option(
                 '--val_batch_size', type=cls.int_type, default=0,
                 help='Batch size used for validation on each replica. If not '
@@ -384,6 +392,18 @@ class BaseConfig(object):
                 help='Times to repeat the data item list to save I/O time. '
                      'A too large number can be memory consuming. This field '
                      'only takes effect on the training dataset.'),
+            cls.command_option(
+                '--data_shard_size', type=cls.int_type, default=0,
+                help='Number of samples with contiguous indices in each shard '
+                     'for shard-aware sampling, where whole shards are '
+                     'assigned to replicas and reads are mostly sequential. '
+                     'This is useful for datasets on remote or slow storage. '
+                     '`0` means to sample across the entire dataset. This '
+                     'field only takes effect on the training dataset.'),
+            cls.command_option(
+                '--data_shuffle_buffer_size', type=cls.int_type, default=0,
+                help='Maximum displacement of each sample when shuffling in '
+                     'shard-aware sampling. `0` means to use the shard size.'),
             cls.command_option(
                 '--data_workers', type=cls.int_type, default=4,
                 help='Number of data workers on each replica.'),
@@ -396,12 +416,48 @@ class BaseConfig(object):
                      'this on can make it faster to move data from CPU to GPU, '
                      'but may require a high-performance computing system. '
                      'This field only takes effect when `data_loader_type` is '
-                     'set as `iter`.'),
+                     'set as `iter`. NOTE: With `data_shared_memory`, batches '
+                     'in the shared-memory ring are NOT pinned (only values '
+                     'outside the ring are), hence copying them to GPU is '
+                     'not asynchronous.'),
             cls.command_option(
                 '--data_threads', type=cls.int_type, default=4,
                 help='Number of threads on each replica for data preparation. '
                      'This field only takes effect when `data_loader_type` is '
-                     'set as `dali`.')
+                     'set as `dali`.'),
+            cls.command_option(
+                '--data_batch_transform', type=cls.bool_type, default=False,
+                help='Whether to execute data transformation at batch level, '
+                     'i.e., vectorizing the transformations across a batch of '
+                     'samples on CPU. This field only takes effect when '
+                     '`data_loader_type` is set as `iter`.'),
+            cls.command_option(
+                '--data_shared_memory', type=cls.bool_type, default=False,
+                help='Whether to transport batches from data workers through '
+                     'a ring of preallocated shared-memory slots, which saves '
+                     'the CPU time and memory of the main process. The ring '
+                     'reserves `data_device_prefetch + 2` slots for batches '
+                     'held by the runner. This field only takes effect when '
+                     '`data_loader_type` is set as `iter`.'),
+            cls.command_option(
+                '--data_drop_keys', type=str, default='',
+                help='Comma-separated output keys of the dataset to drop in '
+                     'data workers before transport, e.g., `raw_image`. This '
+                     'field only takes effect when `data_loader_type` is set '
+                     'as `iter`.'),
+            cls.command_option(
+                '--data_profile_transforms', type=cls.bool_type, default=False,
+                help='Whether to profile the latency of each stage of data '
+                     'pre-processing (e.g., fetching, decoding, resizing) '
+                     'inside data workers, which will be logged to the JSON '
+                     'Lines log and TensorBoard. This field only takes effect '
+                     'on the training dataset when `data_loader_type` is set '
+                     'as `iter`.'),
+            cls.command_option(
+                '--data_device_prefetch', type=cls.int_type, default=1,
+                help='Number of batches moved to GPU in advance on a side '
+                     'stream, overlapping the copy with the training step. '
+                     '`0` means to copy each batch right before using it.')
         ])
 
         options['Controller settings'].extend([
@@ -434,6 +490,23 @@ class BaseConfig(object):
             cls.command_option(
                 '--save_running_stats', type=cls.bool_type, default=False,
                 help='Whether to save the running stats.'),
+            cls.command_option(
+                '--ckpt_async', type=cls.bool_type, default=False,
+                help='Whether to write routine checkpoints in background. '
+                     'If enabled, training resumes right after the '
+                     'checkpoint is copied to CPU memory.'),
+            cls.command_option(
+                '--ckpt_skip_unchanged', type=cls.bool_type, default=True,
+                help='Whether to skip copying tensors which are unchanged '
+                     'since the last checkpoint (e.g., those of frozen '
+                     'models), detected by content checksum. This only '
+                     'takes effect with `--ckpt_async`.'),
+            cls.command_option(
+                '--ckpt_lazy_layout', type=cls.bool_type, default=False,
+                help='Whether to save checkpoints with the lazy layout, where '
+                     'each model/optimizer/etc. is a separate entry, such '
+                     'that loading can skip the components not requested. '
+                     'Checkpoints in both layouts can be loaded.'),
             cls.command_option(
                 '--eval_interval', type=cls.int_type, default=10000,
                 help='Default interval to execute evaluation, which can be '
@@ -481,13 +554,13 @@ class BaseConfig(object):
         """Gets options that are commonly used."""
         recommended_options = [
             'job_name', 'enable_amp', 'resume_path', 'weight_path', 'seed',
-            'batch_size', 'val_batch_size', 'data_loader_type', 'data_repeat',
-            'total_img', 'total_epochs', 'total_iters', 'train_dataset',
-            'train_anno_path', 'train_anno_meta', 'train_max_samples',
-            'train_data_mirror', 'val_dataset', 'val_anno_path',
-            'val_anno_meta', 'val_max_samples', 'val_data_mirror',
-            'log_interval', 'ckpt_interval', 'keep_ckpt_num', 'eval_interval',
-            'eval_at_start'
+            'batch_size', 'batch_gpu', 'val_batch_size', 'data_loader_type',
+            'data_repeat', 'total_img', 'total_epochs', 'total_iters',
+            'train_dataset', 'train_anno_path', 'train_anno_meta',
+            'train_max_samples', 'train_data_mirror', 'val_dataset',
+            'val_anno_path', 'val_anno_meta', 'val_max_samples',
+            'val_data_mirror', 'log_interval', 'ckpt_interval',
+            'keep_ckpt_num', 'eval_interval', 'eval_at_start'
         ]
         return recommended_options
 
@@ -580,6 +653,9 @@ class BaseConfig(object):
 
         self.config.seed = self.args.pop('seed')
         self.config.batch_size = self.args.pop('batch_size')
+        self.config.batch_gpu = self.args.pop('batch_gpu')
+        if self.config.batch_gpu <= 0:
+            self.config.batch_gpu = self.config.batch_size
         self.config.val_batch_size = self.args.pop('val_batch_size')
         if self.config.val_batch_size <= 0:
             self.config.val_batch_size = self.config.batch_size
@@ -592,6 +668,11 @@ class BaseConfig(object):
             self.args.pop('train_anno_path'))
         val_dataset = self.add_prefetch_file(self.args.pop('val_dataset'))
         val_anno_path = self.add_prefetch_file(self.args.pop('val_anno_path'))
+
+        # Batches held by the runner are the ones staged by the device
+        # prefetcher (`depth + 1`) plus `runner.batch_data`, which should not
+        # be overwritten by data workers with shared-memory transport.
+        device_prefetch_depth = self.args.pop('data_device_prefetch')
         self.config.data.update(
             train=dict(
                 dataset_type=None,
@@ -622,8 +703,18 @@ class BaseConfig(object):
                 num_workers=self.args.pop('data_workers'),
                 prefetch_factor=self.args.pop('data_prefetch_factor'),
                 pin_memory=self.args.pop('data_pin_memory'),
-                num_threads=self.args.pop('data_threads')
-            )
+                num_threads=self.args.pop('data_threads'),
+                batch_transform=self.args.pop('data_batch_transform'),
+                shard_size=self.args.pop('data_shard_size'),
+                shuffle_buffer_size=self.args.pop('data_shuffle_buffer_size'),
+                shared_memory=self.args.pop('data_shared_memory'),
+                hold_batches=max(device_prefetch_depth, 0) + 2,
+                drop_keys=[key.strip() for key in
+                           self.args.pop('data_drop_keys').split(',')
+                           if key.strip()],
+                profile_transforms=self.args.pop('data_profile_transforms')
+            ),
+            device_prefetch_depth=device_prefetch_depth
         )
 
         log_interval = self.args.pop('log_interval')
@@ -639,6 +730,9 @@ class BaseConfig(object):
         save_loss = self.args.pop('save_loss')
         save_augment = self.args.pop('save_augment')
         save_running_stats = self.args.pop('save_running_stats')
+        ckpt_async = self.args.pop('ckpt_async')
+        ckpt_skip_unchanged = self.args.pop('ckpt_skip_unchanged')
+        self.config.ckpt_lazy_layout = self.args.pop('ckpt_lazy_layout')
 
         if ckpt_interval > 0:
             self.config.controllers.update(
@@ -651,7 +745,9 @@ class BaseConfig(object):
                     save_learning_rate=save_learning_rate,
                     save_loss=save_loss,
                     save_augment=save_augment,
-                    save_running_stats=save_running_stats
+                    save_running_stats=save_running_stats,
+                    async_save=ckpt_async,
+                    skip_unchanged=ckpt_skip_unchanged
                 )
             )
 
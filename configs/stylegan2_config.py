@@ -48,7 +48,18 @@ To train a StyleGAN2 model, the recommended settings are as follows:
                 help='Minimum pixel value of the training images.'),
             cls.command_option(
                 '--max_val', type=cls.float_type, default=1.0,
-                help='Maximum pixel value of the training images.')
+                help='Maximum pixel value of the training images.'),
+            cls.command_option(
+                '--data_cache_dir', type=str, default=None,
+                help='Directory of the pre-decoded image cache. If provided, '
+                     'images are decoded and resized only once and then '
+                     'served from a memory-mapped cache. Please use '
+                     '`cache_dataset.py` to build the cache in advance.'),
+            cls.command_option(
+                '--data_decode_threads', type=cls.int_type, default=1,
+                help='Number of threads to decode the images of a batch '
+                     'within each data worker. This field only takes effect '
+                     'when `data_batch_transform` is switched on.')
         ])
 
         options['Network settings'].extend([
@@ -153,6 +164,11 @@ To train a StyleGAN2 model, the recommended settings are as follows:
                 '--g_ema_img', type=cls.int_type, default=10_000,
                 help='Factor for updating the smoothed generator, which is '
                      'particularly used for inference.'),
+            cls.command_option(
+                '--g_ema_interval', type=cls.int_type, default=1,
+                help='Interval (in iterations) to update the smoothed '
+                     'generator, where the moving average factor is corrected '
+                     'to cover all iterations in between.'),
             cls.command_option(
                 '--g_ema_rampup', type=cls.float_type, default=0.0,
                 help='Rampup factor for updating the smoothed generator, which '
@@ -163,6 +179,22 @@ To train a StyleGAN2 model, the recommended settings are as follows:
                 help='Whether to use adaptive augmentation pipeline.')
         ])
 
+        options['Metric settings'].extend([
+            cls.command_option(
+                '--fid_backend', type=str, default='scipy',
+                help='Backend to compute FID from feature statistics, among '
+                     '`scipy`, `numpy`, and `torch`. '
+                     '`scipy` (with `scipy.linalg.sqrtm()`) reproduces the '
+                     'numbers reported in previous logs and papers, while '
+                     '`numpy` and `torch` use a faster eigendecomposition '
+                     'solver.'),
+            cls.command_option(
+                '--check_fid_backend', type=cls.bool_type, default=False,
+                help='Whether to additionally compute FID with the `scipy` '
+                     'backend and log the deviation, which verifies the '
+                     'accuracy of other backends.')
+        ])
+
         return options
 
     @classmethod
@@ -183,6 +215,8 @@ To train a StyleGAN2 model, the recommended settings are as follows:
         image_channels = self.args.pop('image_channels')
         min_val = self.args.pop('min_val')
         max_val = self.args.pop('max_val')
+        data_cache_dir = self.args.pop('data_cache_dir')
+        data_decode_threads = self.args.pop('data_decode_threads')
 
         # Parse data transformation settings.
         data_transform_kwargs = dict(
@@ -195,6 +229,10 @@ To train a StyleGAN2 model, the recommended settings are as follows:
         self.config.data.train.transform_kwargs = data_transform_kwargs
         self.config.data.val.dataset_type = DATASET
         self.config.data.val.transform_kwargs = data_transform_kwargs
+        self.config.data.train.cache_dir = data_cache_dir
+        self.config.data.val.cache_dir = data_cache_dir
+        self.config.data.train.decode_threads = data_decode_threads
+        self.config.data.val.decode_threads = data_decode_threads
 
         g_init_res = self.args.pop('g_init_res')
         d_init_res = 4  # This should be fixed as 4.
@@ -286,6 +324,7 @@ To train a StyleGAN2 model, the recommended settings are as follows:
                                 fp16_res=None,
                                 impl=impl),
                 g_ema_img=self.args.pop('g_ema_img'),
+                g_ema_interval=self.args.pop('g_ema_interval'),
                 g_ema_rampup=self.args.pop('g_ema_rampup')
             )
         )
@@ -345,11 +384,15 @@ To train a StyleGAN2 model, the recommended settings are as follows:
                 )
             )
 
+        fid_backend = self.args.pop('fid_backend')
+        check_fid_backend = self.args.pop('check_fid_backend')
         self.config.metrics.update(
             FID50KFull=dict(
                 init_kwargs=dict(name='fid50k_full',
                                  latent_dim=latent_dim,
-                                 label_dim=label_dim),
+                                 label_dim=label_dim,
+                                 fid_backend=fid_backend,
+                                 check_fid_backend=check_fid_backend),
                 eval_kwargs=dict(
                     generator_smooth=dict(noise_mode='random',
                                           fused_modulate=False,
@@ -95,6 +95,9 @@ def build_dataset(for_training, batch_size, dataset_kwargs, data_loader_kwargs):
         data_loader_kwargs['repeat'] = 1
         data_loader_kwargs['shuffle'] = False
         data_loader_kwargs['drop_last_batch'] = False
+        # Metrics rely on the interleaved sample order across replicas.
+        data_loader_kwargs['shard_size'] = 0
+        data_loader_kwargs['profile_transforms'] = False
 
     return build_data_loader(data_loader_type=data_loader_type,
                              dataset=dataset,
@@ -10,12 +10,16 @@ transformation), such that the data received by the data loader can be directly
 grouped to batches and further used for training.
 
 NOTE: Dataset supports reading raw data from disk, parsing annotations, and
-pre-processing the raw data. But it merely handles one data item (instead of a
-batch) at one time.
+pre-processing the raw data. It typically handles one data item (instead of a
+batch) at one time, but can also pre-process a batch of items together, i.e.,
+`dataset[list_of_indices]`, which enables vectorization across the batch.
 """
 
 import os.path
 import json
+import time
+from collections.abc import Sequence
+import numpy as np
 
 from torch.utils.data import Dataset
 
@@ -23,6 +27,7 @@ from utils.misc import parse_file_format
 from .file_readers import build_file_reader
 from .transformations import build_transformation
 from .transformations.misc import switch_between
+from .transform_profiler import TransformProfiler
 
 __all__ = ['BaseDataset']
 
@@ -50,6 +55,13 @@ class BaseDataset(Dataset):
         individual transformation node in the transformation pipeline supports
         DALI. Please refer to `datasets/transformations/base_transformation.py`
         and `datasets/data_loaders/dali_pipeline.py` for more details.
+    (6) get_batch(): Get a batch of items (including pre-processing) from the
+        dataset, where the transformation pipeline is applied to stacked
+        arrays via `self.transform_batch()`. `__getitem__()` redirects to this
+        function when receiving a list of indices.
+    (7) enable_profiler(): Record the latency of fetching raw data, of each
+        transformation node, and of the entire item (or batch) inside data
+        workers. Please refer to `datasets/transform_profiler.py` for details.
 
     The derived class should contain the following methods:
 
@@ -73,10 +85,13 @@ class BaseDataset(Dataset):
     (3) transform(): Define the transformation pipeline to pre-process the raw
         data. The transformed data will be used for training.
         (requires implementation)
-    (4) parse_annotation_file(): Define how to parse item list from a given
+    (4) transform_batch(): Define the transformation pipeline to pre-process a
+        batch of raw data. (optional, the base class falls back to calling
+        `self.transform()` on each item and then stacking the results)
+    (5) parse_annotation_file(): Define how to parse item list from a given
         annotation file. (optional, can directly use the function provided by
         the base class)
-    (5) info(): Collect the information of the dataset. (optional, can directly
+    (6) info(): Collect the information of the dataset. (optional, can directly
         use the function provided by the base class)
 
     More concretely, each dataset class is initialized with `transform_kwargs`,
@@ -102,9 +117,9 @@ class BaseDataset(Dataset):
         Args:
             root_dir: Root directory (or file path) containing the dataset.
             file_format: Format under which the dataset is stored. Supports
-                `dir`, `lmdb`, `tar`, and `zip`. If not specified, the file
-                format will be parsed automatically according to the filename of
-                `root_dir`. (default: None)
+                `dir`, `lmdb`, `shard`, `tar`, and `zip`. If not specified, the
+                file format will be parsed automatically according to the
+                filename of `root_dir`. (default: None)
             annotation_path: A path to the annotation file. If set to `None`,
                 dataset will turn to `annotation_meta` to parse item list.
                 (default: None)
@@ -164,13 +179,18 @@ class BaseDataset(Dataset):
             fp = None
 
         self.annotation_format = annotation_format
+        start_time = time.time()
         if fp is not None:  # Use external annotation if available.
             self.items = self.parse_annotation_file(fp)
             fp.close()
         else:  # Fallback: use image list provided by `self.reader`.
             self.items = self.reader.get_image_list(root_dir)
+        # Time spent on opening the file reader and listing the items.
+        self.open_time = time.time() - start_time
 
-        assert isinstance(self.items, list) and len(self.items) > 0
+        # NOTE: Some readers return a lazily loaded sequence instead of a list,
+        # e.g., `LmdbKeyIndex` from `LmdbReader`.
+        assert isinstance(self.items, Sequence) and len(self.items) > 0
         self.dataset_samples = len(self.items)
         self.num_samples = self.dataset_samples
 
@@ -192,6 +212,9 @@ class BaseDataset(Dataset):
         self.parse_transform_config()
         self.build_transformations()
 
+        # Profiler of data pre-processing, disabled by default.
+        self.profiler = None
+
     def __del__(self):
         """Destroys the dataset, particularly closes the file reader."""
         self.reader.close(self.root_dir)
@@ -230,6 +253,27 @@ class BaseDataset(Dataset):
             trans.has_customized_function_for_dali
             for trans in self.transforms.values())
 
+    def enable_profiler(self, num_workers=0):
+        """Enables profiling the latency of data pre-processing.
+
+        Stages include `fetch` (i.e., `self.get_raw_data()`), each node within
+        `self.transforms`, and `total` (i.e., the entire `self.__getitem__()`).
+
+        NOTE: This function should be called before data workers start, since
+        the histograms are allocated in shared memory.
+
+        Args:
+            num_workers: Number of data workers. (default: 0)
+
+        Returns:
+            The `TransformProfiler`.
+        """
+        stages = ['fetch', *self.transforms, 'total']
+        self.profiler = TransformProfiler(stages, num_slots=num_workers + 1)
+        for name, trans in self.transforms.items():
+            trans.set_profiler(self.profiler, name)
+        return self.profiler
+
     def mirror_aug(self, data, do_mirror, use_dali=False):
         """Mirrors (i.e., horizontal flips) the data to double the dataset.
 
@@ -245,6 +289,22 @@ class BaseDataset(Dataset):
                               cond_false=data,
                               use_dali=use_dali)
 
+    def mirror_aug_batch(self, data, do_mirror):
+        """Mirrors a batch of data, i.e., the batched version of `mirror_aug()`.
+
+        Args:
+            data: The data to mirror, with shape [N, ...].
+            do_mirror: A boolean array with shape [N], indicating whether each
+                sample should be mirrored.
+        """
+        do_mirror = np.asarray(do_mirror, dtype=bool).reshape(-1)
+        if not do_mirror.any():
+            return data
+        data = data.copy()
+        data[do_mirror] = self.transforms['_mirror'](data[do_mirror],
+                                                     is_batch=True)
+        return data
+
     def __getitem__(self, idx):
         """Gets a particular sample (with label if needed).
 
@@ -252,16 +312,47 @@ class BaseDataset(Dataset):
 
         Args:
             idx: Index of the item within the item list maintained by the
-                dataset.
+                dataset. If a list of indices is given, a batch of items will
+                be returned. See `self.get_batch()` for details.
 
         Returns:
             A processed data item, which is a dictionary with `self.num_outputs`
                 key-value pairs and with `self.output_keys` as the keys.
         """
+        if isinstance(idx, (list, tuple)):
+            return self.get_batch(idx)
+        start_time = time.perf_counter()
         raw_data = self.get_raw_data(idx)
+        if self.profiler is not None:
+            self.profiler.record('fetch', time.perf_counter() - start_time)
         transformed_data = self.transform(raw_data, use_dali=False)
         assert isinstance(transformed_data, (list, tuple))
         assert len(transformed_data) == len(self.output_keys), 'Wrong keys!'
+        if self.profiler is not None:
+            self.profiler.record('total', time.perf_counter() - start_time)
+        return dict(zip(self.output_keys, transformed_data))
+
+    def get_batch(self, indices):
+        """Gets a batch of samples, which are pre-processed together.
+
+        Args:
+            indices: A list of indices of the items within the item list
+                maintained by the dataset.
+
+        Returns:
+            A processed batch, which is a dictionary with `self.num_outputs`
+                key-value pairs and with `self.output_keys` as the keys. Each
+                value is stacked along the first dimension.
+        """
+        start_time = time.perf_counter()
+        raw_data = [self.get_raw_data(idx) for idx in indices]
+        if self.profiler is not None:
+            self.profiler.record('fetch', time.perf_counter() - start_time)
+        transformed_data = self.transform_batch(raw_data)
+        assert isinstance(transformed_data, (list, tuple))
+        assert len(transformed_data) == len(self.output_keys), 'Wrong keys!'
+        if self.profiler is not None:
+            self.profiler.record('total', time.perf_counter() - start_time)
         return dict(zip(self.output_keys, transformed_data))
 
     def define_dali_graph(self, raw_data):
@@ -331,6 +422,24 @@ class BaseDataset(Dataset):
         """
         raise NotImplementedError('Should be implemented in derived class!')
 
+    def transform_batch(self, raw_data):
+        """Applies data transformation to a batch of raw data.
+
+        The base class applies `self.transform()` to each item and then stacks
+        the results. Please override this function in derived class with
+        `BaseTransformation.__call__(..., is_batch=True)` for vectorization.
+
+        Args:
+            raw_data: A list of raw data, each of which is fetched by
+                `self.get_raw_data()`.
+
+        Returns:
+            A list of transformed elements, each of which stacks all items
+                along the first dimension.
+        """
+        outputs = [self.transform(item, use_dali=False) for item in raw_data]
+        return [np.stack(x, axis=0) for x in zip(*outputs)]
+
     @property
     def output_keys(self):
         """Returns the name of each output within a pre-processed item.
@@ -388,12 +497,14 @@ class BaseDataset(Dataset):
             'Annotation meta': self.annotation_meta,
             'Annotation format': self.annotation_format,
             'Num samples in dataset': self.dataset_samples,
+            'Time to open and list items (s)': f'{self.open_time:.3f}',
             'Num samples to use (non-positive means all)': self.max_samples,
             'Mirror': self.mirror,
             'Actual num samples used (after mirror)': self.num_samples,
             'Support DALI': self.support_dali,
             'Has customized function for DALI forwarding':
                 self.has_customized_function_for_dali,
+            'Profile pre-processing': self.profiler is not None,
             'Transformation kwargs': '{' + ', '.join([
                 f'{k}: {v}' for k, v in self.transform_kwargs.items()]) + '}'
         }
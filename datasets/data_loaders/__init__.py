@@ -4,6 +4,7 @@
 import warnings
 
 from .iter_data_loader import IterDataLoader
+from .shared_memory_batch import SHARED_MEMORY_HOLD_BATCHES
 try:
     from .dali_data_loader import DALIDataLoader
 except ImportError:
@@ -25,7 +26,14 @@ def build_data_loader(data_loader_type,
                       num_workers=0,
                       prefetch_factor=2,
                       pin_memory=False,
-                      num_threads=1):
+                      num_threads=1,
+                      batch_transform=False,
+                      shard_size=0,
+                      shuffle_buffer_size=0,
+                      shared_memory=False,
+                      hold_batches=SHARED_MEMORY_HOLD_BATCHES,
+                      drop_keys=None,
+                      profile_transforms=False):
     """Builds a data loader with given dataset.
 
     Args:
@@ -50,6 +58,31 @@ def build_data_loader(data_loader_type,
             particularly used for `IterDataLoader`. (default: False)
         num_threads: Number of threads for each replica. This field is
             particularly used for `DALIDataLoader`. (default: 1)
+        batch_transform: Whether to execute data transformation at batch level,
+            i.e., vectorizing the transformations across a batch of samples.
+            This field is particularly used for `IterDataLoader`.
+            (default: False)
+        shard_size: Number of samples with contiguous indices in each shard. If
+            positive, the sampler assigns whole shards to replicas and only
+            shuffles within a bounded buffer, which makes reads mostly
+            sequential. Please refer to
+            `datasets/data_loaders/distributed_sampler.py` for details.
+            (default: 0)
+        shuffle_buffer_size: Maximum displacement of each index when shuffling
+            in the shard-aware mode. `0` means to use `shard_size`.
+            (default: 0)
+        shared_memory: Whether to transport batches from workers through a ring
+            of preallocated shared-memory slots. This field is particularly
+            used for `IterDataLoader`. (default: False)
+        hold_batches: Number of batches that may be held by the consumer at
+            the same time, for which the shared-memory ring reserves slots.
+            This field is particularly used for `IterDataLoader`.
+            (default: `SHARED_MEMORY_HOLD_BATCHES`)
+        drop_keys: Output keys of the dataset to drop before transport. This
+            field is particularly used for `IterDataLoader`. (default: None)
+        profile_transforms: Whether to profile the latency of each stage of
+            data pre-processing. This field is particularly used for
+            `IterDataLoader`. (default: False)
 
     Raises:
         ValueError: If `data_loader_type` is not supported.
@@ -80,7 +113,14 @@ def build_data_loader(data_loader_type,
                               drop_last_batch=drop_last_batch,
                               num_workers=num_workers,
                               prefetch_factor=prefetch_factor,
-                              pin_memory=pin_memory)
+                              pin_memory=pin_memory,
+                              batch_transform=batch_transform,
+                              shard_size=shard_size,
+                              shuffle_buffer_size=shuffle_buffer_size,
+                              shared_memory=shared_memory,
+                              hold_batches=hold_batches,
+                              drop_keys=drop_keys,
+                              profile_transforms=profile_transforms)
     if data_loader_type == 'dali':
         return DALIDataLoader(dataset=dataset,
                               batch_size=batch_size,
@@ -91,6 +131,8 @@ def build_data_loader(data_loader_type,
                               drop_last_batch=drop_last_batch,
                               num_workers=num_workers,
                               prefetch_factor=prefetch_factor,
-                              num_threads=num_threads)
+                              num_threads=num_threads,
+                              shard_size=shard_size,
+                              shuffle_buffer_size=shuffle_buffer_size)
     raise NotImplementedError(f'Not implemented data loader type '
                               f'`{data_loader_type}`!')
@@ -64,6 +64,10 @@ class BaseDataLoader(object):
     (3) seed: Random seed used for shuffling. (default: 0)
     (4) drop_last_sample: Whether to drop the tailing samples that cannot be
         evenly distributed. (default: False)
+    (5) shard_size: Number of samples in each shard for shard-aware sampling.
+        `0` means to sample across the entire dataset. (default: 0)
+    (6) shuffle_buffer_size: Maximum displacement of each index when shuffling
+        in shard-aware sampling. (default: 0)
 
     Additional settings:
 
@@ -85,7 +89,9 @@ class BaseDataLoader(object):
                  drop_last_sample=False,
                  drop_last_batch=True,
                  num_workers=0,
-                 prefetch_factor=2):
+                 prefetch_factor=2,
+                 shard_size=0,
+                 shuffle_buffer_size=0):
         """Initializes the data loader."""
         self._dataset = dataset
         self._batch_size = batch_size
@@ -94,6 +100,8 @@ class BaseDataLoader(object):
         self.shuffle = shuffle
         self.seed = seed
         self.drop_last_sample = drop_last_sample
+        self.shard_size = shard_size
+        self.shuffle_buffer_size = shuffle_buffer_size
 
         self.drop_last_batch = drop_last_batch
         self.num_workers = num_workers
@@ -101,6 +109,10 @@ class BaseDataLoader(object):
 
         self._sampler = None
         self._iter_loader = None
+        # Number of batches consumed from the current pass, and number of
+        # indices skipped at the beginning of the current pass (when resumed).
+        self._num_consumed_batches = 0
+        self._pass_offset = 0
         self.build()
 
     @property
@@ -133,7 +145,10 @@ class BaseDataLoader(object):
             data = next(self._iter_loader)
         except StopIteration:
             self.reset_iter_loader()
+            self._num_consumed_batches = 0
+            self._pass_offset = 0
             data = next(self._iter_loader)
+        self._num_consumed_batches += 1
         return data
 
     def reset_batch_size(self, batch_size=None):
@@ -27,6 +27,8 @@ class DALIDataLoader(BaseDataLoader):
                  drop_last_batch=True,
                  num_workers=0,
                  prefetch_factor=2,
+                 shard_size=0,
+                 shuffle_buffer_size=0,
                  num_threads=1):
         """Initializes the data loader.
 
@@ -43,7 +45,9 @@ class DALIDataLoader(BaseDataLoader):
                          drop_last_sample=drop_last_sample,
                          drop_last_batch=drop_last_batch,
                          num_workers=num_workers,
-                         prefetch_factor=prefetch_factor)
+                         prefetch_factor=prefetch_factor,
+                         shard_size=shard_size,
+                         shuffle_buffer_size=shuffle_buffer_size)
 
     def __len__(self):
         return len(self.iter_loader)
@@ -55,7 +59,9 @@ class DALIDataLoader(BaseDataLoader):
             repeat=self.repeat,
             seed=self.seed,
             drop_last_sample=self.drop_last_sample,
-            for_dali=True)
+            for_dali=True,
+            shard_size=self.shard_size,
+            shuffle_buffer_size=self.shuffle_buffer_size)
         prefetch_queue_depth = max(1, self.num_workers * self.prefetch_factor)
         self._pipeline = DALIPipeline(dataset=self._dataset,
                                       sampler=self._sampler,
@@ -18,8 +18,22 @@ NOTE: The number of repeat times should NOT be very large, especially when there
 are too many samples in the dataset. We recommend to set `repeat = 500` for
 datasets with ~50K samples. If the dataset is mirrored, i.e., with
 `dataset.mirror = True`, the repeat times should be halved accordingly.
+
+For datasets on remote or slow storage, random access across the entire archive
+is expensive. In this case, please use the shard-aware mode with `shard_size`,
+which splits the dataset into shards of contiguous indices. Within each
+repeated epoch, the shard order is shuffled, and whole shards are assigned to
+replicas (in a balanced manner), such that each replica only touches a subset of
+the archive. Then, the indices of each replica are shuffled within a bounded
+window of `shuffle_buffer_size`, i.e., each index is displaced by at most
+`shuffle_buffer_size` positions. Hence, reads are mostly sequential within a
+few shards at any time. Batches are dispatched to data workers in turn, hence
+all workers of a replica read from the same few shards as well.
 """
 
+import bisect
+import heapq
+
 import torch
 import torch.distributed as dist
 
@@ -37,6 +51,9 @@ class DistributedSampler(torch.utils.data.Sampler):
     (4) Distribute the indices to multiple replicas, and drop the last if
         needed.
 
+    NOTE: The indices are generated lazily for each repeated epoch and yielded
+    one by one, without materializing the repeated list.
+
     NOTE: This class can also be used as the starting node of the data
     pre-processing graph in DALI. Instead of using function `__iter__()` (as in
     `torch.utils.data.DataLoader`), DALI will use function `__call__()` to get a
@@ -57,6 +74,11 @@ class DistributedSampler(torch.utils.data.Sampler):
         for_dali: Whether the sampler is for DALI or not. This field is
             particularly used to disable the function `__iter__()` to make DALI
             work properly. (default: False)
+        shard_size: Number of samples with contiguous indices in each shard.
+            Positive values enable the shard-aware mode. (default: 0)
+        shuffle_buffer_size: Maximum displacement of each index when
+            shuffling within a replica in the shard-aware mode. If not
+            positive, `shard_size` will be used. (default: 0)
     """
 
     def __init__(self,
@@ -65,7 +87,9 @@ class DistributedSampler(torch.utils.data.Sampler):
                  shuffle=True,
                  seed=0,
                  drop_last_sample=False,
-                 for_dali=False):
+                 for_dali=False,
+                 shard_size=0,
+                 shuffle_buffer_size=0):
         super().__init__(None)
 
         self._dataset = dataset
@@ -74,11 +98,20 @@ class DistributedSampler(torch.utils.data.Sampler):
         self.seed = max(0, seed)
         self.drop_last_sample = drop_last_sample
         self.for_dali = for_dali
+        self.shard_size = max(0, int(shard_size))
+        self.shuffle_buffer_size = max(0, int(shuffle_buffer_size))
+        if self.shuffle_buffer_size == 0:
+            self.shuffle_buffer_size = self.shard_size
 
         self.world_size = dist.get_world_size()
         self.rank = dist.get_rank()
 
         self.dataset_length = len(self.dataset)
+        if self.shard_size > 0:
+            num_shards = (self.dataset_length - 1) // self.shard_size + 1
+            assert num_shards >= self.world_size, (
+                f'Only {num_shards} shards with shard size {self.shard_size}, '
+                f'fewer than {self.world_size} replicas!')
         self.actual_length = self.dataset_length * self.repeat
 
         if self.drop_last_sample:
@@ -88,8 +121,18 @@ class DistributedSampler(torch.utils.data.Sampler):
                 (self.actual_length - 1) // self.world_size + 1)
         self.num_all_replicas = self.num_per_replica * self.world_size
 
+        # Indices are stored in int32 if possible, which halves the memory.
+        if self.dataset_length <= torch.iinfo(torch.int32).max:
+            self.index_dtype = torch.int32
+        else:
+            self.index_dtype = torch.int64
+
         self.shuffle_times = 0  # How many times the dataset has been shuffled.
-        self.indices = []
+        self.base_shuffle_times = 0  # Shuffle times at the current pass.
+        self.block_bounds = [0]  # Index range of the current replica per block.
+        self.block_sources = []  # Repeated epoch from which each block comes.
+        self._cached_block = (None, None)
+        self._resume_offset = 0  # Indices to skip at the next pass.
         if self.for_dali:
             self.generate_indices()
 
@@ -104,6 +147,9 @@ class DistributedSampler(torch.utils.data.Sampler):
             'Num samples for all replicas': self.num_all_replicas,
             'Num sampler pre replica': self.num_per_replica
         }
+        if self.shard_size > 0:
+            sampler_info['Shard size'] = self.shard_size
+            sampler_info['Shuffle buffer size'] = self.shuffle_buffer_size
         return sampler_info
 
     @property
@@ -115,32 +161,202 @@ class DistributedSampler(torch.utils.data.Sampler):
         return self.num_per_replica
 
     def generate_indices(self):
-        """Generates all the indices handled by the current replica."""
-        indices = []
+        """Prepares the indices handled by the current replica for a new pass.
+
+        Indices are NOT materialized here. Instead, they are generated lazily
+        for each repeated epoch (i.e., block) by `self.get_block()`, hence the
+        memory does not scale with `repeat`. This function only records the
+        shuffle state and the number of indices from each block.
+        """
+        self.base_shuffle_times = self.shuffle_times
+        if self.shuffle:
+            self.shuffle_times += self.repeat
+        self._cached_block = (None, None)
+
+        if self.shard_size > 0:
+            self._plan_shards()
+            return
+
+        # The i-th index of the current replica comes from the global position
+        # `rank + i * world_size`, where the `b`-th block covers the global
+        # positions `[b * dataset_length, (b + 1) * dataset_length)`. Blocks
+        # beyond `repeat` pad the global list with its initial positions.
+        num_pads = self.num_all_replicas - self.actual_length
+        num_blocks = self.repeat + max(0, -(-num_pads // self.dataset_length))
+        bounds = []
+        for block in range(num_blocks):
+            start = block * self.dataset_length - self.rank
+            start = -(-start // self.world_size)  # Ceiling division.
+            bounds.append(min(max(start, 0), self.num_per_replica))
+        bounds.append(self.num_per_replica)
+        self.block_bounds = bounds
+        self.block_sources = [block % self.repeat
+                              for block in range(num_blocks)]
+
+    def _plan_shards(self):
+        """Assigns shards to replicas for all repeated epochs.
+
+        Only the shard IDs of the current replica are kept, which is much
+        more compact than the indices. The shard assignment is computed on all
+        replicas in the same way, and only depends on `seed` and
+        `shuffle_times`. Hence, it is reproducible, and different replicas
+        never share shards within the same repeated epoch.
+        """
+        num_shards = (self.dataset_length - 1) // self.shard_size + 1
+        loads = [(0, rank) for rank in range(self.world_size)]
+        self.shard_plan = []
+        counts = []
         g = torch.Generator()
-        for _ in range(self.repeat):  # Repeat the dataset.
+        for block in range(self.repeat):  # Repeat the dataset.
             if self.shuffle:
-                g.manual_seed(self.seed + self.shuffle_times)
-                self.shuffle_times += 1
-                sub_indices = torch.randperm(self.dataset_length, generator=g)
+                g.manual_seed(self.seed + self.base_shuffle_times + block)
+                shard_order = torch.randperm(num_shards, generator=g).tolist()
             else:
-                sub_indices = torch.arange(self.dataset_length)
-            indices.extend(sub_indices.tolist())
+                shard_order = list(range(num_shards))
+            # Assign each shard to the replica with the fewest samples so far,
+            # with ties broken by rank.
+            heapq.heapify(loads)
+            shards = []
+            count = 0
+            for shard_idx in shard_order:
+                num, rank = heapq.heappop(loads)
+                start = shard_idx * self.shard_size
+                end = min(start + self.shard_size, self.dataset_length)
+                if rank == self.rank:
+                    shards.append(shard_idx)
+                    count += end - start
+                heapq.heappush(loads, (num + end - start, rank))
+            self.shard_plan.append(torch.as_tensor(shards, dtype=torch.int32))
+            counts.append(count)
 
-        if self.drop_last_sample:
-            indices = indices[:self.num_all_replicas]
+        # Even up the number of indices across replicas, by truncating, or by
+        # padding with the indices from the beginning.
+        bounds = [0]
+        self.block_sources = []
+        while bounds[-1] < self.num_per_replica:
+            block = len(self.block_sources) % self.repeat
+            bounds.append(min(bounds[-1] + counts[block],
+                              self.num_per_replica))
+            self.block_sources.append(block)
+        self.block_bounds = bounds
+
+    def _get_permutation(self, block):
+        """Gets the index permutation of the `block`-th repeated epoch."""
+        if self.shuffle:
+            g = torch.Generator()
+            g.manual_seed(self.seed + self.base_shuffle_times + block)
+            indices = torch.randperm(self.dataset_length, generator=g)
         else:
-            indices += indices[:(self.num_all_replicas - len(indices))]
-        assert len(indices) == self.num_all_replicas
+            indices = torch.arange(self.dataset_length)
+        return indices.to(self.index_dtype)
+
+    def _get_shard_indices(self, block):
+        """Gets the indices from the shards assigned to the current replica."""
+        shard_plan = self.shard_plan[block].tolist()
+        if not shard_plan:
+            # The balanced assignment may leave no shard to the current
+            # replica within a repeated epoch.
+            return torch.zeros(0, dtype=self.index_dtype)
+        indices = torch.cat([
+            torch.arange(shard_idx * self.shard_size,
+                         min((shard_idx + 1) * self.shard_size,
+                             self.dataset_length),
+                         dtype=self.index_dtype)
+            for shard_idx in shard_plan
+        ])
+        if self.shuffle and self.shuffle_buffer_size > 1:
+            # Bounded shuffle: sort by the position jittered within the buffer.
+            g = torch.Generator()
+            g.manual_seed((self.seed + self.base_shuffle_times + block) *
+                          self.world_size + self.rank)
+            keys = torch.arange(len(indices), dtype=torch.float64)
+            keys += torch.rand(len(indices), generator=g,
+                               dtype=torch.float64) * self.shuffle_buffer_size
+            indices = indices[torch.argsort(keys)]
+        return indices
+
+    def get_block(self, block):
+        """Gets the indices of the current replica from the `block`-th block.
 
-        # Sub-sampling for the current replica.
-        self.indices = indices[self.rank:self.num_all_replicas:self.world_size]
+        The last generated block is cached, since consecutive requests usually
+        fall into the same block.
+
+        Returns:
+            A compact `torch.Tensor` with dtype `self.index_dtype`.
+        """
+        if self._cached_block[0] == block:
+            return self._cached_block[1]
+        start = self.block_bounds[block]
+        count = self.block_bounds[block + 1] - start
+        source = self.block_sources[block]
+        if self.shard_size > 0:
+            indices = self._get_shard_indices(source)[:count]
+        else:
+            first = (self.rank + start * self.world_size -
+                     block * self.dataset_length)
+            indices = self._get_permutation(source)[
+                first:first + count * self.world_size:self.world_size]
+        assert len(indices) == count
+        self._cached_block = (block, indices)
+        return indices
+
+    def get_index(self, idx):
+        """Gets the `idx`-th index handled by the current replica."""
+        if idx < 0 or idx >= self.num_per_replica:
+            raise IndexError('Sampler index out of range!')
+        block = bisect.bisect_right(self.block_bounds, idx) - 1
+        return int(self.get_block(block)[idx - self.block_bounds[block]])
+
+    def iter_indices(self, start=0):
+        """Yields the indices handled by the current replica block by block.
+
+        Args:
+            start: Number of indices to skip from the beginning. Skipped blocks
+                are not even generated. (default: 0)
+        """
+        if start >= self.num_per_replica:
+            return
+        first_block = bisect.bisect_right(self.block_bounds, start) - 1
+        for block in range(first_block, len(self.block_sources)):
+            indices = self.get_block(block)
+            if block == first_block:
+                indices = indices[start - self.block_bounds[block]:]
+            yield from indices.tolist()
 
     def __iter__(self):
         if self.for_dali:
             raise TypeError('Sampler for DALI is not iterable.')
         self.generate_indices()
-        return iter(self.indices)
+        start, self._resume_offset = self._resume_offset, 0
+        return self.iter_indices(start)
+
+    def state_dict(self, num_consumed=0):
+        """Gets the state of the sampler for resuming.
+
+        Args:
+            num_consumed: Number of indices already consumed from the current
+                pass. (default: 0)
+
+        Returns:
+            A dictionary, which is independent of the replica rank.
+        """
+        return {
+            'seed': self.seed,
+            'shuffle_times': self.base_shuffle_times,
+            'num_consumed': int(num_consumed)
+        }
+
+    def load_state_dict(self, state_dict):
+        """Loads the state, which takes effect from the next pass.
+
+        The next pass re-generates the indices of the saved pass, and
+        fast-forwards over the consumed indices without fetching any data.
+        NOTE: The saved seed overrides the current one to continue the same
+        index stream.
+        """
+        self.seed = state_dict['seed']
+        self.shuffle_times = state_dict['shuffle_times']
+        self._resume_offset = state_dict['num_consumed']
 
     def __call__(self, info):
         """This function is for fetching raw data for DALI pipeline.
@@ -149,7 +365,7 @@ class DistributedSampler(torch.utils.data.Sampler):
         within the current epoch.
         """
         try:
-            return self.dataset.get_raw_data(self.indices[info.idx_in_epoch])
+            return self.dataset.get_raw_data(self.get_index(info.idx_in_epoch))
         except IndexError:
             self.generate_indices()
             raise StopIteration  # pylint: disable=raise-missing-from
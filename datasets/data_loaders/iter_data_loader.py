@@ -1,14 +1,37 @@
 # python3.7
 """Contains the class of iteration-based data loader."""
 
+from torch.utils.data import BatchSampler
 from torch.utils.data import DataLoader
+from torch.utils.data._utils.collate import default_collate
+from torch.utils.data._utils.collate import default_convert
 
 from .distributed_sampler import DistributedSampler
+from .shared_memory_batch import SHARED_MEMORY_HOLD_BATCHES
+from .shared_memory_batch import SharedMemoryBatchRing
+from .shared_memory_batch import SlotBatchSampler
+from .shared_memory_batch import SlotBatchDataset
 from .base_data_loader import BaseDataLoader
 
 __all__ = ['IterDataLoader']
 
 
+class _DropKeysCollate(object):
+    """Drops some keys of the samples (or the batch) before collating."""
+
+    def __init__(self, drop_keys, is_batch=False):
+        self.drop_keys = set(drop_keys)
+        self.is_batch = is_batch
+
+    def _drop(self, data):
+        return {k: v for k, v in data.items() if k not in self.drop_keys}
+
+    def __call__(self, data):
+        if self.is_batch:
+            return default_convert(self._drop(data))
+        return default_collate([self._drop(sample) for sample in data])
+
+
 class IterDataLoader(BaseDataLoader):
     """Defines the iteration-based data loader."""
 
@@ -22,16 +45,60 @@ class IterDataLoader(BaseDataLoader):
                  drop_last_batch=True,
                  num_workers=0,
                  prefetch_factor=2,
-                 pin_memory=False):
+                 shard_size=0,
+                 shuffle_buffer_size=0,
+                 pin_memory=False,
+                 batch_transform=False,
+                 shared_memory=False,
+                 hold_batches=SHARED_MEMORY_HOLD_BATCHES,
+                 drop_keys=None,
+                 profile_transforms=False):
         """Initializes the data loader.
 
         Args:
             pin_memory: Whether to use pinned memory for loaded data. If `True`,
                 it will be faster to move data from CPU to GPU, however, it may
                 require a high-performance computing system. (default: False)
+            batch_transform: Whether to execute data transformation at batch
+                level. If `True`, each worker fetches a whole batch of indices
+                and pre-processes them together with `dataset.get_batch()`,
+                which vectorizes the transformations across samples. In this
+                case, `prefetch_factor` counts batches instead of samples.
+                (default: False)
+            shared_memory: Whether to transport batches from workers through a
+                ring of preallocated shared-memory slots, which are filled by
+                workers in place and consumed by the main process without copy.
+                In this case, each batch is only valid until `hold_batches`
+                more batches are fetched. Please refer to
+                `datasets/data_loaders/shared_memory_batch.py` for details.
+                This field only takes effect if `num_workers > 0`.
+                (default: False)
+            hold_batches: Number of batches that may be held by the consumer
+                at the same time (e.g., the one being used plus those staged by
+                the device prefetcher), for which the shared-memory ring
+                reserves slots on top of `num_workers * prefetch_factor`.
+                (default: `SHARED_MEMORY_HOLD_BATCHES`)
+            drop_keys: Output keys of the dataset to drop in workers, which
+                saves the transport of unused values (e.g., `raw_image`).
+                (default: None)
+            profile_transforms: Whether to profile the latency of each stage of
+                data pre-processing inside workers. The results can be fetched
+                from `self.dataset.profiler`. (default: False)
         """
         self.pin_memory = pin_memory
+        self.batch_transform = batch_transform
+        self.shared_memory = shared_memory and num_workers > 0
+        self.hold_batches = max(int(hold_batches), 1)
+        self.drop_keys = list(drop_keys or [])
+        for key in self.drop_keys:
+            if key not in dataset.output_keys:
+                raise ValueError(f'Invalid key to drop: `{key}`!\n'
+                                 f'Keys allowed: {dataset.output_keys}.')
         self._batch_grouper = None
+        self._ring = None
+        # The profiler should be set up before workers start.
+        if profile_transforms and dataset.profiler is None:
+            dataset.enable_profiler(num_workers=num_workers)
         super().__init__(dataset=dataset,
                          batch_size=batch_size,
                          repeat=repeat,
@@ -40,11 +107,24 @@ class IterDataLoader(BaseDataLoader):
                          drop_last_sample=drop_last_sample,
                          drop_last_batch=drop_last_batch,
                          num_workers=num_workers,
-                         prefetch_factor=prefetch_factor)
+                         prefetch_factor=prefetch_factor,
+                         shard_size=shard_size,
+                         shuffle_buffer_size=shuffle_buffer_size)
 
     def __len__(self):
         return len(self._batch_grouper)
 
+    def __next__(self):
+        data = super().__next__()
+        if not self.shared_memory:
+            return data
+        slot, size, others = data
+        keys = [key for key in self._dataset.output_keys
+                if key not in self.drop_keys]
+        batch_data = self._ring.read(slot, size, keys)
+        batch_data.update(others)
+        return {key: batch_data[key] for key in keys}
+
     def build(self):
         self._sampler = DistributedSampler(
             dataset=self._dataset,
@@ -52,21 +132,115 @@ class IterDataLoader(BaseDataLoader):
             shuffle=self.shuffle,
             seed=self.seed,
             drop_last_sample=self.drop_last_sample,
-            for_dali=False)
+            for_dali=False,
+            shard_size=self.shard_size,
+            shuffle_buffer_size=self.shuffle_buffer_size)
+        if self.shared_memory:
+            self._build_shared_memory_loader()
+            return
+        if self.drop_keys:
+            collate_fn = _DropKeysCollate(self.drop_keys,
+                                          is_batch=self.batch_transform)
+        else:
+            collate_fn = None
+        if self.batch_transform:
+            # Each index yielded by the batch sampler is a list, which will be
+            # handled by `dataset.__getitem__()` as a batch.
+            batch_sampler = BatchSampler(sampler=self._sampler,
+                                         batch_size=self.batch_size,
+                                         drop_last=self.drop_last_batch)
+            self._batch_grouper = DataLoader(
+                dataset=self._dataset,
+                batch_size=None,
+                sampler=batch_sampler,
+                shuffle=False,
+                num_workers=self.num_workers,
+                collate_fn=collate_fn,
+                pin_memory=self.pin_memory,
+                prefetch_factor=self.prefetch_factor)
+            self._iter_loader = iter(self._batch_grouper)
+            return
         self._batch_grouper = DataLoader(dataset=self._dataset,
                                          batch_size=self.batch_size,
                                          sampler=self._sampler,
                                          shuffle=False,
                                          drop_last=self.drop_last_batch,
                                          num_workers=self.num_workers,
+                                         collate_fn=collate_fn,
                                          pin_memory=self.pin_memory,
                                          prefetch_factor=self.prefetch_factor)
         self._iter_loader = iter(self._batch_grouper)
 
+    def _build_shared_memory_loader(self):
+        """Builds the batch generator with the shared-memory transport.
+
+        NOTE: The ring is re-allocated, hence this should only be called when
+        no batch from the previous ring is in use.
+        """
+        sample = self._dataset[0]
+        sample = {k: v for k, v in sample.items() if k not in self.drop_keys}
+        num_slots = (self.num_workers * self.prefetch_factor +
+                     self.hold_batches)
+        self._ring = SharedMemoryBatchRing(sample=sample,
+                                           batch_size=self.batch_size,
+                                           num_slots=num_slots)
+        batch_sampler = BatchSampler(sampler=self._sampler,
+                                     batch_size=self.batch_size,
+                                     drop_last=self.drop_last_batch)
+        self._batch_grouper = DataLoader(
+            dataset=SlotBatchDataset(dataset=self._dataset,
+                                     ring=self._ring,
+                                     batch_transform=self.batch_transform,
+                                     drop_keys=self.drop_keys),
+            batch_size=None,
+            sampler=SlotBatchSampler(batch_sampler, num_slots),
+            shuffle=False,
+            num_workers=self.num_workers,
+            pin_memory=self.pin_memory,
+            prefetch_factor=self.prefetch_factor)
+        self._iter_loader = iter(self._batch_grouper)
+
     def reset_iter_loader(self):
         self._iter_loader = iter(self._batch_grouper)
 
+    def state_dict(self, num_pending_batches=0):
+        """Gets the state of the data loader for resuming.
+
+        Args:
+            num_pending_batches: Number of batches fetched from this data loader
+                but not used yet (e.g., staged by a prefetcher), which will be
+                produced again after resuming. (default: 0)
+
+        Returns:
+            A dictionary, containing the sampler state with the number of
+                consumed samples from the current pass.
+        """
+        num_batches = max(self._num_consumed_batches - num_pending_batches, 0)
+        num_consumed = self._pass_offset + num_batches * self.batch_size
+        return {
+            'batch_size': self.batch_size,
+            'sampler': self._sampler.state_dict(num_consumed)
+        }
+
+    def load_state_dict(self, state_dict):
+        """Loads the state, and fast-forwards to the saved position.
+
+        NOTE: Skipped samples are never fetched, since the sampler simply
+        skips their indices.
+        """
+        self._sampler.load_state_dict(state_dict['sampler'])
+        self.reset_iter_loader()
+        self._num_consumed_batches = 0
+        self._pass_offset = state_dict['sampler']['num_consumed']
+
     def info(self):
         data_loader_info = super().info()
         data_loader_info['Pin memory'] = self.pin_memory
+        data_loader_info['Batch-level transformation'] = self.batch_transform
+        data_loader_info['Shared-memory transport'] = self.shared_memory
+        if self.shared_memory:
+            data_loader_info['Shared-memory slots'] = self._ring.num_slots
+            data_loader_info['Shared-memory size (MB)'] = (
+                f'{self._ring.nbytes / 1024 ** 2:.1f}')
+        data_loader_info['Dropped keys'] = self.drop_keys
         return data_loader_info
@@ -0,0 +1,288 @@
+# python3.7
+"""Unit test for the distributed sampler.
+
+Basically, this file tests whether the lazily generated indices of
+`DistributedSampler` are exactly the same as those materialized by the
+original implementation, whether the indices of different replicas are
+disjoint and cover the dataset, and whether the sampler can resume from the
+saved state exactly. Multiple replicas are simulated within one process by
+patching the world size and the rank.
+"""
+
+from unittest import mock
+
+import torch
+
+from . import distributed_sampler
+from .distributed_sampler import DistributedSampler
+
+__all__ = ['test_sampler']
+
+_DATASET_LENGTHS = [7, 12]
+_WORLD_SIZES = [1, 3, 4]
+_REPEATS = [1, 3]
+
+
+class _DummyDataset(object):
+    """Defines a dummy dataset, which only has a length."""
+
+    def __init__(self, length):
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+
+def _build_sampler(dataset_length, world_size, rank, **kwargs):
+    """Builds a sampler as the `rank`-th one of `world_size` replicas."""
+    with mock.patch.object(distributed_sampler.dist, 'get_world_size',
+                           return_value=world_size), \
+         mock.patch.object(distributed_sampler.dist, 'get_rank',
+                           return_value=rank):
+        return DistributedSampler(_DummyDataset(dataset_length), **kwargs)
+
+
+def _materialize_indices(dataset_length, world_size, rank, repeat, shuffle,
+                         seed, drop_last_sample, shuffle_times):
+    """Materializes the indices of a replica as the original implementation.
+
+    Returns:
+        A two-element tuple, containing the list of indices, and the shuffle
+            times after generating the indices.
+    """
+    actual_length = dataset_length * repeat
+    if drop_last_sample:
+        num_per_replica = actual_length // world_size
+    else:
+        num_per_replica = (actual_length - 1) // world_size + 1
+    num_all_replicas = num_per_replica * world_size
+
+    indices = []
+    g = torch.Generator()
+    for _ in range(repeat):
+        if shuffle:
+            g.manual_seed(seed + shuffle_times)
+            shuffle_times += 1
+            sub_indices = torch.randperm(dataset_length, generator=g)
+        else:
+            sub_indices = torch.arange(dataset_length)
+        indices.extend(sub_indices.tolist())
+    if drop_last_sample:
+        indices = indices[:num_all_replicas]
+    else:
+        indices += indices[:(num_all_replicas - len(indices))]
+    return indices[rank:num_all_replicas:world_size], shuffle_times
+
+
+def test_sampler():
+    """Collects all sampler tests."""
+    print('========== Start Sampler Test ==========')
+    test_lazy_indices()
+    test_partition()
+    test_shard_partition()
+    test_empty_shard_plan()
+    test_resume()
+    print('========== Finish Sampler Test ==========')
+
+
+def test_lazy_indices():
+    """Tests the lazy indices against the materialized ones."""
+    print('===== Testing lazy indices =====')
+    seed = 5
+    for dataset_length in _DATASET_LENGTHS:
+        for world_size in _WORLD_SIZES:
+            for repeat in _REPEATS:
+                for shuffle in [False, True]:
+                    for drop_last_sample in [False, True]:
+                        for rank in range(world_size):
+                            sampler = _build_sampler(
+                                dataset_length, world_size, rank,
+                                repeat=repeat,
+                                shuffle=shuffle,
+                                seed=seed,
+                                drop_last_sample=drop_last_sample)
+                            shuffle_times = 0
+                            for _pass in range(2):
+                                expected, shuffle_times = _materialize_indices(
+                                    dataset_length, world_size, rank, repeat,
+                                    shuffle, seed, drop_last_sample,
+                                    shuffle_times)
+                                indices = list(sampler)
+                                assert indices == expected, (
+                                    f'Lazy indices {indices} mismatch '
+                                    f'materialized ones {expected}!')
+                                assert len(indices) == len(sampler)
+                                indices = [sampler.get_index(idx)
+                                           for idx in range(len(sampler))]
+                                assert indices == expected
+    print('    Pass!')
+
+
+def test_partition():
+    """Tests whether the replicas partition the repeated dataset."""
+    print('===== Testing partition =====')
+    for dataset_length in _DATASET_LENGTHS:
+        for world_size in _WORLD_SIZES:
+            for repeat in _REPEATS:
+                for shuffle in [False, True]:
+                    for drop_last_sample in [False, True]:
+                        counts = [0] * dataset_length
+                        total = 0
+                        for rank in range(world_size):
+                            sampler = _build_sampler(
+                                dataset_length, world_size, rank,
+                                repeat=repeat,
+                                shuffle=shuffle,
+                                drop_last_sample=drop_last_sample)
+                            for idx in sampler:
+                                counts[idx] += 1
+                                total += 1
+                        actual_length = dataset_length * repeat
+                        # Without padding or dropping, each sample is handled
+                        # exactly `repeat` times across all replicas.
+                        if actual_length % world_size == 0:
+                            assert counts == [repeat] * dataset_length
+                        elif drop_last_sample:
+                            assert total == (actual_length -
+                                             actual_length % world_size)
+                            assert max(counts) <= repeat
+                        else:
+                            assert total == (actual_length + world_size -
+                                             actual_length % world_size)
+                            assert min(counts) >= repeat
+    print('    Pass!')
+
+
+def test_shard_partition():
+    """Tests the shard assignment and the bounded shuffle in shard mode."""
+    print('===== Testing shard partition =====')
+    dataset_length = 50
+    for shard_size in [4, 7]:
+        num_shards = (dataset_length - 1) // shard_size + 1
+        for world_size in _WORLD_SIZES:
+            for repeat in _REPEATS:
+                for shuffle in [False, True]:
+                    for shuffle_buffer_size in [0, 3]:
+                        samplers = [
+                            _build_sampler(
+                                dataset_length, world_size, rank,
+                                repeat=repeat,
+                                shuffle=shuffle,
+                                shard_size=shard_size,
+                                shuffle_buffer_size=shuffle_buffer_size)
+                            for rank in range(world_size)
+                        ]
+                        for sampler in samplers:
+                            sampler.generate_indices()
+                        for block in range(repeat):
+                            shards = []
+                            for sampler in samplers:
+                                shards.extend(
+                                    sampler.shard_plan[block].tolist())
+                            assert sorted(shards) == list(range(num_shards)), (
+                                f'Shards {shards} are not disjoint, or do not '
+                                f'cover all {num_shards} shards!')
+                        for sampler in samplers:
+                            buffer_size = sampler.shuffle_buffer_size
+                            for block in range(repeat):
+                                _check_bounded_shuffle(
+                                    sampler, block, shard_size, buffer_size)
+                            indices = list(sampler.iter_indices())
+                            assert len(indices) == len(sampler)
+    print('    Pass!')
+
+
+def _check_bounded_shuffle(sampler, block, shard_size, buffer_size):
+    """Checks that each index is displaced by at most `buffer_size`."""
+    positions = dict()
+    position = 0
+    for shard_idx in sampler.shard_plan[block].tolist():
+        start = shard_idx * shard_size
+        end = min(start + shard_size, sampler.dataset_length)
+        for idx in range(start, end):
+            positions[idx] = position
+            position += 1
+    # pylint: disable=protected-access
+    indices = sampler._get_shard_indices(block).tolist()
+    # pylint: enable=protected-access
+    assert sorted(indices) == sorted(positions)
+    for position, idx in enumerate(indices):
+        assert abs(position - positions[idx]) <= buffer_size, (
+            f'Index {idx} is displaced from {positions[idx]} to {position}, '
+            f'beyond the buffer size {buffer_size}!')
+
+
+def test_empty_shard_plan():
+    """Tests replicas with no shard assigned within some repeated epochs.
+
+    With 11 samples and a shard size of 10, i.e., shards with 10 and 1
+    samples, the replica taking the large shard in one repeated epoch takes
+    nothing in the next one if the small shard comes first.
+    """
+    print('===== Testing empty shard plan =====')
+    dataset_length = 11
+    world_size = 2
+    repeat = 4
+    num_cases = 0
+    for seed in range(100):
+        samplers = [
+            _build_sampler(dataset_length, world_size, rank,
+                           repeat=repeat,
+                           shuffle=True,
+                           seed=seed,
+                           shard_size=10)
+            for rank in range(world_size)
+        ]
+        for sampler in samplers:
+            sampler.generate_indices()
+        if all(len(plan) > 0
+               for sampler in samplers for plan in sampler.shard_plan):
+            continue
+        num_cases += 1
+        for sampler in samplers:
+            indices = list(sampler.iter_indices())
+            assert len(indices) == len(sampler)
+            assert indices == [sampler.get_index(idx)
+                               for idx in range(len(sampler))]
+            for block in range(repeat):
+                _check_bounded_shuffle(sampler, block, 10,
+                                       sampler.shuffle_buffer_size)
+    assert num_cases > 0, 'No replica is found without shards!'
+    print('    Pass!')
+
+
+def test_resume():
+    """Tests resuming from the state dict."""
+    print('===== Testing resume =====')
+    dataset_length = 12
+    for world_size in _WORLD_SIZES:
+        for repeat in _REPEATS:
+            for shuffle in [False, True]:
+                for shard_size in [0, 3]:
+                    for rank in range(world_size):
+                        kwargs = dict(repeat=repeat,
+                                      shuffle=shuffle,
+                                      seed=3,
+                                      shard_size=shard_size)
+                        sampler = _build_sampler(
+                            dataset_length, world_size, rank, **kwargs)
+                        # Resume within both the first and the second pass.
+                        for _pass in range(2):
+                            indices = list(sampler)
+                            for num_consumed in [0, 1, len(indices) // 2,
+                                                 len(indices)]:
+                                state = sampler.state_dict(num_consumed)
+                                resumed = _build_sampler(
+                                    dataset_length, world_size, rank,
+                                    **dict(kwargs, seed=0))
+                                resumed.load_state_dict(state)
+                                assert list(resumed) == indices[num_consumed:]
+                                # The pass after resuming is a full new one.
+                                reference = _build_sampler(
+                                    dataset_length, world_size, rank,
+                                    **kwargs)
+                                reference.shuffle_times = state[
+                                    'shuffle_times']
+                                list(reference)  # Skip the saved pass.
+                                assert list(resumed) == list(reference)
+    print('    Pass!')
@@ -3,6 +3,7 @@
 
 from .directory_reader import DirectoryReader
 from .lmdb_reader import LmdbReader
+from .shard_reader import ShardReader
 from .tar_reader import TarReader
 from .zip_reader import ZipReader
 
@@ -11,6 +12,7 @@ __all__ = ['build_file_reader']
 _READERS = {
     'dir': DirectoryReader,
     'lmdb': LmdbReader,
+    'shard': ShardReader,
     'tar': TarReader,
     'zip': ZipReader
 }
@@ -3,13 +3,108 @@
 
 This reader can summarize file list or fetch bytes of files inside a LMDB
 database.
+
+Listing all keys of a large database requires a full cursor scan, which takes
+minutes for databases with millions of entries. Hence, the keys are scanned
+only ONCE and then persisted as a sidecar key index next to the database, i.e.,
+
+```
+lsun_bedroom_lmdb/
+├── data.mdb
+├── lock.mdb
+├── key_index.bin  # All keys concatenated.
+└── key_index.npy  # Offsets of the keys in `key_index.bin`, in int64.
+```
+
+If the database directory is not writable, the key index is saved to the global
+cache directory (see `utils.misc.get_cache_dir()`) instead. The index is loaded
+lazily with `mmap` as an `LmdbKeyIndex`, which behaves like a read-only list of
+keys, without creating millions of Python objects at open time.
+
+Besides, the environment is opened with many reader slots, and each process
+(e.g., each data worker) keeps ONE read transaction alive and reuses it across
+`fetch_file()` calls. The environment is re-opened automatically after forking,
+since an LMDB environment should not be shared across processes.
 """
 
+import os
+import os.path
+import hashlib
+import mmap
+import time
+from collections.abc import Sequence
+import numpy as np
+
 import lmdb
 
+from utils.misc import get_cache_dir
 from .base_reader import BaseReader
 
-__all__ = ['LmdbReader']
+__all__ = ['LmdbReader', 'LmdbKeyIndex']
+
+KEY_INDEX_NAME = 'key_index'  # Name of the sidecar key index.
+MAX_READERS = 1024  # Maximum number of concurrent read transactions.
+
+
+class LmdbKeyIndex(Sequence):
+    """Defines a read-only, lazily loaded list of LMDB keys.
+
+    Keys are fetched from the memory-mapped blob on access, hence opening the
+    index only costs loading the offsets (also memory-mapped).
+
+    Args:
+        prefix: Path prefix of the index files, i.e., `${prefix}.bin` and
+            `${prefix}.npy`.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.offsets = np.load(f'{prefix}.npy', mmap_mode='r')
+        if self.offsets[-1] > 0:
+            with open(f'{prefix}.bin', 'rb') as f:
+                # Mapping stays valid after the file is closed.
+                self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:  # Empty keys cannot be mapped.
+            self.blob = b''
+
+    @staticmethod
+    def build(prefix, keys):
+        """Saves `keys` (in `bytes`) as an index atomically."""
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(key) for key in keys], dtype=np.int64)
+        pid = os.getpid()
+        with open(f'{prefix}.bin.{pid}.tmp', 'wb') as f:
+            f.write(b''.join(keys))
+        with open(f'{prefix}.npy.{pid}.tmp', 'wb') as f:
+            np.save(f, offsets)
+        # The blob is replaced first, since the offsets are checked as the
+        # completion of the index.
+        os.replace(f'{prefix}.bin.{pid}.tmp', f'{prefix}.bin')
+        os.replace(f'{prefix}.npy.{pid}.tmp', f'{prefix}.npy')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError('Key index out of range!')
+        return bytes(self.blob[self.offsets[idx]:self.offsets[idx + 1]])
+
+    def __getstate__(self):
+        # Memory mappings cannot be pickled, hence re-open after unpickling.
+        return self.prefix
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+    def close(self):
+        """Closes the memory mapping."""
+        if isinstance(self.blob, mmap.mmap):
+            self.blob.close()
 
 
 class LmdbReader(BaseReader):
@@ -17,27 +112,75 @@ class LmdbReader(BaseReader):
 
     This is a static class, which is used to solve the problem that different
     data workers cannot share the same memory.
+
+    NOTE: `get_file_list()` returns an `LmdbKeyIndex` instead of a `list`. The
+    keys are sorted already, since LMDB stores keys in lexicographical order.
     """
 
     reader_cache = dict()
 
+    @staticmethod
+    def _open_env(path):
+        """Opens the environment and a read transaction for this process."""
+        env = lmdb.open(path,
+                        max_readers=MAX_READERS,
+                        readonly=True,
+                        lock=False,
+                        readahead=False,
+                        meminit=False)
+        return env, env.begin(write=False, buffers=False)
+
+    @staticmethod
+    def _get_key_index_prefix(path, num_samples):
+        """Gets the prefix of an up-to-date key index, or where to build one.
+
+        Returns:
+            A two-element tuple, i.e., the prefix, and whether the index at
+                this prefix is valid.
+        """
+        data_path = os.path.join(path, 'data.mdb')
+        data_mtime = os.path.getmtime(data_path)
+        digest = hashlib.sha256(
+            os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+        candidates = [
+            os.path.join(path, KEY_INDEX_NAME),
+            os.path.join(get_cache_dir(), f'lmdb_{KEY_INDEX_NAME}_{digest}')
+        ]
+        for prefix in candidates:
+            offset_path = f'{prefix}.npy'
+            if (not os.path.isfile(offset_path) or
+                    os.path.getmtime(offset_path) < data_mtime):
+                continue
+            offsets = np.load(offset_path, mmap_mode='r')
+            if len(offsets) == num_samples + 1:
+                return prefix, True
+        if os.access(path, os.W_OK):
+            return candidates[0], False
+        os.makedirs(os.path.dirname(candidates[1]), exist_ok=True)
+        return candidates[1], False
+
     @staticmethod
     def open(path):
         """Opens a lmdb file."""
         lmdb_files = LmdbReader.reader_cache
         if path not in lmdb_files:
-            env = lmdb.open(path,
-                            max_readers=1,
-                            readonly=True,
-                            lock=False,
-                            readahead=False,
-                            meminit=False)
-            with env.begin(write=False) as txn:
-                num_samples = txn.stat()['entries']
-                keys = [key for key, _ in txn.cursor()]
+            start_time = time.time()
+            env, txn = LmdbReader._open_env(path)
+            num_samples = txn.stat()['entries']
+            prefix, is_valid = LmdbReader._get_key_index_prefix(
+                path, num_samples)
+            if not is_valid:
+                with txn.cursor() as cursor:
+                    keys = list(cursor.iternext(keys=True, values=False))
+                LmdbKeyIndex.build(prefix, keys)
+                del keys
             file_info = {'env': env,
+                         'txn': txn,
+                         'pid': os.getpid(),
                          'num_samples': num_samples,
-                         'keys': keys}
+                         'keys': LmdbKeyIndex(prefix),
+                         'key_index_built': not is_valid,
+                         'open_time': time.time() - start_time}
             lmdb_files[path] = file_info
         return lmdb_files[path]
 
@@ -46,9 +189,21 @@ class LmdbReader(BaseReader):
         lmdb_files = LmdbReader.reader_cache
         lmdb_file = lmdb_files.pop(path, None)
         if lmdb_file is not None:
-            lmdb_file['env'].close()
+            # Only the process opening the environment can close it.
+            if lmdb_file['pid'] == os.getpid():
+                lmdb_file['txn'].abort()
+                lmdb_file['env'].close()
+            lmdb_file['keys'].close()
             lmdb_file.clear()
 
+    @staticmethod
+    def get_open_time(path):
+        """Gets the time (in seconds) spent on opening the database.
+
+        This includes scanning the keys if the key index is built at opening.
+        """
+        return LmdbReader.open(path)['open_time']
+
     @staticmethod
     def open_anno_file(path, anno_filename=None):
         # TODO: Support loading annotation file from LMDB.
@@ -59,6 +214,11 @@ class LmdbReader(BaseReader):
         lmdb_file = LmdbReader.open(path)
         return lmdb_file['keys']
 
+    @classmethod
+    def get_file_list(cls, path):
+        # NOTE: Keys are already sorted, which saves materializing the list.
+        return cls._get_file_list(path)
+
     @classmethod
     def get_file_list_with_ext(cls, path, ext=None):
         # NOTE: In LMDB, keys do not reveal file extension.
@@ -72,7 +232,11 @@ class LmdbReader(BaseReader):
     @staticmethod
     def fetch_file(path, filename):
         lmdb_file = LmdbReader.open(path)
-        env = lmdb_file['env']
-        with env.begin(write=False) as txn:
-            file_bytes = txn.get(filename)
-        return file_bytes
+        if lmdb_file['pid'] != os.getpid():
+            # Forked (e.g., into a data worker), hence re-open the environment
+            # for this process.
+            env, txn = LmdbReader._open_env(path)
+            lmdb_file.update(env=env, txn=txn, pid=os.getpid())
+        if isinstance(filename, str):
+            filename = filename.encode('utf-8')
+        return lmdb_file['txn'].get(filename)
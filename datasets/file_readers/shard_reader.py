@@ -0,0 +1,242 @@
+# python3.7
+"""Contains the class of packed shard reader.
+
+A packed shard dataset is a directory containing one or more contiguous binary
+blobs (i.e., shards) together with a NumPy index, which records the shard ID,
+the byte offset, and the byte length of every member file. For example,
+
+```
+ffhq256_shard/
+├── index.npz
+├── shard_00000.bin
+├── shard_00001.bin
+└── ...
+```
+
+Shards are opened with `mmap`, hence fetching a file simply slices the mapped
+memory, without any header parsing or data copying. Besides, the mapping is
+created once by the main process and shared with all data workers after
+forking.
+
+Please use `prepare_dataset.py` with `--save_format shard` to create such a
+dataset, or use `ShardWriter` directly.
+"""
+
+import io
+import os.path
+import mmap
+import numpy as np
+
+from .base_reader import BaseReader
+
+__all__ = ['ShardReader', 'ShardWriter']
+
+INDEX_FILENAME = 'index.npz'  # Name of the index file inside the directory.
+DEFAULT_SHARD_SIZE = 4 * 1024 ** 3  # Maximum bytes of each shard, i.e., 4 GB.
+
+
+class ShardReader(BaseReader):
+    """Defines a class to load packed shards.
+
+    This is a static class, which is used to solve the problem that different
+    data workers cannot share the same memory.
+
+    NOTE: `fetch_file()` returns a read-only `memoryview` instead of `bytes`.
+    It can be fed into `np.frombuffer()` directly without copying. Use
+    `bytes()` to convert it if a `bytes` object is really needed.
+    """
+
+    reader_cache = dict()
+
+    @staticmethod
+    def open(path):
+        shard_files = ShardReader.reader_cache
+        if path not in shard_files:
+            index_path = os.path.join(path, INDEX_FILENAME)
+            assert os.path.isfile(index_path), (
+                f'Index file `{index_path}` is missing!')
+            with np.load(index_path, allow_pickle=False) as index:
+                filenames = index['filenames'].tolist()
+                shard_ids = index['shard_ids']
+                offsets = index['offsets']
+                lengths = index['lengths']
+                shard_names = index['shard_names'].tolist()
+            maps = []
+            for shard_name in shard_names:
+                with open(os.path.join(path, shard_name), 'rb') as f:
+                    # Mapping stays valid after the file is closed.
+                    maps.append(
+                        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            file_info = {'maps': maps,
+                         'blobs': [memoryview(m) for m in maps],
+                         'filenames': filenames,
+                         'file_to_idx': {name: idx for idx, name in
+                                         enumerate(filenames)},
+                         'shard_ids': shard_ids,
+                         'offsets': offsets,
+                         'lengths': lengths}
+            shard_files[path] = file_info
+        return shard_files[path]
+
+    @staticmethod
+    def close(path):
+        shard_files = ShardReader.reader_cache
+        shard_file = shard_files.pop(path, None)
+        if shard_file is not None:
+            for blob in shard_file['blobs']:
+                blob.release()
+            for shard_map in shard_file['maps']:
+                # Mappings with fetched slices still alive will be unmapped
+                # once these slices are garbage collected.
+                try:
+                    shard_map.close()
+                except BufferError:
+                    pass
+            shard_file.clear()
+
+    @staticmethod
+    def open_anno_file(path, anno_filename=None):
+        shard_file = ShardReader.open(path)
+        if not anno_filename:
+            return None
+        if anno_filename not in shard_file['file_to_idx']:
+            return None
+        # File will be closed after parsed in dataset.
+        return io.BytesIO(ShardReader.fetch_file(path, anno_filename))
+
+    @staticmethod
+    def _get_file_list(path):
+        shard_file = ShardReader.open(path)
+        return shard_file['filenames']
+
+    @staticmethod
+    def fetch_file(path, filename):
+        shard_file = ShardReader.open(path)
+        idx = shard_file['file_to_idx'][filename]
+        blob = shard_file['blobs'][shard_file['shard_ids'][idx]]
+        offset = int(shard_file['offsets'][idx])
+        return blob[offset:offset + int(shard_file['lengths'][idx])]
+
+
+class ShardWriter(object):
+    """Defines a class to pack files into shards readable by `ShardReader`.
+
+    The interface follows `zipfile.ZipFile`, i.e., files are added with
+    `writestr()` and the index is saved by `close()`. A new shard is started
+    whenever the current one would exceed `shard_size` bytes.
+
+    Packing can be resumed from the index saved by `checkpoint()` (or
+    `close()`) with `num_resumed`, which keeps the first `num_resumed` files and
+    discards everything packed after them.
+
+    Args:
+        path: Directory to save the shards and the index.
+        shard_size: Maximum number of bytes of each shard. A single file larger
+            than this field will occupy a shard on its own.
+            (default: 4 GB)
+        num_resumed: Number of files already packed in `path` to resume from.
+            `0` means to pack from scratch. (default: 0)
+    """
+
+    def __init__(self, path, shard_size=DEFAULT_SHARD_SIZE, num_resumed=0):
+        assert shard_size > 0, 'Shard size should be positive!'
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.shard_size = int(shard_size)
+
+        self.filenames = []
+        self._filename_set = set()
+        self.shard_ids = []
+        self.offsets = []
+        self.lengths = []
+        self.shard_names = []
+
+        self._shard = None  # File pointer of the shard under writing.
+        self._shard_offset = 0
+
+        if num_resumed > 0:
+            self._resume(num_resumed)
+
+    def _resume(self, num_resumed):
+        """Resumes from the first `num_resumed` files in the saved index."""
+        index_path = os.path.join(self.path, INDEX_FILENAME)
+        with np.load(index_path, allow_pickle=False) as index:
+            assert len(index['filenames']) >= num_resumed, (
+                f'Only {len(index["filenames"])} files are packed in '
+                f'`{self.path}`, fewer than {num_resumed}!')
+            self.filenames = index['filenames'][:num_resumed].tolist()
+            self.shard_ids = index['shard_ids'][:num_resumed].tolist()
+            self.offsets = index['offsets'][:num_resumed].tolist()
+            self.lengths = index['lengths'][:num_resumed].tolist()
+            shard_names = index['shard_names'].tolist()
+        self._filename_set = set(self.filenames)
+        self.shard_names = shard_names[:self.shard_ids[-1] + 1]
+        self._shard_offset = self.offsets[-1] + self.lengths[-1]
+        # File will be closed by calling `self.close()`.
+        self._shard = open(  # pylint: disable=consider-using-with
+            os.path.join(self.path, self.shard_names[-1]), 'r+b')
+        self._shard.truncate(self._shard_offset)
+        self._shard.seek(self._shard_offset)
+
+    def _open_new_shard(self):
+        """Closes the current shard and starts a new one."""
+        if self._shard is not None:
+            self._shard.close()
+        shard_name = f'shard_{len(self.shard_names):05d}.bin'
+        self.shard_names.append(shard_name)
+        # File will be closed by calling `self.close()`.
+        self._shard = open(os.path.join(self.path, shard_name), 'wb')  # pylint: disable=consider-using-with
+        self._shard_offset = 0
+
+    def writestr(self, filename, data):
+        """Appends a file to the shards.
+
+        Args:
+            filename: Name of the file, which is used as the key for fetching.
+            data: Content of the file, in `bytes`, `bytearray`, `memoryview`,
+                or `str` (which will be encoded with UTF-8).
+        """
+        if filename in self._filename_set:
+            raise ValueError(f'File `{filename}` has already been packed!')
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        data = memoryview(data).cast('B')
+        if (self._shard is None or (self._shard_offset > 0 and
+                                    self._shard_offset + data.nbytes >
+                                    self.shard_size)):
+            self._open_new_shard()
+        self._shard.write(data)
+
+        self.filenames.append(filename)
+        self._filename_set.add(filename)
+        self.shard_ids.append(len(self.shard_names) - 1)
+        self.offsets.append(self._shard_offset)
+        self.lengths.append(data.nbytes)
+        self._shard_offset += data.nbytes
+
+    def _save_index(self):
+        """Saves the index atomically."""
+        index_path = os.path.join(self.path, INDEX_FILENAME)
+        temp_path = f'{index_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f,
+                     filenames=np.array(self.filenames, dtype=np.str_),
+                     shard_ids=np.array(self.shard_ids, dtype=np.int32),
+                     offsets=np.array(self.offsets, dtype=np.int64),
+                     lengths=np.array(self.lengths, dtype=np.int64),
+                     shard_names=np.array(self.shard_names, dtype=np.str_))
+        os.replace(temp_path, index_path)
+
+    def checkpoint(self):
+        """Flushes the shard under writing and saves the index so far."""
+        if self._shard is not None:
+            self._shard.flush()
+            os.fsync(self._shard.fileno())
+        self._save_index()
+
+    def close(self):
+        """Closes the last shard and saves the index."""
+        if self._shard is not None:
+            self._shard.close()
+            self._shard = None
+        self._save_index()
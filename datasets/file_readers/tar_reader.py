@@ -1,23 +1,57 @@
 # python3.7
 """Contains the class of TAR file reader.
 
-Basically, a TAR file will be first extracted, under the same root directory as
-the source TAR file, and with the same base name as the source TAR file. For
-example, the TAR file `/home/data/test_data.tar.gz` will be extracted to
-`/home/data/test_data/`. Then, this file reader degenerates into
-`DirectoryReader`.
+An uncompressed TAR file stores each member file contiguously right after its
+header. Hence, this reader scans the headers ONCE to build an index recording
+the byte offset and the byte length of every member file, and then serves
+`fetch_file()` by slicing the memory-mapped archive, WITHOUT extracting anything
+to the disk. The index is cached next to the archive (or in the global cache
+directory if the archive directory is not writable), e.g.,
 
-NOTE: TAR file is not recommended to use. Instead, please use ZIP file.
+```
+/home/data/test_data.tar
+/home/data/test_data.tar.index.npz
+```
+
+Compressed TAR files (e.g., `.tar.gz` and `.tgz`) do not support random access.
+Please convert such a file into an uncompressed one first, which is done ONCE:
+
+```
+python -m datasets.file_readers.tar_reader /home/data/test_data.tar.gz
+```
+
+which saves `/home/data/test_data.tar`. After that, the compressed path can
+still be used, and the reader will pick the converted archive automatically.
 """
 
+import io
+import os
 import os.path
+import sys
+import bz2
+import gzip
+import hashlib
+import lzma
+import mmap
 import shutil
 import tarfile
+import numpy as np
 
+from utils.misc import get_cache_dir
 from .base_reader import BaseReader
 
 __all__ = ['TarReader']
 
+INDEX_SUFFIX = '.index.npz'  # Suffix of the index file.
+COMPRESSED_EXTENSIONS = {  # Compressed extension -> Decompression function.
+    '.tar.gz': gzip.open,
+    '.tgz': gzip.open,
+    '.tar.bz2': bz2.open,
+    '.tbz2': bz2.open,
+    '.tar.xz': lzma.open,
+    '.txz': lzma.open
+}
+
 
 class TarReader(BaseReader):
     """Defines a class to load TAR file.
@@ -28,21 +62,131 @@ class TarReader(BaseReader):
 
     reader_cache = dict()
 
+    @staticmethod
+    def get_uncompressed_path(path):
+        """Gets the path to the uncompressed archive regarding `path`.
+
+        `None` is returned if `path` does not look like a compressed archive.
+        """
+        for ext in COMPRESSED_EXTENSIONS:
+            if path.lower().endswith(ext):
+                return path[:-len(ext)] + '.tar'
+        return None
+
+    @staticmethod
+    def convert(path, target_path=None):
+        """Converts a compressed TAR file into an uncompressed one.
+
+        The conversion decompresses the archive in a streaming manner, without
+        extracting any member file.
+
+        Args:
+            path: Path to the compressed TAR file.
+            target_path: Path to save the uncompressed TAR file. If not
+                specified, the path from `get_uncompressed_path()` will be
+                used. (default: None)
+
+        Returns:
+            The path to the uncompressed TAR file.
+        """
+        decompress_fn = None
+        for ext, fn in COMPRESSED_EXTENSIONS.items():
+            if path.lower().endswith(ext):
+                decompress_fn = fn
+        if decompress_fn is None:
+            raise ValueError(f'Invalid compressed TAR file: `{path}`!\n'
+                             f'Extensions allowed: '
+                             f'{list(COMPRESSED_EXTENSIONS)}.')
+        target_path = target_path or TarReader.get_uncompressed_path(path)
+        temp_path = f'{target_path}.{os.getpid()}.tmp'
+        with decompress_fn(path, 'rb') as src, open(temp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, length=16 * 1024 ** 2)
+        os.replace(temp_path, target_path)
+        return target_path
+
+    @staticmethod
+    def _get_index_path(path):
+        """Gets the path to the up-to-date index, or where to build one.
+
+        Returns:
+            A two-element tuple, i.e., the index path, and whether the index at
+                this path is valid.
+        """
+        tar_mtime = os.path.getmtime(path)
+        digest = hashlib.sha256(
+            os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+        candidates = [
+            f'{path}{INDEX_SUFFIX}',
+            os.path.join(get_cache_dir(),
+                         f'{os.path.basename(path)}_{digest}{INDEX_SUFFIX}')
+        ]
+        for index_path in candidates:
+            if (os.path.isfile(index_path) and
+                    os.path.getmtime(index_path) >= tar_mtime):
+                return index_path, True
+        if os.access(os.path.dirname(os.path.abspath(path)), os.W_OK):
+            return candidates[0], False
+        os.makedirs(os.path.dirname(candidates[1]), exist_ok=True)
+        return candidates[1], False
+
+    @staticmethod
+    def _build_index(path, index_path):
+        """Builds the index with one sequential pass over the headers."""
+        filenames = []
+        offsets = []
+        lengths = []
+        try:
+            # Mode `r:` only accepts uncompressed archives. A zero-length file
+            # is treated as an empty archive.
+            if os.path.getsize(path) > 0:
+                with tarfile.open(path, 'r:') as f:
+                    for member in f:
+                        if member.isfile() and not member.issparse():
+                            filenames.append(member.name)
+                            offsets.append(member.offset_data)
+                            lengths.append(member.size)
+        except tarfile.ReadError as e:
+            raise ValueError(
+                f'`{path}` is not an uncompressed TAR file, which does not '
+                f'support random access! Please convert it ONCE with\n'
+                f'    python -m datasets.file_readers.tar_reader {path}'
+            ) from e
+        temp_path = f'{index_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f,
+                     filenames=np.array(filenames, dtype=np.str_),
+                     offsets=np.array(offsets, dtype=np.int64),
+                     lengths=np.array(lengths, dtype=np.int64))
+        os.replace(temp_path, index_path)
+
     @staticmethod
     def open(path):
         tar_files = TarReader.reader_cache
         if path not in tar_files:
-            root_dir = os.path.dirname(path)
-            base_dir = os.path.basename(path).split('.tar')[0]
-            extract_dir = os.path.join(root_dir, base_dir)
-            filenames = []
-            with tarfile.open(path, 'r') as f:
-                for member in f.getmembers():
-                    if member.isfile():
-                        filenames.append(member.name)
-                f.extractall(extract_dir)
-            file_info = {'extract_dir': extract_dir,
-                         'filenames': filenames}
+            tar_path = path
+            uncompressed_path = TarReader.get_uncompressed_path(path)
+            if uncompressed_path and os.path.isfile(uncompressed_path):
+                tar_path = uncompressed_path
+            index_path, is_valid = TarReader._get_index_path(tar_path)
+            if not is_valid:
+                TarReader._build_index(tar_path, index_path)
+            with np.load(index_path, allow_pickle=False) as index:
+                filenames = index['filenames'].tolist()
+                offsets = index['offsets']
+                lengths = index['lengths']
+            tar_map = None  # Zero-length files can not be mapped.
+            if os.path.getsize(tar_path) > 0:
+                with open(tar_path, 'rb') as f:
+                    # Mapping stays valid after the file is closed.
+                    tar_map = mmap.mmap(f.fileno(), 0,
+                                        access=mmap.ACCESS_READ)
+            file_info = {'tar_path': tar_path,
+                         'map': tar_map,
+                         'filenames': filenames,
+                         'file_to_idx': {name: idx for idx, name in
+                                         enumerate(filenames)},
+                         'offsets': offsets,
+                         'lengths': lengths}
             tar_files[path] = file_info
         return tar_files[path]
 
@@ -51,8 +195,8 @@ class TarReader(BaseReader):
         tar_files = TarReader.reader_cache
         tar_file = tar_files.pop(path, None)
         if tar_file is not None:
-            extract_dir = tar_file['extract_dir']
-            shutil.rmtree(extract_dir)
+            if tar_file['map'] is not None:
+                tar_file['map'].close()
             tar_file.clear()
 
     @staticmethod
@@ -60,11 +204,12 @@ class TarReader(BaseReader):
         tar_file = TarReader.open(path)
         if not anno_filename:
             return None
-        anno_path = os.path.join(tar_file['extract_dir'], anno_filename)
-        if not os.path.isfile(anno_path):
+        if anno_filename not in tar_file['file_to_idx']:
             return None
         # File will be closed after parsed in dataset.
-        return open(anno_path, 'r')
+        return io.TextIOWrapper(
+            io.BytesIO(TarReader.fetch_file(path, anno_filename)),
+            encoding='utf-8')
 
     @staticmethod
     def _get_file_list(path):
@@ -74,6 +219,12 @@ class TarReader(BaseReader):
     @staticmethod
     def fetch_file(path, filename):
         tar_file = TarReader.open(path)
-        with open(os.path.join(tar_file['extract_dir'], filename), 'rb') as f:
-            file_bytes = f.read()
-        return file_bytes
+        idx = tar_file['file_to_idx'][filename]
+        offset = int(tar_file['offsets'][idx])
+        return tar_file['map'][offset:offset + int(tar_file['lengths'][idx])]
+
+
+if __name__ == '__main__':
+    for tar_path in sys.argv[1:]:
+        print(f'Converting `{tar_path}` ...')
+        print(f'Saved to `{TarReader.convert(tar_path)}`.')
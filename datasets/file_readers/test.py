@@ -0,0 +1,114 @@
+# python3.7
+"""Unit test for packing archives with `prepare_dataset.py`.
+
+Basically, this file tests whether an archive packed with interruption and
+resuming is the same as the one packed in one go, i.e., all entries written
+before the interruption are kept, and the annotation lists exactly the entries
+within the archive.
+"""
+
+import os
+import json
+
+from prepare_dataset import pack_archive
+from .zip_reader import ZipReader
+
+__all__ = ['test_pack_archive']
+
+_TEST_DIR = 'pack_archive_test'
+_NUM_ITEMS = 10
+_CHECKPOINT_INTERVAL = 3
+
+
+class _Interruption(Exception):
+    """Defines the exception simulating an interrupted packing."""
+
+
+def _encode_item(idx):
+    """Encodes a dummy item, with the same output as `encode_item()`."""
+    target = idx % 3
+    return f'{target}/img{idx:08d}.bin', bytes([idx]) * (idx + 1), target
+
+
+def _encoded_items(indices, interrupt_at=None):
+    """Yields encoded items, and interrupts after `interrupt_at` items."""
+    for count, idx in enumerate(indices):
+        if count == interrupt_at:
+            raise _Interruption
+        yield _encode_item(idx)
+
+
+def _pack(archive_path, resume=False, interrupt_at=None):
+    """Packs `_NUM_ITEMS` dummy items into a ZIP archive."""
+    pack_archive(
+        archive_path=archive_path,
+        indices=range(_NUM_ITEMS),
+        encoded_items=lambda indices: _encoded_items(indices, interrupt_at),
+        save_format='zip',
+        shard_size=0,
+        meta_info=dict(num_items=_NUM_ITEMS),
+        options=dict(test=True),
+        resume=resume,
+        checkpoint_interval=_CHECKPOINT_INTERVAL)
+
+
+def _check_archive(archive_path):
+    """Checks the entries and the annotation of a packed archive."""
+    zip_file = ZipReader.open(archive_path)
+    assert zip_file.testzip() is None, f'Corrupted archive `{archive_path}`!'
+    labels = json.load(ZipReader.open_anno_file(archive_path,
+                                                'annotation.json'))
+    expected_labels = []
+    for idx in range(_NUM_ITEMS):
+        img_relative_path, buffer, target = _encode_item(idx)
+        expected_labels.append([img_relative_path, target])
+        assert ZipReader.fetch_file(archive_path, img_relative_path) == buffer
+    assert labels == expected_labels, (
+        f'Annotation {labels} mismatches {expected_labels}!')
+    file_list = sorted(ZipReader.get_file_list(archive_path))
+    expected_file_list = sorted(
+        [path for path, _ in expected_labels] +
+        ['annotation.json', 'meta.json'])
+    assert file_list == expected_file_list, (
+        f'Entries {file_list} mismatch {expected_file_list}!')
+    ZipReader.close(archive_path)
+    assert not os.path.exists(f'{archive_path}.progress.json')
+    assert not os.path.exists(f'{archive_path}.items.jsonl')
+
+
+def test_pack_archive(test_dir=_TEST_DIR):
+    """Tests packing archives with interruption and resuming."""
+    print('========== Start Archive Packing Test ==========')
+
+    os.makedirs(test_dir, exist_ok=True)
+
+    print('===== Testing packing in one go =====')
+    archive_path = os.path.join(test_dir, 'full.zip')
+    _pack(archive_path)
+    _check_archive(archive_path)
+    print('    Pass!')
+
+    # Interrupt right after a checkpoint, in between two checkpoints, and
+    # before the first checkpoint.
+    for interrupt_at in [_CHECKPOINT_INTERVAL * 2,
+                         _CHECKPOINT_INTERVAL * 2 + 2,
+                         1]:
+        print(f'===== Testing resuming after {interrupt_at} items =====')
+        archive_path = os.path.join(test_dir, f'resume{interrupt_at}.zip')
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+        try:
+            _pack(archive_path, interrupt_at=interrupt_at)
+        except _Interruption:
+            pass
+        else:
+            raise AssertionError('Packing is not interrupted!')
+        assert os.path.isfile(f'{archive_path}.progress.json')
+        _pack(archive_path, resume=True)
+        _check_archive(archive_path)
+        # Completed archive is skipped.
+        _pack(archive_path, resume=True, interrupt_at=0)
+        _check_archive(archive_path)
+        print('    Pass!')
+
+    print('========== Finish Archive Packing Test ==========')
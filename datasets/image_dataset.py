@@ -4,9 +4,31 @@
 `ImageDataset` is commonly used as the dataset that provides images with labels.
 Concretely, each data sample (or say item) consists of an image and its
 corresponding label (if provided).
+
+For fixed-resolution training, the output of decoding and resizing is
+deterministic for each image. Hence, `ImageDataset` supports caching these
+pre-decoded images (i.e., `raw_image` before mirroring) into a memory-mapped
+uint8 array with shape [N, H, W, C], such that only mirroring and normalization
+are executed at each step. Please refer to `cache_dataset.py` for building the
+cache in advance.
+
+With batch-level transformation (see `--data_batch_transform`), each data worker
+fetches a whole batch, and decodes all buffers of the batch with a bounded
+thread pool (see `decode_threads`). Since `cv2` releases the GIL, this
+parallelizes the decoding inside each worker, which helps when the number of
+worker processes is limited (e.g., by memory).
 """
 
+import os.path
+import hashlib
+import json
+import time
+import warnings
 import numpy as np
+from tqdm import tqdm
+
+import torch
+import torch.distributed as dist
 
 from utils.formatting_utils import raw_label_to_one_hot
 from .base_dataset import BaseDataset
@@ -46,7 +68,9 @@ class ImageDataset(BaseDataset):
                  mirror=False,
                  transform_kwargs=None,
                  use_label=True,
-                 num_classes=None):
+                 num_classes=None,
+                 cache_dir=None,
+                 decode_threads=1):
         """Initializes the dataset.
 
         Args:
@@ -59,7 +83,17 @@ class ImageDataset(BaseDataset):
                 be provided as a number larger than the actual number of
                 classes. For example, sometimes, we may want to leave an
                 additional class for an auxiliary task. (default: None)
+            cache_dir: Directory of the pre-decoded image cache. If set, images
+                will be served from the cache file under this directory, which
+                is keyed by the dataset path, the resolution, and the number of
+                channels. The cache will be built if not found. If set as
+                `None`, images will be decoded on the fly. (default: None)
+            decode_threads: Number of threads to decode the images of a batch
+                within each data worker, which only takes effect with
+                batch-level transformation. (default: 1)
         """
+        # Required by `self.parse_transform_config()`.
+        self.decode_threads = max(int(decode_threads), 1)
         super().__init__(root_dir=root_dir,
                          file_format=file_format,
                          annotation_path=annotation_path,
@@ -89,6 +123,262 @@ class ImageDataset(BaseDataset):
         else:
             self.num_classes = 0
 
+        # Load pre-decoded image cache if needed.
+        self.cache_dir = cache_dir
+        self.cache_path = None
+        self.cache = None
+        if self.cache_dir:
+            self.load_cache(self.cache_dir)
+
+    @property
+    def cache_samples(self):
+        """Returns the number of images maintained by the cache.
+
+        NOTE: Mirrored samples are flipped on the fly, hence not cached.
+        """
+        if self.mirror:
+            return self.num_samples // 2
+        return self.num_samples
+
+    @property
+    def cache_shape(self):
+        """Returns the shape of the cache, i.e., [N, H, W, C]."""
+        height, width = self.transforms['resize'].image_size
+        channels = self.transform_kwargs['image_channels']
+        return (self.cache_samples, height, width, channels)
+
+    def get_cache_path(self, cache_dir):
+        """Gets the path of the cache file under `cache_dir`.
+
+        The filename contains a hash of the dataset path, the file format, the
+        annotation, as well as the modification time of the dataset, such that
+        any change of the dataset will lead to a new cache.
+        """
+        cache_shape = self.cache_shape
+        root_dir = os.path.abspath(self.root_dir)
+        key = {
+            'root_dir': root_dir,
+            'root_mtime': os.path.getmtime(root_dir),
+            'file_format': self.file_format,
+            'annotation_path': self.annotation_path,
+            'annotation_meta': self.annotation_meta,
+            'shape': cache_shape
+        }
+        key = hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8'))
+        dataset_name = os.path.splitext(os.path.basename(
+            root_dir.rstrip('/')))[0]
+        shape_str = 'x'.join(map(str, cache_shape))
+        return os.path.join(
+            cache_dir, f'{dataset_name}_{shape_str}_{key.hexdigest()[:16]}.npy')
+
+    def get_decoded_image(self, idx):
+        """Decodes and resizes a particular image, i.e., the cached content.
+
+        Args:
+            idx: Index of the item within the item list maintained by the
+                dataset. Mirroring is NOT taken into account.
+
+        Returns:
+            An uint8 image with shape [H, W, C].
+        """
+        if self.use_label:
+            image_path = self.items[idx][0]
+        else:
+            image_path = self.items[idx]
+        buffer = np.frombuffer(self.fetch_file(image_path), dtype=np.uint8)
+        image = self.transforms['decode'](buffer)
+        image = self.transforms['resize'](image)
+        if image.shape != self.cache_shape[1:]:
+            raise ValueError(f'Image `{image_path}` is with shape '
+                             f'{image.shape} after decoding and resizing, '
+                             f'which is incompatible with the cache shape '
+                             f'{self.cache_shape[1:]}!')
+        return image
+
+    def get_decoded_images(self, indices):
+        """Decodes and resizes a batch of images with the thread pool.
+
+        Args:
+            indices: A list of indices of the items within the item list
+                maintained by the dataset. Mirroring is NOT taken into account.
+
+        Returns:
+            An uint8 array with shape [N, H, W, C].
+        """
+        if self.use_label:
+            image_paths = [self.items[idx][0] for idx in indices]
+        else:
+            image_paths = [self.items[idx] for idx in indices]
+        buffers = [np.frombuffer(self.fetch_file(image_path), dtype=np.uint8)
+                   for image_path in image_paths]
+        images = self.transforms['decode'].decode_batch(buffers)
+        images = self.transforms['resize'](images)
+        for image_path, image in zip(image_paths, images):
+            if image.shape != self.cache_shape[1:]:
+                raise ValueError(f'Image `{image_path}` is with shape '
+                                 f'{image.shape} after decoding and resizing, '
+                                 f'which is incompatible with the cache shape '
+                                 f'{self.cache_shape[1:]}!')
+        return np.stack(images, axis=0)
+
+    def measure_decode_throughput(self, num_samples=1024, batch_size=64):
+        """Measures the throughput of decoding and resizing in this process.
+
+        Images are processed batch by batch with `self.get_decoded_images()`,
+        hence the result reflects the speed of ONE data worker with
+        `self.decode_threads` threads.
+
+        Args:
+            num_samples: Number of images to decode. (default: 1024)
+            batch_size: Number of images decoded at once. (default: 64)
+
+        Returns:
+            The throughput in images per second.
+        """
+        num_samples = min(num_samples, self.cache_samples)
+        batch_size = max(int(batch_size), 1)
+        start_time = time.time()
+        for start in range(0, num_samples, batch_size):
+            end = min(start + batch_size, num_samples)
+            self.get_decoded_images(list(range(start, end)))
+        return num_samples / (time.time() - start_time)
+
+    def _fill_cache(self, cache, indices, num_workers=0, batch_size=1,
+                    verbose=True):
+        """Decodes the images at `indices` into `cache` (an array-like).
+
+        Args:
+            cache: The array to fill, with shape `self.cache_shape`.
+            indices: Indices of the images to decode, in increasing order.
+            num_workers: Number of workers for decoding. (default: 0)
+            batch_size: Number of images decoded by each worker at once.
+                (default: 1)
+            verbose: Whether to show the progress bar. (default: True)
+        """
+        image_set = _DecodedImageSet(self)
+        batches = list(torch.utils.data.BatchSampler(
+            list(indices), batch_size=max(int(batch_size), 1),
+            drop_last=False))
+        loader = torch.utils.data.DataLoader(image_set,
+                                             batch_size=None,
+                                             sampler=batches,
+                                             num_workers=num_workers)
+        start_time = time.time()
+        num_done = 0
+        with tqdm(total=len(indices), desc='Cache',
+                  disable=not verbose) as pbar:
+            for batch_indices, images in zip(batches, loader):
+                cache[batch_indices] = images.numpy()
+                num_done += len(batch_indices)
+                pbar.update(len(batch_indices))
+                pbar.set_postfix_str(
+                    f'{num_done / (time.time() - start_time):.1f} images/sec')
+
+    def build_cache(self, cache_dir, num_workers=0, batch_size=1):
+        """Builds the pre-decoded image cache under `cache_dir`.
+
+        Images are decoded and resized by `num_workers` processes, and written
+        to a temporary file, which will be renamed to the cache path once
+        finished. Hence, an interrupted building will never leave a corrupted
+        cache behind. If `batch_size` is larger than 1, each process decodes a
+        batch of images at once with `self.decode_threads` threads.
+
+        Args:
+            cache_dir: Directory to save the cache.
+            num_workers: Number of workers for decoding. (default: 0)
+            batch_size: Number of images decoded by each worker at once.
+                (default: 1)
+
+        Returns:
+            Path to the built cache.
+        """
+        cache_path = self.get_cache_path(cache_dir)
+        if os.path.isfile(cache_path):
+            return cache_path
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = f'{cache_path}.{os.getpid()}.tmp.npy'
+        cache = np.lib.format.open_memmap(
+            temp_path, mode='w+', dtype=np.uint8, shape=self.cache_shape)
+        self._fill_cache(cache, range(self.cache_samples),
+                         num_workers=num_workers,
+                         batch_size=batch_size)
+        cache.flush()
+        del cache
+        os.replace(temp_path, cache_path)
+        return cache_path
+
+    def build_cache_distributed(self, cache_dir):
+        """Builds the pre-decoded image cache with all replicas together.
+
+        The chief allocates the cache as a temporary file, and then each
+        replica decodes the images with indices `rank::world_size` into it.
+        Hence, the time spent between two collectives is divided by the number
+        of replicas (instead of the chief building the whole cache while the
+        others wait in `dist.barrier()`, which may exceed the timeout of the
+        process group).
+
+        NOTE: `cache_dir` should be on a file system shared by all replicas.
+        For large datasets, it is still recommended to build the cache in
+        advance with `cache_dataset.py`, since the building of each replica
+        should finish within the timeout of the process group.
+
+        Returns:
+            Path to the built cache.
+        """
+        cache_path = self.get_cache_path(cache_dir)
+        rank = dist.get_rank()
+        world_size = dist.get_world_size()
+        temp_path = f'{cache_path}.distributed.tmp.npy'
+        if rank == 0:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Overwrites the one left by an interrupted building if any.
+            cache = np.lib.format.open_memmap(
+                temp_path, mode='w+', dtype=np.uint8, shape=self.cache_shape)
+            del cache
+        dist.barrier()  # The temporary cache is allocated.
+        cache = np.load(temp_path, mmap_mode='r+')
+        self._fill_cache(cache, range(rank, self.cache_samples, world_size),
+                         verbose=(rank == 0))
+        cache.flush()
+        del cache
+        dist.barrier()  # All replicas have written their images.
+        if rank == 0:
+            os.replace(temp_path, cache_path)
+        dist.barrier()  # The cache is ready.
+        return cache_path
+
+    def load_cache(self, cache_dir):
+        """Loads the pre-decoded image cache, which is built if not found.
+
+        Under the distributed environment, the cache is built by all replicas
+        together with `self.build_cache_distributed()`, unless all replicas
+        find the cache.
+        """
+        is_distributed = dist.is_available() and dist.is_initialized()
+        self.cache_path = self.get_cache_path(cache_dir)
+        cache_exists = os.path.isfile(self.cache_path)
+        if is_distributed:
+            # All replicas should take the same branch, since building runs
+            # collectives. Hence, the cache is treated as existing only if it
+            # is found by all replicas (e.g., `cache_dir` may be node-local).
+            # NOTE: `torch.distributed.all_reduce()` may only work for GPU data.
+            # Hence we move the data onto GPU for reducing.
+            sync_tensor = torch.tensor([int(cache_exists)]).cuda()
+            dist.all_reduce(sync_tensor, op=dist.ReduceOp.MIN)
+            cache_exists = bool(sync_tensor.item())
+        if not cache_exists:
+            if not is_distributed or dist.get_rank() == 0:
+                warnings.warn(f'Pre-decoded image cache `{self.cache_path}` '
+                              f'is not found, and will be built now, which '
+                              f'may take a while. Please consider building it '
+                              f'in advance with `cache_dataset.py`.')
+            if is_distributed:
+                self.build_cache_distributed(cache_dir)
+            else:
+                self.build_cache(cache_dir)
+        self.cache = np.load(self.cache_path, mmap_mode='r')
+        assert self.cache.shape == self.cache_shape, 'Broken cache!'
+
     def get_raw_data(self, idx):
         # Handle data mirroring.
         do_mirror = self.mirror and idx >= (self.num_samples // 2)
@@ -102,8 +392,11 @@ class ImageDataset(BaseDataset):
         else:
             image_path = self.items[idx]
 
-        # Load image to buffer.
-        buffer = np.frombuffer(self.fetch_file(image_path), dtype=np.uint8)
+        # Load image to buffer, or directly from the cache.
+        if self.cache is not None:
+            buffer = np.array(self.cache[idx])
+        else:
+            buffer = np.frombuffer(self.fetch_file(image_path), dtype=np.uint8)
 
         idx = np.array(idx)
         do_mirror = np.array(do_mirror)
@@ -125,7 +418,8 @@ class ImageDataset(BaseDataset):
         max_val = self.transform_kwargs.setdefault('max_val', 1.0)
         self.transform_config = dict(
             decode=dict(transform_type='Decode', image_channels=image_channels,
-                        return_square=True, center_crop=True),
+                        return_square=True, center_crop=True,
+                        num_threads=self.decode_threads),
             resize=dict(transform_type='Resize', image_size=image_size),
             normalize=dict(transform_type='Normalize',
                            min_val=min_val, max_val=max_val)
@@ -137,8 +431,12 @@ class ImageDataset(BaseDataset):
         else:
             idx, do_mirror, buffer = raw_data
 
-        raw_image = self.transforms['decode'](buffer, use_dali=use_dali)
-        raw_image = self.transforms['resize'](raw_image, use_dali=use_dali)
+        # Cached images have already been decoded and resized.
+        if self.cache is not None:
+            raw_image = buffer
+        else:
+            raw_image = self.transforms['decode'](buffer, use_dali=use_dali)
+            raw_image = self.transforms['resize'](raw_image, use_dali=use_dali)
         raw_image = self.mirror_aug(raw_image, do_mirror, use_dali=use_dali)
         image = self.transforms['normalize'](raw_image, use_dali=use_dali)
 
@@ -146,6 +444,28 @@ class ImageDataset(BaseDataset):
             return [idx, raw_image, image, raw_label, label]
         return [idx, raw_image, image]
 
+    def transform_batch(self, raw_data):
+        # Raw images are with different sizes, hence are decoded and resized
+        # as a list, where decoding runs on the thread pool.
+        if self.cache is not None:
+            raw_images = [item[2] for item in raw_data]
+        else:
+            raw_images = self.transforms['decode'].decode_batch(
+                [item[2] for item in raw_data])
+            raw_images = self.transforms['resize'](raw_images)
+        raw_image = np.stack(raw_images, axis=0)
+
+        idx = np.stack([item[0] for item in raw_data], axis=0)
+        do_mirror = np.stack([item[1] for item in raw_data], axis=0)
+        raw_image = self.mirror_aug_batch(raw_image, do_mirror)
+        image = self.transforms['normalize'](raw_image, is_batch=True)
+
+        if self.use_label:
+            raw_label = np.stack([item[3] for item in raw_data], axis=0)
+            label = np.stack([item[4] for item in raw_data], axis=0)
+            return [idx, raw_image, image, raw_label, label]
+        return [idx, raw_image, image]
+
     @property
     def output_keys(self):
         if self.use_label:
@@ -158,4 +478,21 @@ class ImageDataset(BaseDataset):
         dataset_info['Use label'] = self.use_label
         if self.use_label:
             dataset_info['Num classes for training'] = self.num_classes
+        dataset_info['Pre-decoded image cache'] = self.cache_path
+        dataset_info['Decode threads (batch-level)'] = self.decode_threads
         return dataset_info
+
+
+class _DecodedImageSet(torch.utils.data.Dataset):
+    """Wraps `ImageDataset` to produce images for building the cache."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return self.dataset.cache_samples
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (list, tuple)):
+            return self.dataset.get_decoded_images(idx)
+        return self.dataset.get_decoded_image(idx)
@@ -0,0 +1,120 @@
+# python3.7
+"""Contains the class to profile the latency of data pre-processing stages.
+
+The data time recorded by the runner only tells how long the main process waits
+for a batch, but not which stage (e.g., fetching, decoding, resizing, or
+augmentation) is the bottleneck. `TransformProfiler` records the latency of
+each stage into a histogram with log2-spaced buckets (in microseconds), i.e.,
+bucket `b` covers [2^b, 2^(b+1)) us.
+
+The histograms are kept in shared memory, which is allocated by the main process
+BEFORE data workers start. Each worker (and the main process) only writes its
+own row, hence no lock is required, and the main process can aggregate the
+results at any time without communicating with the workers.
+
+Stages are recorded per call, i.e., per sample for `dataset[idx]`, or per batch
+for `dataset[indices]` (with batch-level transformation). The profiler is
+disabled by default, where the overhead is only an attribute check per call.
+Please refer to `BaseDataset.enable_profiler()` for usage.
+"""
+
+import os
+import numpy as np
+
+import torch
+from torch.utils.data import get_worker_info
+
+__all__ = ['TransformProfiler']
+
+NUM_BUCKETS = 32  # Up to 2^32 us, i.e., about 71 minutes.
+
+
+class TransformProfiler(object):
+    """Defines the profiler recording the latency of each stage.
+
+    Args:
+        stages: Names of the stages to profile.
+        num_slots: Number of rows of the histograms, which should be the number
+            of data workers plus one (for the main process).
+    """
+
+    def __init__(self, stages, num_slots):
+        self.stages = list(stages)
+        self.num_slots = max(int(num_slots), 1)
+        self._stage_to_idx = {stage: idx for idx, stage in
+                              enumerate(self.stages)}
+        self.counts = torch.zeros(
+            (self.num_slots, len(self.stages), NUM_BUCKETS), dtype=torch.int64
+        ).share_memory_()
+        self.sums = torch.zeros(
+            (self.num_slots, len(self.stages)), dtype=torch.float64
+        ).share_memory_()
+
+        # Views of the row owned by the current process, created lazily.
+        self._views = None
+        self._views_pid = None
+
+        # Aggregated results at the last summary, to compute the increments.
+        self._last_counts = np.zeros((len(self.stages), NUM_BUCKETS),
+                                     dtype=np.int64)
+        self._last_sums = np.zeros((len(self.stages),), dtype=np.float64)
+
+    def __getstate__(self):
+        # Views are bound to the process, hence re-created after unpickling.
+        state = self.__dict__.copy()
+        state['_views'] = None
+        state['_views_pid'] = None
+        return state
+
+    def _get_views(self):
+        """Gets the `numpy.ndarray` views of the row owned by this process."""
+        if self._views is None or self._views_pid != os.getpid():
+            worker_info = get_worker_info()
+            if worker_info is None or self.num_slots == 1:
+                slot = 0
+            else:
+                slot = worker_info.id % (self.num_slots - 1) + 1
+            self._views = (self.counts[slot].numpy(), self.sums[slot].numpy())
+            self._views_pid = os.getpid()
+        return self._views
+
+    def record(self, stage, duration):
+        """Records the duration (in seconds) of one call of `stage`."""
+        counts, sums = self._get_views()
+        idx = self._stage_to_idx[stage]
+        bucket = max(int(duration * 1e6), 1).bit_length() - 1
+        counts[idx, min(bucket, NUM_BUCKETS - 1)] += 1
+        sums[idx] += duration
+
+    def summarize(self):
+        """Summarizes the calls recorded since the last summary.
+
+        NOTE: Percentiles are estimated with the upper bound of the bucket,
+        hence are accurate up to a factor of 2.
+
+        Returns:
+            A dictionary, mapping each stage to a dictionary with the number of
+                calls (`count`), and the mean, median, and 95th percentile of
+                the latency in milliseconds (`mean_ms`, `p50_ms`, `p95_ms`).
+        """
+        counts = self.counts.numpy().sum(axis=0)
+        sums = self.sums.numpy().sum(axis=0)
+        delta_counts = counts - self._last_counts
+        delta_sums = sums - self._last_sums
+        self._last_counts = counts
+        self._last_sums = sums
+
+        upper_bounds_ms = np.exp2(np.arange(1, NUM_BUCKETS + 1)) / 1000
+        results = dict()
+        for idx, stage in enumerate(self.stages):
+            count = int(delta_counts[idx].sum())
+            stage_results = dict(count=count, mean_ms=0.0, p50_ms=0.0,
+                                 p95_ms=0.0)
+            if count > 0:
+                cum_counts = np.cumsum(delta_counts[idx])
+                stage_results['mean_ms'] = 1000 * float(delta_sums[idx]) / count
+                for key, quantile in [('p50_ms', 0.5), ('p95_ms', 0.95)]:
+                    bucket = int(np.searchsorted(cum_counts, quantile * count))
+                    stage_results[key] = float(upper_bounds_ms[bucket])
+            results[stage] = stage_results
+        return results
@@ -13,6 +13,9 @@ For more details on using DALI, please refer to
 https://docs.nvidia.com/deeplearning/dali/user-guide/docs/
 """
 
+import time
+import numpy as np
+
 try:
     import nvidia.dali.pipeline as dali_pipeline
 except ImportError:
@@ -63,6 +66,19 @@ class BaseTransformation(object):
     function is used for `self._DALI_forward()`. Unfortunately, when this field
     is set as `True`, parallel data pre-fetching may also be turned off. Please
     refer to `datasets/data_loaders/dali_pipeline.py` for more details.
+
+    Besides, CPU forwarding can also be executed on a batch of samples, i.e.,
+    `self._CPU_batch_forward()`, where each input is a stacked array with shape
+    [N, ...]. This saves the per-sample Python overhead and enables
+    vectorization across the batch. By default, it falls back to calling
+    `self._CPU_forward()` on each sample and then stacking the results. Derived
+    classes are encouraged to override it with vectorized implementation,
+    keeping randomness independent across samples (but shared across the
+    elements of the input list).
+
+    Finally, the latency of CPU forwarding can be recorded by a profiler (see
+    `datasets/transform_profiler.py`) set with `self.set_profiler()`. It is
+    disabled by default.
     """
 
     def __init__(self, support_dali=False):
@@ -70,6 +86,8 @@ class BaseTransformation(object):
         self._name = self.__class__.__name__
         self._support_dali = support_dali
         self._has_customized_function_for_dali = False
+        self._profiler = None
+        self._profile_stage = None
 
     @property
     def name(self):
@@ -86,6 +104,16 @@ class BaseTransformation(object):
         """Whether DALI forwarding is implemented with customized function."""
         return self._has_customized_function_for_dali
 
+    def set_profiler(self, profiler, stage):
+        """Sets the profiler to record the latency of each CPU forwarding.
+
+        Args:
+            profiler: A `TransformProfiler`, or `None` to disable profiling.
+            stage: Name of the stage under which the latency is recorded.
+        """
+        self._profiler = profiler
+        self._profile_stage = stage
+
     def _CPU_forward(self, data):
         """Transforms the input data with typical CPU operations.
 
@@ -97,6 +125,20 @@ class BaseTransformation(object):
         """
         raise NotImplementedError('Should be implemented in derived class!')
 
+    def _CPU_batch_forward(self, data):
+        """Transforms a batch of input data with typical CPU operations.
+
+        NOTE: This fallback requires `self._CPU_forward()` to produce outputs
+        with the same shape for all samples.
+
+        Args:
+            data: A list of `numpy.ndarray`, each of which stacks N samples
+                along the first dimension.
+        """
+        num = data[0].shape[0]
+        outputs = [self._CPU_forward([x[i] for x in data]) for i in range(num)]
+        return [np.stack(x, axis=0) for x in zip(*outputs)]
+
     def _DALI_forward(self, data):
         """Transforms the input data with DALI operations.
 
@@ -110,17 +152,20 @@ class BaseTransformation(object):
         raise NotImplementedError(f'DALI forward is not supported in '
                                   f'data transformation `{self.name}`!')
 
-    def __call__(self, data, use_dali=False):
+    def __call__(self, data, use_dali=False, is_batch=False):
         """Transforms the input data with the proper manner.
 
-        Basically, this function chooses between `self._CPU_forward()` and
-        `self._DALI_forward()`. In addition, this function handles the case
-        where `data` is not a list, such that `self._CPU_forward()` and
-        `self._DALI_forward()` only need to consider list input.
+        Basically, this function chooses among `self._CPU_forward()`,
+        `self._CPU_batch_forward()`, and `self._DALI_forward()`. In addition,
+        this function handles the case where `data` is not a list, such that
+        these functions only need to consider list input.
 
         Args:
             use_dali: Whether to use `self._DALI_forward()` for forwarding or
                 not. (default: False)
+            is_batch: Whether the input data is a batch of samples stacked
+                along the first dimension. This field only takes effect for
+                CPU forwarding. (default: False)
         """
         is_input_list = True
 
@@ -130,6 +175,16 @@ class BaseTransformation(object):
 
         if use_dali and self.support_dali and dali_pipeline is not None:
             outputs = self._DALI_forward(data)
+        elif self._profiler is not None:
+            start_time = time.perf_counter()
+            if is_batch:
+                outputs = self._CPU_batch_forward(data)
+            else:
+                outputs = self._CPU_forward(data)
+            self._profiler.record(self._profile_stage,
+                                  time.perf_counter() - start_time)
+        elif is_batch:
+            outputs = self._CPU_batch_forward(data)
         else:
             outputs = self._CPU_forward(data)
 
@@ -51,6 +51,25 @@ class CenterCrop(BaseTransformation):
                 image[y:y + self.crop_size[0], x:x + self.crop_size[1]]))
         return outputs
 
+    def _CPU_batch_forward(self, data):
+        outputs = []
+        for images in data:
+            height, width = images.shape[1:3]
+            if height == self.crop_size[0] and width == self.crop_size[1]:
+                outputs.append(images)
+                continue
+            if height < self.crop_size[0]:
+                raise ValueError(f'Cropping height `{self.crop_size[0]}` is '
+                                 f'larger than image height `{height}`!')
+            if width < self.crop_size[1]:
+                raise ValueError(f'Cropping width `{self.crop_size[1]}` is '
+                                 f'larger than image width `{width}`!')
+            y = (height - self.crop_size[0]) // 2
+            x = (width - self.crop_size[1]) // 2
+            outputs.append(np.ascontiguousarray(
+                images[:, y:y + self.crop_size[0], x:x + self.crop_size[1]]))
+        return outputs
+
     def _DALI_forward(self, data):
         return fn.crop(data,
                        crop_pos_x=0.5,
@@ -95,6 +114,33 @@ class RandomCrop(BaseTransformation):
                 image[y:y + self.crop_size[0], x:x + self.crop_size[1]]))
         return outputs
 
+    def _CPU_batch_forward(self, data):
+        num = data[0].shape[0]
+        crop_pos_y = np.random.uniform(size=num)
+        crop_pos_x = np.random.uniform(size=num)
+
+        outputs = []
+        for images in data:
+            height, width = images.shape[1:3]
+            if height == self.crop_size[0] and width == self.crop_size[1]:
+                outputs.append(images)
+                continue
+            if height < self.crop_size[0]:
+                raise ValueError(f'Cropping height `{self.crop_size[0]}` is '
+                                 f'larger than image height `{height}`!')
+            if width < self.crop_size[1]:
+                raise ValueError(f'Cropping width `{self.crop_size[1]}` is '
+                                 f'larger than image width `{width}`!')
+            # Gather all crops at once with broadcast indices.
+            y = ((height - self.crop_size[0]) * crop_pos_y).astype(np.int64)
+            x = ((width - self.crop_size[1]) * crop_pos_x).astype(np.int64)
+            rows = y[:, np.newaxis] + np.arange(self.crop_size[0])
+            cols = x[:, np.newaxis] + np.arange(self.crop_size[1])
+            outputs.append(images[np.arange(num)[:, np.newaxis, np.newaxis],
+                                  rows[:, :, np.newaxis],
+                                  cols[:, np.newaxis, :]])
+        return outputs
+
     def _DALI_forward(self, data):
         crop_pos_y = fn.random.uniform(range=(0, 1))
         crop_pos_x = fn.random.uniform(range=(0, 1))
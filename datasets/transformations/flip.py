@@ -45,6 +45,23 @@ class Flip(BaseTransformation):
             outputs.append(np.ascontiguousarray(image))
         return outputs
 
+    def _CPU_batch_forward(self, data):
+        num = data[0].shape[0]
+        do_horizontal = np.random.uniform(size=num) < self.horizontal_prob
+        do_vertical = np.random.uniform(size=num) < self.vertical_prob
+
+        # Early return if no flipping is applied.
+        if not do_horizontal.any() and not do_vertical.any():
+            return data
+
+        outputs = []
+        for images in data:
+            images = images.copy()
+            images[do_horizontal] = images[do_horizontal, :, ::-1]
+            images[do_vertical] = images[do_vertical, ::-1, :]
+            outputs.append(images)
+        return outputs
+
     def _DALI_forward(self, data):
         do_horizontal = fn.random.coin_flip(probability=self.horizontal_prob)
         do_vertical = fn.random.coin_flip(probability=self.vertical_prob)
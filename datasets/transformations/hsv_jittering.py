@@ -58,6 +58,35 @@ class HSVJittering(BaseTransformation):
             outputs.append(new_image)
         return outputs
 
+    def _CPU_batch_forward(self, data):
+        # Early return if no jittering is needed.
+        if (self.h_range == (0, 0) and self.s_range == (1, 1) and
+                self.v_range == (1, 1)):
+            return data
+
+        # Get random jittering value for each sample.
+        num = data[0].shape[0]
+        hue = np.random.uniform(*self.h_range, size=(num, 1, 1))
+        sat = np.random.uniform(*self.s_range, size=(num, 1, 1))
+        val = np.random.uniform(*self.v_range, size=(num, 1, 1))
+
+        # Perform color jittering. Color conversion is pixel-wise, hence the
+        # batch can be converted at once by stacking images vertically.
+        outputs = []
+        for images in data:
+            assert images.shape[3] == 3, 'RGB image is expected!'
+            height, width = images.shape[1:3]
+            images = np.ascontiguousarray(images).reshape(-1, width, 3)
+            hsv = cv2.cvtColor(images, cv2.COLOR_RGB2HSV)
+            hsv = hsv.reshape(num, height, width, 3)
+            h = ((hsv[..., 0] + hue) % 180).astype(np.uint8)
+            s = np.clip(hsv[..., 1] * sat, 0, 255).astype(np.uint8)
+            v = np.clip(hsv[..., 2] * val, 0, 255).astype(np.uint8)
+            hsv = np.stack([h, s, v], axis=3).reshape(-1, width, 3)
+            new_images = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
+            outputs.append(new_images.reshape(num, height, width, 3))
+        return outputs
+
     def _DALI_forward(self, data):
         # Early return is no jittering is needed.
         if (self.h_range == (0, 0) and self.s_range == (1, 1) and
@@ -41,6 +41,16 @@ class Normalize(BaseTransformation):
             outputs.append(image)
         return outputs
 
+    def _CPU_batch_forward(self, data):
+        outputs = []
+        for images in data:
+            images = images.astype(np.float32)
+            images /= 255
+            images *= (self.max_val - self.min_val)
+            images += self.min_val
+            outputs.append(np.ascontiguousarray(images.transpose(0, 3, 1, 2)))
+        return outputs
+
     def _DALI_forward(self, data):
         return fn.crop_mirror_normalize(
             data,
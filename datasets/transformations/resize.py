@@ -39,6 +39,19 @@ class Resize(BaseTransformation):
                            interpolation=cv2.INTER_AREA))
         return outputs
 
+    def _CPU_batch_forward(self, data):
+        outputs = []
+        for images in data:
+            if images.shape[1:3] == self.image_size:
+                outputs.append(images)
+                continue
+            outputs.append(np.stack([
+                cv2.resize(image, (self.image_size[1], self.image_size[0]),
+                           interpolation=cv2.INTER_AREA)
+                for image in images
+            ], axis=0))
+        return outputs
+
     def _DALI_forward(self, data):
         return fn.resize(data,
                          resize_y=float(self.image_size[0]),
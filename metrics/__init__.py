@@ -23,6 +23,7 @@ from .equivariance import EQTFracMetric
 from .equivariance import EQTFrac50K
 from .equivariance import EQRMetric
 from .equivariance import EQR50K
+from .multi_gan_metric import MultiGANMetric as MultiGAN
 
 __all__ = ['build_metric']
 
@@ -48,7 +49,8 @@ _METRICS = {
     'EQTFrac': EQTFracMetric,
     'EQTFrac50K': EQTFrac50K,
     'EQR': EQRMetric,
-    'EQR50K': EQR50K
+    'EQR50K': EQR50K,
+    'MultiGAN': MultiGAN
 }
 
 
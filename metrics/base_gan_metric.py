@@ -17,6 +17,7 @@ import torch
 import torch.nn.functional as F
 
 from .base_metric import BaseMetric
+from .feature_cache import FeatureCache
 
 __all__ = ['BaseGANMetric']
 
@@ -31,8 +32,25 @@ class BaseGANMetric(BaseMetric):
     the current replica. Meanwhile, this class will also collect the latent
     codes for all replicas together and save it to `work_dir` to ensure the
     reproducibility.
+
+    Besides, this class provides `self.extract_real_features_with_cache()`,
+    which extracts features from real data and shares them with other metrics
+    through `metrics.feature_cache.FeatureCache`.
+
+    To let multiple metrics share the same synthesized samples (see
+    `metrics/multi_gan_metric.py`), a derived class can declare the outputs it
+    requires from the fake samples with `fake_outputs`, and implement
+    `self.compute_result()`. Within a shared pass, each metric receives the
+    outputs batch by batch via `self.accumulate_fake()`, wrapped by
+    `self.begin_fake_pass()` and `self.end_fake_pass()`. By default, the
+    outputs are gathered from all replicas onto the chief.
     """
 
+    # Names of the outputs required from each batch of fake samples in a shared
+    # pass, among `inception_feature`, `inception_prediction`, and
+    # `perceptual_feature`. Empty means not supporting the shared pass.
+    fake_outputs = ()
+
     def __init__(self,
                  name=None,
                  work_dir=None,
@@ -213,6 +231,144 @@ class BaseGANMetric(BaseMetric):
             assert len(all_labels) == 0
         self.sync()
 
+    def extract_real_features_with_cache(self,
+                                         data_loader,
+                                         real_num,
+                                         extractor,
+                                         extractor_kwargs,
+                                         extract_fn):
+        """Extracts features from the first `real_num` real samples.
+
+        The features are loaded from the shared feature cache if available.
+        Otherwise, they are extracted with `extract_fn` and then saved to the
+        cache, such that all metrics using the same dataset and the same
+        feature extractor can reuse them.
+
+        Args:
+            data_loader: The data loader of real data, which should NOT be
+                shuffled.
+            real_num: Number of real samples to extract features from.
+            extractor: Name of the feature extractor.
+            extractor_kwargs: Keyword arguments that affect the output of the
+                feature extractor.
+            extract_fn: A callable function which takes a batch of images (on
+                GPU) as the input, and returns a batch of features.
+
+        Returns:
+            A `numpy.ndarray` with shape [real_num, ...] on the chief replica,
+                and `None` on other replicas.
+        """
+        if data_loader.shuffle:
+            raise ValueError('Validation dataset should not be shuffled!')
+
+        cache = FeatureCache(data_loader.dataset, extractor, extractor_kwargs)
+        cache_path = cache.find(real_num)
+        if cache_path is not None:
+            self.logger.info(f'Loading statistics of real data from cache '
+                             f'`{cache_path}` {self.log_tail}.')
+            all_features = cache.load(real_num) if self.is_chief else None
+            self.sync()
+            return all_features
+
+        self.logger.info(f'Extracting features with `{extractor}` from real '
+                         f'data {self.log_tail}.',
+                         is_verbose=True)
+        self.logger.init_pbar()
+        pbar_task = self.logger.add_pbar_task('Real', total=real_num)
+        all_features = []
+        batch_size = data_loader.batch_size
+        replica_num = self.get_replica_num(real_num)
+        for batch_idx in range(len(data_loader)):
+            if batch_idx * batch_size >= replica_num:
+                # NOTE: Here, we always go through the entire dataset to make
+                # sure the next evaluator can visit the data loader from the
+                # beginning.
+                _batch_data = next(data_loader)
+                continue
+            with torch.no_grad():
+                batch_data = next(data_loader)['image'].cuda().detach()
+                batch_features = extract_fn(batch_data)
+                gathered_features = self.gather_batch_results(batch_features)
+                self.append_batch_results(gathered_features, all_features)
+            self.logger.update_pbar(pbar_task, batch_size * self.world_size)
+        self.logger.close_pbar()
+        all_features = self.gather_all_results(all_features)[:real_num]
+
+        if self.is_chief:
+            assert all_features.shape[0] == real_num
+            cache_path = cache.save(all_features)
+            self.logger.info(f'Saving statistics of real data to cache '
+                             f'`{cache_path}` {self.log_tail}.')
+        else:
+            assert len(all_features) == 0
+            all_features = None
+        self.sync()
+        return all_features
+
+    def extract_real(self, data_loader):
+        """Extracts whatever required from real data for a shared pass.
+
+        Returns:
+            The results on the chief replica, which will be passed to
+            `self.compute_result()`, and `None` on other replicas.
+        """
+        return None
+
+    def begin_fake_pass(self):
+        """Prepares to accumulate outputs of fake samples in a shared pass."""
+        self._fake_results = {name: [] for name in self.fake_outputs}
+
+    def accumulate_fake(self, outputs, start, end):
+        """Accumulates outputs of a batch of fake samples in a shared pass.
+
+        Args:
+            outputs: A dictionary of batch outputs, containing at least the
+                keys from `self.fake_outputs`.
+            start: Starting position (included) of the batch within the
+                samples of the current replica.
+            end: Ending position (excluded) of the batch within the samples of
+                the current replica.
+        """
+        # The shared pass may contain more samples than required.
+        end = min(end, self.replica_latent_num)
+        if start >= end:
+            return
+        for name in self.fake_outputs:
+            batch_results = outputs[name][:end - start]
+            gathered_results = self.gather_batch_results(batch_results)
+            self.append_batch_results(gathered_results,
+                                      self._fake_results[name])
+
+    def end_fake_pass(self):
+        """Finishes accumulating outputs of fake samples in a shared pass.
+
+        Returns:
+            A dictionary of the gathered outputs on the chief replica, which
+                will be passed to `self.compute_result()`, and `None` on other
+                replicas.
+        """
+        fake_results = dict()
+        for name, result_list in self._fake_results.items():
+            all_results = self.gather_all_results(result_list)
+            fake_results[name] = all_results[:self.latent_num]
+        self._fake_results = None
+        return fake_results if self.is_chief else None
+
+    def compute_result(self, data_loader, real_results, fake_results):
+        """Computes the evaluation result from real and fake results.
+
+        NOTE: This function is only called on the chief replica.
+
+        Args:
+            data_loader: The data loader of real data.
+            real_results: Results returned by `self.extract_real()`.
+            fake_results: Results returned by `self.end_fake_pass()`.
+
+        Returns:
+            The evaluation result, which is a dictionary.
+        """
+        raise NotImplementedError('Should be implemented in derived class!')
+
     def evaluate(self, *args):
         raise NotImplementedError('Should be implemented in derived class!')
 
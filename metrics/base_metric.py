@@ -53,6 +53,8 @@ class BaseMetric(object):
     (7) gather_all_results(): Gather the results from all batches.
     (8) sync(): Synchronize all replicas to make sure they are running into the
         same point.
+    (9) get_valid_mask(): Get the mask of samples that are not padded, which is
+        useful when accumulating results locally without gathering.
 
     For example, the helper function can be used like:
 
@@ -133,6 +135,29 @@ class BaseMetric(object):
             total_num = num
         return indices[self.rank:total_num:self.world_size]
 
+    def get_valid_mask(self, start, end, num):
+        """Gets the mask of valid (i.e., not padded) samples of the replica.
+
+        Samples are distributed to replicas in an interleaved manner (see
+        `self.get_indices()`), hence the `i`-th sample processed by the current
+        replica is the `(i * world_size + rank)`-th one among all replicas.
+        Those beyond `num` are padded ones, which should be excluded when the
+        results are accumulated on each replica instead of being gathered and
+        truncated.
+
+        Args:
+            start: Starting position (included) of the samples within the
+                current replica.
+            end: Ending position (excluded) of the samples within the current
+                replica.
+            num: The total number of samples to process by all replicas.
+
+        Returns:
+            A boolean `numpy.ndarray` with shape [end - start].
+        """
+        positions = np.arange(start, end) * self.world_size + self.rank
+        return positions < num
+
     @staticmethod
     def pad_tensor(tensor, target_num):
         """Pads the first dimension of the input tensor to the target number.
@@ -0,0 +1,174 @@
+# python3.7
+"""Contains the class of the shared cache for real-data features.
+
+Feature-based metrics (e.g., FID, KID, GANPR, and ICFID) all start by
+extracting features from the real data with a particular feature extractor,
+which is usually the most time-consuming part of periodic evaluation. This
+module lets all these metrics share the extracted features through the global
+cache directory (see `utils.misc.get_cache_dir()`).
+
+Each cache is content-addressed by the hash of
+
+(1) the dataset identity, i.e., the absolute path, size, and modification time
+    of the dataset and of the annotation file, together with the file format
+    and the number of items;
+(2) the data transformation settings, i.e., `dataset.transform_kwargs`;
+(3) the feature extractor, i.e., the model name and its keyword arguments.
+
+The number of samples is encoded in the filename instead of the hash. Since real
+features are always extracted from the beginning of the dataset in order, a
+cache with more samples can also serve a request with fewer samples. Caches are
+loaded with memory mapping, hence only the required rows are read from disk.
+
+Besides features, statistics computed from the features (e.g., the mean and
+covariance used by FID) can be cached with a different `suffix`. Such caches
+are only valid for the exact number of samples, so please check them with
+`get_path()` instead of `find()`.
+"""
+
+import os.path
+import glob
+import hashlib
+import json
+import numpy as np
+
+from utils.misc import get_cache_dir
+
+__all__ = ['FeatureCache', 'get_dataset_fingerprint']
+
+
+def _get_file_identity(path):
+    """Gets the identity (path, size, and mtime) of a file or a directory."""
+    if not path or not os.path.exists(path):
+        return path
+    stat = os.stat(path)
+    return dict(path=os.path.abspath(path),
+                size=stat.st_size,
+                mtime=stat.st_mtime)
+
+
+def get_dataset_fingerprint(dataset):
+    """Gets the fingerprint of a dataset, which is used for cache addressing.
+
+    Args:
+        dataset: The dataset to get fingerprint from, which should be derived
+            from `datasets.base_dataset.BaseDataset`.
+
+    Returns:
+        A JSON-serializable dictionary.
+    """
+    return dict(root_dir=_get_file_identity(dataset.root_dir),
+                file_format=dataset.file_format,
+                annotation_path=_get_file_identity(dataset.annotation_path),
+                annotation_meta=dataset.annotation_meta,
+                dataset_samples=dataset.dataset_samples,
+                mirror=dataset.mirror,
+                transform_kwargs=dataset.transform_kwargs)
+
+
+class FeatureCache(object):
+    """Defines the cache of features extracted from a particular dataset.
+
+    Usage:
+
+    ```
+    cache = FeatureCache(dataset, 'InceptionModel', dict(align_tf=True))
+    features = cache.load(num)  # `None` if not cached yet.
+    if features is None:
+        features = extract_features(dataset, num)
+        cache.save(features)
+    ```
+
+    Args:
+        dataset: The dataset from which the features are extracted.
+        extractor: Name of the feature extractor, which also appears in the
+            cache filename.
+        extractor_kwargs: Keyword arguments that affect the output of the
+            feature extractor. (default: None)
+        cache_dir: Directory to save the caches. If not specified, the global
+            cache directory will be used. (default: None)
+    """
+
+    def __init__(self, dataset, extractor, extractor_kwargs=None,
+                 cache_dir=None):
+        self.cache_dir = cache_dir or get_cache_dir()
+        self.extractor = extractor
+        self.extractor_kwargs = extractor_kwargs or dict()
+
+        key = dict(dataset=get_dataset_fingerprint(dataset),
+                   extractor=self.extractor,
+                   extractor_kwargs=self.extractor_kwargs)
+        key = json.dumps(key, sort_keys=True, default=str)
+        self.digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+        dataset_name = os.path.splitext(
+            os.path.basename(os.path.normpath(dataset.root_dir)))[0]
+        self.prefix = f'{dataset_name}_{self.extractor}_{self.digest}'
+
+    def get_path(self, num, suffix='feature'):
+        """Gets the cache path regarding `num` samples.
+
+        Args:
+            num: Number of samples.
+            suffix: Suffix of the cache, which distinguishes different contents
+                extracted with the same extractor. (default: `feature`)
+        """
+        return os.path.join(self.cache_dir,
+                            f'{self.prefix}_{suffix}_{num}.npy')
+
+    def find(self, num, suffix='feature'):
+        """Finds an existing cache that is able to serve `num` samples.
+
+        The cache with exactly `num` samples is preferred. Otherwise, the
+        smallest cache with more than `num` samples is returned.
+
+        Returns:
+            The path to the cache, or `None` if not found.
+        """
+        path = self.get_path(num, suffix)
+        if os.path.isfile(path):
+            return path
+
+        head = os.path.join(self.cache_dir, f'{self.prefix}_{suffix}_')
+        candidates = []
+        for candidate in glob.glob(f'{glob.escape(head)}*.npy'):
+            candidate_num = candidate[len(head):-len('.npy')]
+            if candidate_num.isdigit() and int(candidate_num) >= num:
+                candidates.append((int(candidate_num), candidate))
+        if not candidates:
+            return None
+        return min(candidates)[1]
+
+    def load(self, num, suffix='feature'):
+        """Loads the features of the first `num` samples with memory mapping.
+
+        Returns:
+            A read-only `numpy.ndarray` with shape [num, ...], or `None` if not
+                cached.
+        """
+        path = self.find(num, suffix)
+        if path is None:
+            return None
+        return np.load(path, mmap_mode='r')[:num]
+
+    def save(self, data, suffix='feature', num=None):
+        """Saves the data to the cache atomically.
+
+        Args:
+            data: A `numpy.ndarray` to save.
+            suffix: Suffix of the cache. (default: `feature`)
+            num: Number of samples from which the data is computed. If not
+                specified, the first dimension of `data` is treated as the
+                number of samples. (default: None)
+
+        Returns:
+            The path to the saved cache.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        num = data.shape[0] if num is None else num
+        path = self.get_path(num, suffix)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.save(f, data)
+        os.replace(temp_path, path)
+        return path
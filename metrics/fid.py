@@ -12,9 +12,12 @@ import torch
 import torch.nn.functional as F
 
 from models import build_model
-from utils.misc import get_cache_dir
 from .base_gan_metric import BaseGANMetric
-from .utils import compute_fid_from_feature
+from .feature_cache import FeatureCache
+from .utils import _FID_BACKENDS_ALLOWED
+from .utils import FeatureStats
+from .utils import compute_fid
+from .utils import compute_matrix_sqrt
 
 __all__ = ['FIDMetric', 'FID50K', 'FID50KFull']
 
@@ -24,6 +27,8 @@ FEATURE_DIM = 2048  # Dimension of inception feature.
 class FIDMetric(BaseGANMetric):
     """Defines the class for FID metric computation."""
 
+    fake_outputs = ('inception_feature',)
+
     def __init__(self,
                  name='FID',
                  work_dir=None,
@@ -36,7 +41,9 @@ class FIDMetric(BaseGANMetric):
                  labels=None,
                  seed=0,
                  real_num=-1,
-                 fake_num=-1):
+                 fake_num=-1,
+                 fid_backend='scipy',
+                 check_fid_backend=False):
         """Initializes the class with number of real/fakes samples for FID.
 
         Args:
@@ -45,6 +52,15 @@ class FIDMetric(BaseGANMetric):
                 (default: -1)
             fake_num: Number of fake images used for FID evaluation.
                 (default: -1)
+            fid_backend: Backend to compute FID from statistics, among `scipy`,
+                `numpy`, and `torch`. `scipy` reproduces the numbers reported
+                previously, while the latter two are opt-in, which use
+                eigendecomposition with the square root of the real covariance
+                cached. Please see `metrics/utils.py` for details.
+                (default: `scipy`)
+            check_fid_backend: Whether to additionally compute FID with the
+                `scipy` backend and report the deviation, which is useful for
+                verifying the accuracy of other backends. (default: False)
         """
         super().__init__(name=name,
                          work_dir=work_dir,
@@ -59,66 +75,113 @@ class FIDMetric(BaseGANMetric):
                          seed=seed)
         self.real_num = real_num
         self.fake_num = fake_num
+        if fid_backend not in _FID_BACKENDS_ALLOWED:
+            raise ValueError(f'Invalid FID backend: `{fid_backend}`!\n'
+                             f'Backends allowed: {_FID_BACKENDS_ALLOWED}.')
+        self.fid_backend = fid_backend
+        self.check_fid_backend = check_fid_backend
 
         # Build inception model for feature extraction.
         self.inception_model = build_model('InceptionModel', align_tf=True)
 
-    def extract_real_features(self, data_loader):
-        """Extracts inception features from real data."""
+    def get_real_num(self, data_loader):
+        """Gets the number of real samples used for evaluation."""
         if self.real_num < 0:
-            real_num = len(data_loader.dataset)
-        else:
-            real_num = min(self.real_num, len(data_loader.dataset))
-
-        dataset_name = os.path.splitext(
-            os.path.basename(data_loader.dataset.root_dir))[0]
-        cache_name = f'{dataset_name}_{real_num}_inception_feature.npy'
-        cache_path = os.path.join(get_cache_dir(), cache_name)
-
-        if os.path.exists(cache_path):
+            return len(data_loader.dataset)
+        return min(self.real_num, len(data_loader.dataset))
+
+    @staticmethod
+    def get_real_cache(data_loader):
+        """Gets the shared cache regarding real data."""
+        return FeatureCache(data_loader.dataset,
+                            extractor='InceptionModel',
+                            extractor_kwargs=dict(align_tf=True))
+
+    def extract_real_stats(self, data_loader):
+        """Extracts statistics of inception features from real data.
+
+        The statistics are cached as the mean and the covariance only. If they
+        are not cached yet, they are computed from the shared real-feature
+        cache if available, or otherwise accumulated in a streaming manner.
+
+        Returns:
+            A two-element tuple, i.e., the mean and the covariance, on the chief
+                replica, and `None` on other replicas.
+        """
+        real_num = self.get_real_num(data_loader)
+        cache = self.get_real_cache(data_loader)
+        mean_path = cache.get_path(real_num, suffix='mean')
+        cov_path = cache.get_path(real_num, suffix='cov')
+        if os.path.isfile(mean_path) and os.path.isfile(cov_path):
             self.logger.info(f'Loading statistics of real data from cache '
-                             f'`{cache_path}` {self.log_tail}.')
-            all_features = np.load(cache_path) if self.is_chief else None
+                             f'`{mean_path}` and `{cov_path}` '
+                             f'{self.log_tail}.')
+            if self.is_chief:
+                real_stats = (np.load(mean_path), np.load(cov_path))
+            else:
+                real_stats = None
             self.sync()
-            return all_features
-
-        self.logger.info(f'Extracting inception features from real data '
-                         f'{self.log_tail}.',
-                         is_verbose=True)
-        self.logger.init_pbar()
-        pbar_task = self.logger.add_pbar_task('Real', total=real_num)
-        all_features = []
-        batch_size = data_loader.batch_size
-        replica_num = self.get_replica_num(real_num)
-        for batch_idx in range(len(data_loader)):
-            if batch_idx * batch_size >= replica_num:
-                # NOTE: Here, we always go through the entire dataset to make
-                # sure the next evaluator can visit the data loader from the
-                # beginning.
-                _batch_data = next(data_loader)
-                continue
-            with torch.no_grad():
-                batch_data = next(data_loader)['image'].cuda().detach()
-                batch_features = self.inception_model(batch_data)
-                gathered_features = self.gather_batch_results(batch_features)
-                self.append_batch_results(gathered_features, all_features)
-            self.logger.update_pbar(pbar_task, batch_size * self.world_size)
-        self.logger.close_pbar()
-        all_features = self.gather_all_results(all_features)[:real_num]
+            return real_stats
+
+        feature_path = cache.find(real_num)
+        if feature_path is not None:
+            self.logger.info(f'Computing statistics of real data from cache '
+                             f'`{feature_path}` {self.log_tail}.')
+            if self.is_chief:
+                stats = FeatureStats(FEATURE_DIM)
+                features = cache.load(real_num)
+                for start in range(0, real_num, self.batch_size):
+                    stats.update(features[start:start + self.batch_size])
+        else:
+            self.logger.info(f'Extracting inception features from real data '
+                             f'{self.log_tail}.',
+                             is_verbose=True)
+            self.logger.init_pbar()
+            pbar_task = self.logger.add_pbar_task('Real', total=real_num)
+            stats = FeatureStats(FEATURE_DIM, device=self.device)
+            batch_size = data_loader.batch_size
+            replica_num = self.get_replica_num(real_num)
+            for batch_idx in range(len(data_loader)):
+                if batch_idx * batch_size >= replica_num:
+                    # NOTE: Here, we always go through the entire dataset to
+                    # make sure the next evaluator can visit the data loader
+                    # from the beginning.
+                    _batch_data = next(data_loader)
+                    continue
+                with torch.no_grad():
+                    batch_data = next(data_loader)['image'].cuda().detach()
+                    batch_features = self.inception_model(batch_data)
+                    start = batch_idx * batch_size
+                    end = start + batch_features.shape[0]
+                    valid = self.get_valid_mask(start, end, real_num)
+                    stats.update(batch_features[torch.from_numpy(valid)])
+                self.logger.update_pbar(pbar_task, batch_size * self.world_size)
+            self.logger.close_pbar()
+            stats.all_reduce()
 
-        self.logger.info(f'Saving statistics of real data to cache '
-                         f'`{cache_path}` {self.log_tail}.')
         if self.is_chief:
-            assert all_features.shape == (real_num, FEATURE_DIM)
-            np.save(cache_path, all_features)
+            assert stats.num == real_num
+            real_stats = stats.get_mean_cov()
+            cache.save(real_stats[0], suffix='mean', num=real_num)
+            cache.save(real_stats[1], suffix='cov', num=real_num)
+            self.logger.info(f'Saving statistics of real data to cache '
+                             f'`{mean_path}` and `{cov_path}` '
+                             f'{self.log_tail}.')
         else:
-            assert len(all_features) == 0
-            all_features = None
+            real_stats = None
         self.sync()
-        return all_features
+        return real_stats
+
+    def extract_fake_stats(self, generator, generator_kwargs):
+        """Extracts statistics of inception features from fake data.
+
+        Features are accumulated on each replica in a streaming manner and
+        then merged with a single all-reduce, without gathering.
 
-    def extract_fake_features(self, generator, generator_kwargs):
-        """Extracts inception features from fake data."""
+        Returns:
+            A two-element tuple, i.e., the mean and the covariance, on the chief
+                replica, and `None` on other replicas.
+        """
         fake_num = self.fake_num
         batch_size = self.batch_size
         if self.random_latents:
@@ -144,7 +207,7 @@ class FIDMetric(BaseGANMetric):
                          is_verbose=True)
         self.logger.init_pbar()
         pbar_task = self.logger.add_pbar_task('Fake', total=fake_num)
-        all_features = []
+        stats = FeatureStats(FEATURE_DIM, device=self.device)
         for start in range(0, self.replica_latent_num, batch_size):
             end = min(start + batch_size, self.replica_latent_num)
             with torch.no_grad():
@@ -167,32 +230,95 @@ class FIDMetric(BaseGANMetric):
                     batch_labels = labels[start:end].cuda().detach()
                 batch_images = G(batch_codes, batch_labels, **G_kwargs)['image']
                 batch_features = self.inception_model(batch_images)
-                gathered_features = self.gather_batch_results(batch_features)
-                self.append_batch_results(gathered_features, all_features)
+                valid = self.get_valid_mask(start, end, fake_num)
+                stats.update(batch_features[torch.from_numpy(valid)])
             self.logger.update_pbar(pbar_task, (end - start) * self.world_size)
         self.logger.close_pbar()
-        all_features = self.gather_all_results(all_features)[:fake_num]
+        stats.all_reduce()
 
         if self.is_chief:
-            assert all_features.shape == (fake_num, FEATURE_DIM)
+            assert stats.num == fake_num
+            fake_stats = stats.get_mean_cov()
         else:
-            assert len(all_features) == 0
-            all_features = None
+            fake_stats = None
 
         if G_mode:
             G.train()  # restore model training mode.
 
         self.sync()
-        return all_features
+        return fake_stats
+
+    def get_real_cov_sqrt(self, data_loader, real_cov):
+        """Gets the square root of the real covariance.
+
+        As it only depends on real data, the square root is computed once and
+        then cached. This function should be called by the chief only.
+        """
+        cache = self.get_real_cache(data_loader)
+        cache_path = cache.get_path(self.get_real_num(data_loader),
+                                    suffix='cov_sqrt')
+        if os.path.isfile(cache_path):
+            return np.load(cache_path)
+        real_cov_sqrt = compute_matrix_sqrt(real_cov, backend=self.fid_backend)
+        cache.save(real_cov_sqrt, suffix='cov_sqrt',
+                   num=self.get_real_num(data_loader))
+        return real_cov_sqrt
+
+    def extract_real(self, data_loader):
+        return self.extract_real_stats(data_loader)
+
+    def begin_fake_pass(self):
+        """Accumulates statistics instead of gathering features."""
+        self._fake_stats = FeatureStats(FEATURE_DIM, device=self.device)
+
+    def accumulate_fake(self, outputs, start, end):
+        end = min(end, self.replica_latent_num)
+        if start >= end:
+            return
+        batch_features = outputs['inception_feature'][:end - start]
+        valid = self.get_valid_mask(start, end, self.fake_num)
+        self._fake_stats.update(batch_features[torch.from_numpy(valid)])
+
+    def end_fake_pass(self):
+        stats = self._fake_stats
+        self._fake_stats = None
+        stats.all_reduce()
+        if not self.is_chief:
+            return None
+        assert stats.num == self.fake_num
+        return stats.get_mean_cov()
+
+    def compute_result(self, data_loader, real_results, fake_results):
+        real_stats = real_results
+        fake_stats = fake_results
+        real_cov_sqrt = None
+        if self.fid_backend != 'scipy':
+            real_cov_sqrt = self.get_real_cov_sqrt(data_loader, real_stats[1])
+        start_time = time.time()
+        fid = compute_fid(*fake_stats, *real_stats,
+                          backend=self.fid_backend,
+                          real_cov_sqrt=real_cov_sqrt)
+        fid_time = time.time() - start_time
+        if self.check_fid_backend:
+            start_time = time.time()
+            ref_fid = compute_fid(*fake_stats, *real_stats, backend='scipy')
+            ref_time = time.time() - start_time
+            deviation = abs(fid - ref_fid)
+            self.logger.info(
+                f'FID with backend `{self.fid_backend}`: {fid:.6f} '
+                f'({fid_time:.3f}s), with backend `scipy`: {ref_fid:.6f} '
+                f'({ref_time:.3f}s), absolute deviation: {deviation:.3e}, '
+                f'relative deviation: {deviation / abs(ref_fid):.3e} '
+                f'{self.log_tail}.')
+        return {self.name: fid}
 
     def evaluate(self, data_loader, generator, generator_kwargs):
-        real_features = self.extract_real_features(data_loader)
-        fake_features = self.extract_fake_features(generator, generator_kwargs)
+        real_stats = self.extract_real_stats(data_loader)
+        fake_stats = self.extract_fake_stats(generator, generator_kwargs)
         if self.is_chief:
-            fid = compute_fid_from_feature(fake_features, real_features)
-            result = {self.name: fid}
+            result = self.compute_result(data_loader, real_stats, fake_stats)
         else:
-            assert real_features is None and fake_features is None
+            assert real_stats is None and fake_stats is None
             result = None
         self.sync()
         return result
@@ -237,6 +363,7 @@ class FIDMetric(BaseGANMetric):
         metric_info = super().info()
         metric_info['Num real samples'] = self.real_num
         metric_info['Num fake samples'] = self.fake_num
+        metric_info['FID backend'] = self.fid_backend
         return metric_info
 
 
@@ -256,7 +383,9 @@ class FID50K(FIDMetric):
                  latent_codes=None,
                  label_dim=0,
                  labels=None,
-                 seed=0):
+                 seed=0,
+                 fid_backend='scipy',
+                 check_fid_backend=False):
         super().__init__(name=name,
                          work_dir=work_dir,
                          logger=logger,
@@ -268,7 +397,9 @@ class FID50K(FIDMetric):
                          labels=labels,
                          seed=seed,
                          real_num=50_000,
-                         fake_num=50_000)
+                         fake_num=50_000,
+                         fid_backend=fid_backend,
+                         check_fid_backend=check_fid_backend)
 
 
 class FID50KFull(FIDMetric):
@@ -288,7 +419,9 @@ class FID50KFull(FIDMetric):
                  latent_codes=None,
                  label_dim=0,
                  labels=None,
-                 seed=0):
+                 seed=0,
+                 fid_backend='scipy',
+                 check_fid_backend=False):
         super().__init__(name=name,
                          work_dir=work_dir,
                          logger=logger,
@@ -300,4 +433,6 @@ class FID50KFull(FIDMetric):
                          labels=labels,
                          seed=seed,
                          real_num=-1,
-                         fake_num=50_000)
+                         fake_num=50_000,
+                         fid_backend=fid_backend,
+                         check_fid_backend=check_fid_backend)
@@ -14,18 +14,25 @@ import torch
 import torch.nn.functional as F
 
 from models import build_model
-from utils.misc import get_cache_dir
 from .base_gan_metric import BaseGANMetric
+from .feature_cache import FeatureCache
 from .utils import compute_gan_precision_recall
+from .utils import compute_gan_precision_recall_knn
+from .utils import compute_knn_radii
 
 __all__ = ['GANPRMetric', 'GANPR50K', 'GANPR50KFull']
 
 FEATURE_DIM = 4096  # Dimension of perceptual feature from VGG16.
+EXTRACTOR_KWARGS = dict(no_top=False,
+                        resize_input=True,
+                        return_tensor='feature')  # Used for cache addressing.
 
 
 class GANPRMetric(BaseGANMetric):
     """Defines the class for precision-recall metric for GAN evaluation."""
 
+    fake_outputs = ('perceptual_feature',)
+
     def __init__(self,
                  name='GANPR',
                  work_dir=None,
@@ -40,7 +47,8 @@ class GANPRMetric(BaseGANMetric):
                  real_num=-1,
                  fake_num=-1,
                  chunk_size=10000,
-                 top_k=3):
+                 top_k=3,
+                 use_knn_index=True):
         """Initializes the class with number of real/fakes samples for GANPR.
 
         Args:
@@ -53,6 +61,11 @@ class GANPRMetric(BaseGANMetric):
                 save memory. (default: 10000)
             top_k: Hyper-parameter for precision-recall computation.
                 (default: 3)
+            use_knn_index: Whether to compute precision and recall with k-NN
+                radii, which streams the top-k over chunks instead of
+                concatenating full rows of distances, and skips probes that
+                have already hit the manifold. The radii of the real manifold
+                are cached and reused across evaluations. (default: True)
         """
         super().__init__(name=name,
                          work_dir=work_dir,
@@ -69,6 +82,7 @@ class GANPRMetric(BaseGANMetric):
         self.fake_num = fake_num
         self.chunk_size = chunk_size
         self.top_k = top_k
+        self.use_knn_index = use_knn_index
 
         # Build perceptual model for feature extraction.
         self.perceptual_model = build_model(
@@ -81,52 +95,15 @@ class GANPRMetric(BaseGANMetric):
         else:
             real_num = min(self.real_num, len(data_loader.dataset))
 
-        dataset_name = os.path.splitext(
-            os.path.basename(data_loader.dataset.root_dir))[0]
-        cache_name = f'{dataset_name}_{real_num}_perceptual_feature.npy'
-        cache_path = os.path.join(get_cache_dir(), cache_name)
-
-        if os.path.exists(cache_path):
-            self.logger.info(f'Loading statistics of real data from cache '
-                             f'`{cache_path}` {self.log_tail}.')
-            all_features = np.load(cache_path) if self.is_chief else None
-            self.sync()
-            return all_features
-
-        self.logger.info(f'Extracting perceptual features from real data '
-                         f'{self.log_tail}.',
-                         is_verbose=True)
-        self.logger.init_pbar()
-        pbar_task = self.logger.add_pbar_task('Real', total=real_num)
-        all_features = []
-        batch_size = data_loader.batch_size
-        replica_num = self.get_replica_num(real_num)
-        for batch_idx in range(len(data_loader)):
-            if batch_idx * batch_size >= replica_num:
-                # NOTE: Here, we always go through the entire dataset to make
-                # sure the next evaluator can visit the data loader from the
-                # beginning.
-                _batch_data = next(data_loader)
-                continue
-            with torch.no_grad():
-                batch_data = next(data_loader)['image'].cuda().detach()
-                batch_features = self.perceptual_model(
-                    batch_data, resize_input=True, return_tensor='feature')
-                gathered_features = self.gather_batch_results(batch_features)
-                self.append_batch_results(gathered_features, all_features)
-            self.logger.update_pbar(pbar_task, batch_size * self.world_size)
-        self.logger.close_pbar()
-        all_features = self.gather_all_results(all_features)[:real_num]
-
-        self.logger.info(f'Saving statistics of real data to cache '
-                         f'`{cache_path}` {self.log_tail}.')
+        all_features = self.extract_real_features_with_cache(
+            data_loader=data_loader,
+            real_num=real_num,
+            extractor='PerceptualModel',
+            extractor_kwargs=EXTRACTOR_KWARGS,
+            extract_fn=lambda x: self.perceptual_model(
+                x, resize_input=True, return_tensor='feature'))
         if self.is_chief:
             assert all_features.shape == (real_num, FEATURE_DIM)
-            np.save(cache_path, all_features)
-        else:
-            assert len(all_features) == 0
-            all_features = None
-        self.sync()
         return all_features
 
     def extract_fake_features(self, generator, generator_kwargs):
@@ -198,16 +175,53 @@ class GANPRMetric(BaseGANMetric):
         self.sync()
         return all_features
 
+    def get_real_radii(self, data_loader, real_features):
+        """Gets the k-NN radii of the real manifold.
+
+        As it only depends on real data, the radii are computed once and then
+        cached. This function should be called by the chief only.
+        """
+        cache = FeatureCache(data_loader.dataset,
+                             extractor='PerceptualModel',
+                             extractor_kwargs=EXTRACTOR_KWARGS)
+        real_num = real_features.shape[0]
+        cache_path = cache.get_path(real_num, suffix=f'knn{self.top_k}_radii')
+        if os.path.isfile(cache_path):
+            self.logger.info(f'Loading k-NN radii of real data from cache '
+                             f'`{cache_path}` {self.log_tail}.')
+            return np.load(cache_path)
+        real_radii = compute_knn_radii(real_features, self.top_k,
+                                       self.chunk_size)
+        cache.save(real_radii, suffix=f'knn{self.top_k}_radii', num=real_num)
+        return real_radii
+
+    def extract_real(self, data_loader):
+        return self.extract_real_features(data_loader)
+
+    def compute_result(self, data_loader, real_results, fake_results):
+        real_features = real_results
+        fake_features = fake_results['perceptual_feature']
+        assert fake_features.shape == (self.fake_num, FEATURE_DIM)
+        if self.use_knn_index:
+            real_radii = self.get_real_radii(data_loader, real_features)
+            precision, recall = compute_gan_precision_recall_knn(
+                fake_features, real_features, self.chunk_size, self.top_k,
+                real_radii=real_radii)
+        else:
+            precision, recall = compute_gan_precision_recall(
+                fake_features, real_features, self.chunk_size, self.top_k)
+        return {
+            f'{self.name}_precision': precision,
+            f'{self.name}_recall': recall
+        }
+
     def evaluate(self, data_loader, generator, generator_kwargs):
         real_features = self.extract_real_features(data_loader)
         fake_features = self.extract_fake_features(generator, generator_kwargs)
         if self.is_chief:
-            precision, recall = compute_gan_precision_recall(
-                fake_features, real_features, self.chunk_size, self.top_k)
-            result = {
-                f'{self.name}_precision': precision,
-                f'{self.name}_recall': recall
-            }
+            result = self.compute_result(
+                data_loader, real_features,
+                dict(perceptual_feature=fake_features))
         else:
             assert real_features is None and fake_features is None
             result = None
@@ -265,6 +279,7 @@ class GANPRMetric(BaseGANMetric):
         metric_info['Num fake samples'] = self.fake_num
         metric_info['Chuck size for computation'] = self.chunk_size
         metric_info['Top-k for positive hitting'] = self.top_k
+        metric_info['Use k-NN index'] = self.use_knn_index
         return metric_info
 
 
@@ -286,7 +301,8 @@ class GANPR50K(GANPRMetric):
                  labels=None,
                  seed=0,
                  chunk_size=10000,
-                 top_k=3):
+                 top_k=3,
+                 use_knn_index=True):
         super().__init__(name=name,
                          work_dir=work_dir,
                          logger=logger,
@@ -300,7 +316,8 @@ class GANPR50K(GANPRMetric):
                          real_num=50_000,
                          fake_num=50_000,
                          chunk_size=chunk_size,
-                         top_k=top_k)
+                         top_k=top_k,
+                         use_knn_index=use_knn_index)
 
 
 class GANPR50KFull(GANPRMetric):
@@ -322,7 +339,8 @@ class GANPR50KFull(GANPRMetric):
                  labels=None,
                  seed=0,
                  chunk_size=10000,
-                 top_k=3):
+                 top_k=3,
+                 use_knn_index=True):
         super().__init__(name=name,
                          work_dir=work_dir,
                          logger=logger,
@@ -336,4 +354,5 @@ class GANPR50KFull(GANPRMetric):
                          real_num=200_000,
                          fake_num=50_000,
                          chunk_size=chunk_size,
-                         top_k=top_k)
+                         top_k=top_k,
+                         use_knn_index=use_knn_index)
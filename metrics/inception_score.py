@@ -25,6 +25,8 @@ PROBS_DIM = 1008  # Dimension of predicted probabilities.
 class ISMetric(BaseGANMetric):
     """Defines the class for IS metric computation."""
 
+    fake_outputs = ('inception_prediction',)
+
     def __init__(self,
                  name='IS',
                  work_dir=None,
@@ -133,11 +135,17 @@ class ISMetric(BaseGANMetric):
         self.sync()
         return all_probs
 
+    def compute_result(self, data_loader, real_results, fake_results):
+        probs = fake_results['inception_prediction']
+        assert probs.shape == (self.latent_num, PROBS_DIM)
+        is_mean, is_std = compute_is(probs, self.num_splits)
+        return {f'{self.name}_mean': is_mean, f'{self.name}_std': is_std}
+
     def evaluate(self, _data_loader, generator, generator_kwargs):
         probs = self.extract_fake_probs(generator, generator_kwargs)
         if self.is_chief:
-            is_mean, is_std = compute_is(probs, self.num_splits)
-            result = {f'{self.name}_mean': is_mean, f'{self.name}_std': is_std}
+            result = self.compute_result(
+                _data_loader, None, dict(inception_prediction=probs))
         else:
             assert probs is None
             result = None
@@ -12,7 +12,6 @@ import torch
 import torch.nn.functional as F
 
 from models import build_model
-from utils.misc import get_cache_dir
 from .base_gan_metric import BaseGANMetric
 from .utils import compute_fid_from_feature
 
@@ -90,27 +89,6 @@ class ICFIDMetric(BaseGANMetric):
 
     def extract_real_features(self, data_loader):
         """Extracts inception features from real data."""
-        # Load real features cache if available.
-        dataset_name = os.path.splitext(
-            os.path.basename(data_loader.dataset.root_dir))[0]
-        if self.real_num_per_cls <= 0:
-            cache_name = (f'{dataset_name}-label{self.interested_classes}-'
-                          f'all-inception_features.npy')
-        else:
-            cache_name = (f'{dataset_name}-label{self.interested_classes}-'
-                          f'{self.real_num_per_cls}each-inception_features.npy')
-        cache_path = os.path.join(get_cache_dir(), cache_name.replace(' ', ''))
-
-        if os.path.exists(cache_path):
-            self.logger.info(f'Loading statistics of real data from cache '
-                             f'`{cache_path}` {self.log_tail}.')
-            if self.is_chief:
-                feature_dict = np.load(cache_path, allow_pickle=True).item()
-            else:
-                feature_dict = None
-            self.sync()
-            return feature_dict
-
         dataset = data_loader.dataset
         if dataset.mirror:
             raise ValueError('Validation dataset should not be mirrored!')
@@ -159,56 +137,27 @@ class ICFIDMetric(BaseGANMetric):
                     # Stop traversing if already having enough samples.
                     break
 
-        # Get the amount of real samples need to be processed by each replica.
-        replica_real_num = self.get_replica_num(max(ends_at.values()))
+        # Features of the first `real_num` samples cover all interested
+        # samples, which are shared with other metrics through cache.
+        real_num = max(ends_at.values())
+        all_features = self.extract_real_features_with_cache(
+            data_loader=data_loader,
+            real_num=real_num,
+            extractor='InceptionModel',
+            extractor_kwargs=dict(align_tf=True),
+            extract_fn=self.inception_model)
+        if not self.is_chief:
+            assert all_features is None
+            return None
 
-        # Prepare real samples.
-        self.logger.info(f'Extracting inception features from real data '
-                         f'{self.log_tail}.',
-                         is_verbose=True)
-        self.logger.init_pbar()
-        pbar_task = self.logger.add_pbar_task('Real', total=len(data_loader))
-        feature_dict = {cls_id: list() for cls_id in self.interested_classes}
-        batch_size = data_loader.batch_size
-        for batch_idx in range(len(data_loader)):
-            if batch_idx * batch_size >= replica_real_num:
-                # NOTE: Here, we always go through the entire dataset to make
-                # sure the next evaluator can visit the data loader from the
-                # beginning.
-                _batch_data = next(data_loader)
-                continue
-            with torch.no_grad():
-                batch_data = next(data_loader)
-                batch_images = batch_data['image'].cuda().detach()
-                batch_labels = batch_data['raw_label']
-                batch_features = self.inception_model(batch_images)
-                gathered_labels = self.gather_batch_results(batch_labels)
-                gathered_features = self.gather_batch_results(batch_features)
-                if not self.is_chief:  # Skip if not chief.
-                    assert not gathered_features and not gathered_labels
-                    continue
-                for feature, cls_id in zip(gathered_features, gathered_labels):
-                    if cls_id not in self.interested_classes:
-                        continue
-                    if len(feature_dict[cls_id]) < cut_offs[cls_id]:
-                        feature_dict[cls_id].append(feature[np.newaxis, :])
-            self.logger.update_pbar(pbar_task, batch_size * self.world_size)
-        self.logger.close_pbar()
+        # Group features by class. Samples of each class before its stopping
+        # point are exactly the interested ones.
+        labels = np.array([item[1] for item in dataset.items[:real_num]])
+        feature_dict = dict()
         for cls_id in self.interested_classes:
-            feature_dict[cls_id] = self.gather_all_results(feature_dict[cls_id])
-
-        # Save cache.
-        self.logger.info(f'Saving statistics of real data to cache '
-                         f'`{cache_path}` {self.log_tail}.')
-        if self.is_chief:
-            assert all(
-                feature_dict[cls_id].shape == (cut_offs[cls_id], FEATURE_DIM)
-                for cls_id in self.interested_classes)
-            np.save(cache_path, feature_dict)
-        else:
-            assert all(len(feature) == 0 for feature in feature_dict.values())
-            feature_dict = None
-        self.sync()
+            indices = np.nonzero(labels == cls_id)[0][:cut_offs[cls_id]]
+            feature_dict[cls_id] = np.asarray(all_features[indices])
+            assert feature_dict[cls_id].shape == (cut_offs[cls_id], FEATURE_DIM)
         return feature_dict
 
     def extract_fake_features(self, generator, generator_kwargs, cls_id):
@@ -14,9 +14,8 @@ import torch
 import torch.nn.functional as F
 
 from models import build_model
-from utils.misc import get_cache_dir
 from .base_gan_metric import BaseGANMetric
-from .utils import compute_kid_from_feature
+from .utils import compute_kid_batched
 
 __all__ = ['KIDMetric', 'KID50K', 'KID50KFull']
 
@@ -26,6 +25,8 @@ FEATURE_DIM = 2048  # Dimension of inception feature
 class KIDMetric(BaseGANMetric):
     """Defines the class for KID metric computation."""
 
+    fake_outputs = ('inception_feature',)
+
     def __init__(self,
                  name='KID',
                  work_dir=None,
@@ -40,7 +41,8 @@ class KIDMetric(BaseGANMetric):
                  real_num=-1,
                  fake_num=-1,
                  num_subsets=50,
-                 max_subset_size=1000):
+                 max_subset_size=1000,
+                 kid_backend='numpy'):
         """Initializes the class for KID.
 
         Args:
@@ -52,6 +54,10 @@ class KIDMetric(BaseGANMetric):
             num_subsets: Number of subsets. (default: 50, aligned with official
                 KID)
             max_subset_size: The maximum size of a subset. (default: 1000)
+            kid_backend: Backend to compute KID from features, `numpy` or
+                `torch`. Subsets are drawn with `seed` and evaluated in
+                batches. Please see `compute_kid_batched()` in
+                `metrics/utils.py` for details. (default: `numpy`)
         """
         super().__init__(name=name,
                          work_dir=work_dir,
@@ -68,6 +74,7 @@ class KIDMetric(BaseGANMetric):
         self.fake_num = fake_num
         self.num_subsets = num_subsets
         self.max_subset_size = max_subset_size
+        self.kid_backend = kid_backend
 
         # Build inception model for feature extraction.
         self.inception_model = build_model('InceptionModel', align_tf=True)
@@ -79,51 +86,14 @@ class KIDMetric(BaseGANMetric):
         else:
             real_num = min(self.real_num, len(data_loader.dataset))
 
-        dataset_name = os.path.splitext(
-            os.path.basename(data_loader.dataset.root_dir))[0]
-        cache_name = f'{dataset_name}_{real_num}_inception_feature.npy'
-        cache_path = os.path.join(get_cache_dir(), cache_name)
-
-        if os.path.exists(cache_path):
-            self.logger.info(f'Loading statistics of real data from cache '
-                             f'`{cache_path}` {self.log_tail}.')
-            all_features = np.load(cache_path) if self.is_chief else None
-            self.sync()
-            return all_features
-
-        self.logger.info(f'Extracting inception features from real data '
-                         f'{self.log_tail}.',
-                         is_verbose=True)
-        self.logger.init_pbar()
-        pbar_task = self.logger.add_pbar_task('Real', total=real_num)
-        all_features = []
-        batch_size = data_loader.batch_size
-        replica_num = self.get_replica_num(real_num)
-        for batch_idx in range(len(data_loader)):
-            if batch_idx * batch_size >= replica_num:
-                # NOTE: Here, we always go through the entire dataset to make
-                # sure the next evaluator can visit the data loader from the
-                # beginning.
-                _batch_data = next(data_loader)
-                continue
-            with torch.no_grad():
-                batch_data = next(data_loader)['image'].cuda().detach()
-                batch_features = self.inception_model(batch_data)
-                gathered_features = self.gather_batch_results(batch_features)
-                self.append_batch_results(gathered_features, all_features)
-            self.logger.update_pbar(pbar_task, batch_size * self.world_size)
-        self.logger.close_pbar()
-        all_features = self.gather_all_results(all_features)[:real_num]
-
-        self.logger.info(f'Saving statistics of real data to cache '
-                         f'`{cache_path}` {self.log_tail}.')
+        all_features = self.extract_real_features_with_cache(
+            data_loader=data_loader,
+            real_num=real_num,
+            extractor='InceptionModel',
+            extractor_kwargs=dict(align_tf=True),
+            extract_fn=self.inception_model)
         if self.is_chief:
             assert all_features.shape == (real_num, FEATURE_DIM)
-            np.save(cache_path, all_features)
-        else:
-            assert len(all_features) == 0
-            all_features = None
-        self.sync()
         return all_features
 
     def extract_fake_features(self, generator, generator_kwargs):
@@ -194,15 +164,27 @@ class KIDMetric(BaseGANMetric):
         self.sync()
         return all_features
 
+    def extract_real(self, data_loader):
+        return self.extract_real_features(data_loader)
+
+    def compute_result(self, data_loader, real_results, fake_results):
+        fake_features = fake_results['inception_feature']
+        assert fake_features.shape == (self.fake_num, FEATURE_DIM)
+        kid = compute_kid_batched(fake_features,
+                                  real_results,
+                                  num_subsets=self.num_subsets,
+                                  max_subset_size=self.max_subset_size,
+                                  seed=self.seed,
+                                  backend=self.kid_backend)
+        return {self.name: kid}
+
     def evaluate(self, data_loader, generator, generator_kwargs):
         real_features = self.extract_real_features(data_loader)
         fake_features = self.extract_fake_features(generator, generator_kwargs)
         if self.is_chief:
-            kid = compute_kid_from_feature(fake_features,
-                                           real_features,
-                                           num_subsets=self.num_subsets,
-                                           max_subset_size=self.max_subset_size)
-            result = {self.name: kid}
+            result = self.compute_result(
+                data_loader, real_features,
+                dict(inception_feature=fake_features))
         else:
             assert real_features is None and fake_features is None
             result = None
@@ -251,6 +233,7 @@ class KIDMetric(BaseGANMetric):
         metric_info['Num fake samples'] = self.fake_num
         metric_info['Num subsets'] = self.num_subsets
         metric_info['Max size of each subset'] = self.max_subset_size
+        metric_info['KID backend'] = self.kid_backend
         return metric_info
 
 
@@ -271,7 +254,8 @@ class KID50K(KIDMetric):
                  labels=None,
                  seed=0,
                  num_subsets=100,
-                 max_subset_size=1000):
+                 max_subset_size=1000,
+                 kid_backend='numpy'):
         super().__init__(name=name,
                          work_dir=work_dir,
                          logger=logger,
@@ -285,7 +269,8 @@ class KID50K(KIDMetric):
                          real_num=50_000,
                          fake_num=50_000,
                          num_subsets=num_subsets,
-                         max_subset_size=max_subset_size)
+                         max_subset_size=max_subset_size,
+                         kid_backend=kid_backend)
 
 
 class KID50KFull(KIDMetric):
@@ -306,7 +291,8 @@ class KID50KFull(KIDMetric):
                  labels=None,
                  seed=0,
                  num_subsets=100,
-                 max_subset_size=1000):
+                 max_subset_size=1000,
+                 kid_backend='numpy'):
         super().__init__(name=name,
                          work_dir=work_dir,
                          logger=logger,
@@ -320,4 +306,5 @@ class KID50KFull(KIDMetric):
                          real_num=1_000_000,
                          fake_num=50_000,
                          num_subsets=num_subsets,
-                         max_subset_size=max_subset_size)
+                         max_subset_size=max_subset_size,
+                         kid_backend=kid_backend)
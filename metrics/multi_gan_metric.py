@@ -0,0 +1,275 @@
+# python3.7
+"""Contains the class to evaluate GANs with multiple metrics in one pass.
+
+Evaluating FID, KID, IS, and GANPR separately requires to synthesize the fake
+samples and to run the feature extractors once per metric, even though all of
+them use the same generator with the same latent codes. This class wraps these
+metrics, synthesizes each batch of fake samples ONCE, runs each required
+feature extractor ONCE (e.g., the inception features and predictions come from
+the same forward pass), and fans the outputs out to all wrapped metrics. Real
+data is handled by each wrapped metric, which shares the extracted features
+through the real-feature cache (see `metrics/feature_cache.py`).
+
+The wrapped metrics keep their own names, hence the results (including the
+text files and the TensorBoard scalars) are the same as evaluating them
+separately, e.g.,
+
+```
+metrics = dict(
+    MultiGAN=dict(init_kwargs=dict(metrics=dict(FID50K=dict(),
+                                                 KID50K=dict(),
+                                                 GANPR50K=dict())),
+                  eval_kwargs=dict(generator_smooth=dict()),
+                  interval=None,
+                  first_iter=None,
+                  save_best=True)
+)
+```
+"""
+
+import numpy as np
+
+import torch
+import torch.nn.functional as F
+
+from models import build_model
+from .base_gan_metric import BaseGANMetric
+from .fid import FIDMetric
+from .fid import FID50K
+from .fid import FID50KFull
+from .inception_score import ISMetric
+from .inception_score import IS50K
+from .kid import KIDMetric
+from .kid import KID50K
+from .kid import KID50KFull
+from .gan_pr import GANPRMetric
+from .gan_pr import GANPR50K
+from .gan_pr import GANPR50KFull
+
+__all__ = ['MultiGANMetric']
+
+# Metrics supporting the shared pass.
+_SHARED_PASS_METRICS = {
+    'FID': FIDMetric,
+    'FID50K': FID50K,
+    'FID50KFull': FID50KFull,
+    'IS': ISMetric,
+    'IS50K': IS50K,
+    'KID': KIDMetric,
+    'KID50K': KID50K,
+    'KID50KFull': KID50KFull,
+    'GANPR': GANPRMetric,
+    'GANPR50K': GANPR50K,
+    'GANPR50KFull': GANPR50KFull
+}
+
+
+class MultiGANMetric(BaseGANMetric):
+    """Defines the class for evaluating multiple GAN metrics in one pass."""
+
+    def __init__(self,
+                 name='MultiGAN',
+                 work_dir=None,
+                 logger=None,
+                 tb_writer=None,
+                 batch_size=1,
+                 latent_dim=512,
+                 latent_codes=None,
+                 label_dim=0,
+                 labels=None,
+                 seed=0,
+                 metrics=None):
+        """Initializes the class with the metrics to wrap.
+
+        Args:
+            metrics: A dictionary, whose keys are the metric types (case
+                sensitive) and values are the keyword arguments to build the
+                corresponding metrics, besides those shared with this class.
+                The number of synthesized samples is the maximum one required
+                by all wrapped metrics. (default: None)
+
+        Raises:
+            ValueError: If any metric type does not support the shared pass.
+        """
+        assert metrics, 'At least one metric is required!'
+        self.metrics = dict()
+        for metric_type, metric_kwargs in metrics.items():
+            if metric_type not in _SHARED_PASS_METRICS:
+                raise ValueError(f'Invalid metric type: `{metric_type}`!\n'
+                                 f'Types allowed: '
+                                 f'{list(_SHARED_PASS_METRICS)}.')
+            metric = _SHARED_PASS_METRICS[metric_type](
+                work_dir=work_dir,
+                logger=logger,
+                tb_writer=tb_writer,
+                batch_size=batch_size,
+                latent_dim=latent_dim,
+                latent_codes=latent_codes,
+                label_dim=label_dim,
+                labels=labels,
+                seed=seed,
+                **(metric_kwargs or dict()))
+            self.metrics[metric.name] = metric
+
+        super().__init__(name=name,
+                         work_dir=work_dir,
+                         logger=logger,
+                         tb_writer=tb_writer,
+                         batch_size=batch_size,
+                         latent_num=max(metric.latent_num
+                                        for metric in self.metrics.values()),
+                         latent_dim=latent_dim,
+                         latent_codes=latent_codes,
+                         label_dim=label_dim,
+                         labels=labels,
+                         seed=seed)
+        # Names of the metric results produced by each wrapped metric.
+        self.result_keys = {name: [] for name in self.metrics}
+
+        # Build feature extractors only if needed. Models are shared with the
+        # wrapped metrics since `build_model()` caches the instances.
+        self.fake_outputs = set()
+        for metric in self.metrics.values():
+            self.fake_outputs.update(metric.fake_outputs)
+        self.inception_model = None
+        self.perceptual_model = None
+        if ('inception_feature' in self.fake_outputs or
+                'inception_prediction' in self.fake_outputs):
+            self.inception_model = build_model('InceptionModel', align_tf=True)
+        if 'perceptual_feature' in self.fake_outputs:
+            self.perceptual_model = build_model(
+                'PerceptualModel', no_top=False, enable_lpips=False)
+
+    def extract_fake_outputs(self, generator, generator_kwargs):
+        """Synthesizes fake data and fans the outputs to all wrapped metrics.
+
+        Returns:
+            A dictionary, whose keys are the names of the wrapped metrics and
+                values are the results from their `self.end_fake_pass()`.
+        """
+        latent_num = self.latent_num
+        batch_size = self.batch_size
+        if self.random_latents:
+            g1 = torch.Generator(device=self.device)
+            g1.manual_seed(self.seed)
+        else:
+            latent_codes = np.load(self.latent_file)[self.replica_indices]
+            latent_codes = torch.from_numpy(latent_codes).to(torch.float32)
+        if self.random_labels:
+            g2 = torch.Generator(device=self.device)
+            g2.manual_seed(self.seed)
+        else:
+            labels = np.load(self.label_file)[self.replica_indices]
+            labels = torch.from_numpy(labels).to(torch.float32)
+
+        G = generator
+        G_kwargs = generator_kwargs
+        G_mode = G.training  # save model training mode.
+        G.eval()
+
+        for metric in self.metrics.values():
+            metric.begin_fake_pass()
+
+        self.logger.info(f'Extracting {sorted(self.fake_outputs)} from fake '
+                         f'data {self.log_tail}.',
+                         is_verbose=True)
+        self.logger.init_pbar()
+        pbar_task = self.logger.add_pbar_task('Fake', total=latent_num)
+        for start in range(0, self.replica_latent_num, batch_size):
+            end = min(start + batch_size, self.replica_latent_num)
+            with torch.no_grad():
+                if self.random_latents:
+                    batch_codes = torch.randn((end - start, *self.latent_dim),
+                                              generator=g1, device=self.device)
+                else:
+                    batch_codes = latent_codes[start:end].cuda().detach()
+                if self.random_labels:
+                    if self.label_dim == 0:
+                        batch_labels = torch.zeros((end - start, 0),
+                                                   device=self.device)
+                    else:
+                        rnd_labels = torch.randint(
+                            low=0, high=self.label_dim, size=(end - start,),
+                            generator=g2, device=self.device)
+                        batch_labels = F.one_hot(
+                            rnd_labels, num_classes=self.label_dim)
+                else:
+                    batch_labels = labels[start:end].cuda().detach()
+                batch_images = G(batch_codes, batch_labels, **G_kwargs)['image']
+                outputs = dict()
+                if self.inception_model is not None:
+                    features, predictions = self.inception_model(
+                        batch_images,
+                        output_features_and_predictions=True,
+                        remove_logits_bias=True)
+                    outputs['inception_feature'] = features
+                    outputs['inception_prediction'] = predictions
+                if self.perceptual_model is not None:
+                    outputs['perceptual_feature'] = self.perceptual_model(
+                        batch_images, resize_input=True,
+                        return_tensor='feature')
+                for metric in self.metrics.values():
+                    metric.accumulate_fake(outputs, start, end)
+            self.logger.update_pbar(pbar_task, (end - start) * self.world_size)
+        self.logger.close_pbar()
+
+        fake_results = dict()
+        for name, metric in self.metrics.items():
+            fake_results[name] = metric.end_fake_pass()
+
+        if G_mode:
+            G.train()  # restore model training mode.
+
+        self.sync()
+        return fake_results
+
+    def evaluate(self, data_loader, generator, generator_kwargs):
+        # Metrics extracting real features go first, so that those only
+        # requiring statistics (i.e., FID) can compute them from the cache.
+        metric_names = sorted(
+            self.metrics, key=lambda name: isinstance(self.metrics[name],
+                                                      FIDMetric))
+        real_results = dict()
+        for name in metric_names:
+            real_results[name] = self.metrics[name].extract_real(data_loader)
+        fake_results = self.extract_fake_outputs(generator, generator_kwargs)
+        if self.is_chief:
+            result = dict()
+            for name, metric in self.metrics.items():
+                metric_result = metric.compute_result(
+                    data_loader, real_results[name], fake_results[name])
+                self.result_keys[name] = list(metric_result)
+                result.update(metric_result)
+        else:
+            result = None
+        self.sync()
+        return result
+
+    def _is_better_than(self, metric_name, new, ref):
+        for metric in self.metrics.values():
+            flag = metric._is_better_than(metric_name, new, ref)  # pylint: disable=protected-access
+            if flag is not None:
+                return flag
+        return None
+
+    def save(self, result, target_filename=None, log_suffix=None, tag=None):
+        for name, metric in self.metrics.items():
+            if self.is_chief:
+                metric_result = {key: result[key]
+                                 for key in self.result_keys[name]}
+            else:
+                assert result is None
+                metric_result = None
+            metric.save(metric_result,
+                        target_filename=target_filename,
+                        log_suffix=log_suffix,
+                        tag=tag)
+
+    def info(self):
+        metric_info = super().info()
+        metric_info['Num fake samples'] = self.latent_num
+        metric_info['Fake outputs'] = sorted(self.fake_outputs)
+        for name, metric in self.metrics.items():
+            for key, val in metric.info().items():
+                metric_info[f'{name} - {key}'] = val
+        return metric_info
@@ -0,0 +1,196 @@
+# python3.7
+"""Unit test for the utility functions used for computing metrics.
+
+Basically, this file tests whether the batched, chunked, and streaming
+implementations in `metrics/utils.py` produce the same results as the
+reference ones on random features, i.e.,
+
+- `compute_kid_batched()` v.s. `compute_kid_from_feature()`.
+- `compute_knn_radii()` v.s. the k-NN radii from the full distance matrix.
+- `compute_gan_precision_recall_knn()` v.s. precision and recall from the full
+  distance matrix (as `compute_gan_precision_recall()`).
+- `FeatureStats` v.s. `numpy.mean()` and `numpy.cov()`.
+"""
+
+import numpy as np
+import torch
+
+from .utils import FeatureStats
+from .utils import kid_kernel
+from .utils import compute_kid_from_feature
+from .utils import compute_kid_batched
+from .utils import compute_pairwise_distance
+from .utils import compute_knn_radii
+from .utils import compute_gan_precision_recall_knn
+
+__all__ = ['test_metric_utils']
+
+_SEED = 0
+_DIM = 16
+
+
+def test_metric_utils():
+    """Collects all metric utility tests."""
+    print('========== Start Metric Utility Test ==========')
+    test_kid()
+    test_knn_radii()
+    test_gan_precision_recall()
+    test_feature_stats()
+    print('========== Finish Metric Utility Test ==========')
+
+
+def _get_features(num, shift=0.0, seed=_SEED):
+    """Gets random features with shape [num, _DIM]."""
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((num, _DIM)) + shift
+
+
+def _compute_kid_reference(fake_features, real_features, fake_indices,
+                           real_indices):
+    """Computes KID on the given subsets as `compute_kid_from_feature()`."""
+    num_samples = fake_indices.shape[1]
+    total = 0
+    for fake_idx, real_idx in zip(fake_indices, real_indices):
+        x = fake_features[fake_idx]
+        y = real_features[real_idx]
+        sum_kxx_kyy = kid_kernel(x, x) + kid_kernel(y, y)
+        kxy = kid_kernel(x, y)
+        temp = sum_kxx_kyy.sum() - np.diag(sum_kxx_kyy).sum()
+        temp = temp / (num_samples - 1)
+        total += temp - 2 * kxy.sum() / num_samples
+    return float(total / len(fake_indices) / num_samples)
+
+
+def test_kid():
+    """Tests `compute_kid_batched()`."""
+    print('===== Testing KID =====')
+    fake_features = _get_features(60, shift=0.5, seed=_SEED)
+    real_features = _get_features(50, seed=_SEED + 1)
+    backends = ['numpy', 'torch']
+
+    # With the subset size no smaller than the number of samples, each subset
+    # is a permutation of all samples, hence the result is independent of the
+    # random subsets.
+    fake_subset = fake_features[:50]
+    expected = compute_kid_from_feature(
+        fake_subset, real_features, num_subsets=3, max_subset_size=50)
+    for backend in backends:
+        kid = compute_kid_batched(
+            fake_subset, real_features, num_subsets=3, max_subset_size=50,
+            backend=backend)
+        assert np.isclose(kid, expected, rtol=1e-8, atol=1e-10), (
+            f'KID {kid} with backend `{backend}` mismatches {expected}!')
+
+    # With smaller subsets, compare on the same subsets, which are drawn as
+    # `compute_kid_batched()`. Tiny memory budgets force multiple batches.
+    num_subsets = 7
+    num_samples = 20
+    rng = np.random.default_rng(_SEED)
+    fake_indices = np.stack([
+        rng.choice(len(fake_features), size=num_samples, replace=False)
+        for _ in range(num_subsets)
+    ])
+    real_indices = np.stack([
+        rng.choice(len(real_features), size=num_samples, replace=False)
+        for _ in range(num_subsets)
+    ])
+    expected = _compute_kid_reference(
+        fake_features, real_features, fake_indices, real_indices)
+    for backend in backends:
+        for max_memory in [1, 512 * 1024 ** 2]:
+            kid = compute_kid_batched(
+                fake_features, real_features, num_subsets=num_subsets,
+                max_subset_size=num_samples, seed=_SEED, backend=backend,
+                max_memory=max_memory)
+            assert np.isclose(kid, expected, rtol=1e-8, atol=1e-10), (
+                f'KID {kid} with backend `{backend}` and memory budget '
+                f'{max_memory} mismatches {expected}!')
+    print('    Pass!')
+
+
+def _compute_knn_radii_reference(features, top_k):
+    """Computes k-NN radii from the full distance matrix."""
+    distances = compute_pairwise_distance(features, features, use_cuda=False)
+    return np.partition(distances, top_k, axis=1)[:, top_k]
+
+
+def _compute_precision_recall_reference(fake_features, real_features, top_k):
+    """Computes precision and recall from the full distance matrices."""
+    real_radii = _compute_knn_radii_reference(real_features, top_k)
+    fake_radii = _compute_knn_radii_reference(fake_features, top_k)
+    distances = compute_pairwise_distance(
+        fake_features, real_features, use_cuda=False)
+    precision = np.any(distances <= real_radii[None, :], axis=1).mean()
+    recall = np.any(distances.T <= fake_radii[None, :], axis=1).mean()
+    return float(precision), float(recall)
+
+
+def test_knn_radii():
+    """Tests `compute_knn_radii()`."""
+    print('===== Testing k-NN radii =====')
+    features = _get_features(100).astype(np.float32)
+    for top_k in [1, 3, 5]:
+        expected = _compute_knn_radii_reference(features, top_k)
+        for chunk_size in [7, 32, 10000]:
+            radii = compute_knn_radii(features, top_k, chunk_size)
+            assert radii.shape == expected.shape
+            assert np.allclose(radii, expected, rtol=1e-4, atol=1e-4), (
+                f'k-NN radii with top_k {top_k} and chunk size {chunk_size} '
+                f'mismatch the reference, with maximum difference '
+                f'{np.abs(radii - expected).max()}!')
+    print('    Pass!')
+
+
+def test_gan_precision_recall():
+    """Tests `compute_gan_precision_recall_knn()`."""
+    print('===== Testing GAN precision and recall =====')
+    fake_features = _get_features(120, shift=0.3, seed=_SEED)
+    real_features = _get_features(100, seed=_SEED + 1)
+    fake_features = fake_features.astype(np.float32)
+    real_features = real_features.astype(np.float32)
+    # Distances are computed in float32 on device, hence a probe lying right
+    # on the radius may flip. Allow one sample of difference.
+    tolerance = 1.0 / min(len(fake_features), len(real_features))
+    for top_k in [1, 3]:
+        expected = _compute_precision_recall_reference(
+            fake_features, real_features, top_k)
+        for chunk_size in [16, 10000]:
+            precision, recall = compute_gan_precision_recall_knn(
+                fake_features, real_features, chunk_size=chunk_size,
+                top_k=top_k)
+            assert abs(precision - expected[0]) <= tolerance, (
+                f'Precision {precision} mismatches {expected[0]}!')
+            assert abs(recall - expected[1]) <= tolerance, (
+                f'Recall {recall} mismatches {expected[1]}!')
+            # Pre-computed real radii give the same results.
+            real_radii = compute_knn_radii(real_features, top_k, chunk_size)
+            assert compute_gan_precision_recall_knn(
+                fake_features, real_features, chunk_size=chunk_size,
+                top_k=top_k, real_radii=real_radii) == (precision, recall)
+    print('    Pass!')
+
+
+def test_feature_stats():
+    """Tests the streaming mean and covariance of `FeatureStats`."""
+    print('===== Testing feature statistics =====')
+    features = _get_features(257, shift=3.0).astype(np.float32)
+    expected_mean = np.mean(features.astype(np.float64), axis=0)
+    expected_cov = np.cov(features.astype(np.float64), rowvar=False)
+    for batch_size in [1, 10, 257]:
+        stats = FeatureStats(dim=_DIM, device='cpu')
+        for start in range(0, len(features), batch_size):
+            batch = features[start:start + batch_size]
+            # Both `numpy.ndarray` and `torch.Tensor` are accepted.
+            if (start // batch_size) % 2:
+                batch = torch.from_numpy(batch)
+            stats.update(batch)
+        stats.all_reduce()  # No-op without distributed environment.
+        mean, cov = stats.get_mean_cov()
+        assert stats.num == len(features)
+        assert np.allclose(mean, expected_mean, rtol=1e-10, atol=1e-10), (
+            f'Mean with batch size {batch_size} mismatches the reference!')
+        assert np.allclose(cov, expected_cov, rtol=1e-8, atol=1e-8), (
+            f'Covariance with batch size {batch_size} mismatches the '
+            f'reference, with maximum difference '
+            f'{np.abs(cov - expected_cov).max()}!')
+    print('    Pass!')
@@ -5,11 +5,14 @@ import numpy as np
 import scipy.linalg
 
 import torch
+import torch.distributed as dist
 
 __all__ = [
-    'compute_fid', 'compute_fid_from_feature', 'kid_kernel',
-    'compute_kid_from_feature', 'compute_is', 'compute_pairwise_distance',
-    'compute_gan_precision_recall'
+    'FeatureStats', 'compute_matrix_sqrt', 'compute_fid',
+    'compute_fid_from_feature', 'kid_kernel', 'compute_kid_from_feature',
+    'compute_kid_batched', 'compute_is', 'compute_pairwise_distance',
+    'compute_gan_precision_recall', 'compute_knn_radii',
+    'compute_manifold_membership', 'compute_gan_precision_recall_knn'
 ]
 
 
@@ -27,7 +30,119 @@ def random_sample(array, size=1, replace=True):
     return array[np.random.choice(len(array), size=size, replace=replace)]
 
 
-def compute_fid(fake_mean, fake_cov, real_mean, real_cov):
+class FeatureStats(object):
+    """Accumulates the mean and covariance of features in a streaming manner.
+
+    Instead of keeping all features, this class only maintains the number of
+    samples, the sum of features, and the sum of outer products of features,
+    all in float64 for numerical stability. Statistics from different replicas
+    can be merged with a single all-reduce via `self.all_reduce()`.
+
+    Usage:
+
+    ```
+    stats = FeatureStats(dim=2048, device='cuda')
+    for batch_features in ...:
+        stats.update(batch_features)
+    stats.all_reduce()
+    mean, cov = stats.get_mean_cov()
+    ```
+    """
+
+    def __init__(self, dim, device=None):
+        """Initializes the accumulator.
+
+        Args:
+            dim: Dimension of the features.
+            device: Device to accumulate the statistics on. (default: None)
+        """
+        self.dim = dim
+        self.num = 0
+        self.sum = torch.zeros(dim, dtype=torch.float64, device=device)
+        self.outer = torch.zeros((dim, dim), dtype=torch.float64, device=device)
+
+    def update(self, features):
+        """Updates the statistics with a batch of features.
+
+        Args:
+            features: `torch.Tensor` or `numpy.ndarray`, with shape [N, dim].
+        """
+        features = torch.as_tensor(features, device=self.sum.device)
+        features = features.detach().to(torch.float64).reshape(-1, self.dim)
+        self.num += features.shape[0]
+        self.sum += features.sum(dim=0)
+        self.outer += features.T @ features
+
+    def all_reduce(self):
+        """Sums up the statistics across all replicas with one collective."""
+        if not dist.is_initialized() or dist.get_world_size() == 1:
+            return
+        num = torch.tensor([self.num], dtype=torch.float64,
+                           device=self.sum.device)
+        packed = torch.cat([num, self.sum, self.outer.flatten()])
+        dist.all_reduce(packed)
+        self.num = int(round(packed[0].item()))
+        self.sum = packed[1:1 + self.dim]
+        self.outer = packed[1 + self.dim:].reshape(self.dim, self.dim)
+
+    def get_mean_cov(self):
+        """Gets the mean and the (unbiased) covariance of the features.
+
+        Returns:
+            A two-element tuple of `numpy.ndarray` in float64, with shape [dim]
+                and [dim, dim] respectively, which are consistent with
+                `numpy.mean()` and `numpy.cov(rowvar=False)`.
+        """
+        assert self.num > 1, 'At least two samples are required!'
+        mean = self.sum / self.num
+        cov = (self.outer - self.num * torch.outer(mean, mean)) / (self.num - 1)
+        return mean.cpu().numpy(), cov.cpu().numpy()
+
+
+_FID_BACKENDS_ALLOWED = ['scipy', 'numpy', 'torch']
+
+
+def _get_torch_device():
+    """Gets the device for `torch` backend, i.e., GPU if available."""
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+def compute_matrix_sqrt(matrix, backend='numpy'):
+    """Computes the square root of a symmetric positive semi-definite matrix.
+
+    The square root is computed with symmetric eigendecomposition, i.e.,
+
+    matrix = V @ diag(w) @ V.T  =>  matrix^0.5 = V @ diag(w^0.5) @ V.T
+
+    where negative eigenvalues caused by numerical error are clipped to zero.
+
+    Args:
+        matrix: The matrix, with shape [dim, dim].
+        backend: Backend for the eigendecomposition, `numpy` or `torch`. The
+            `torch` backend runs on GPU if available. (default: `numpy`)
+
+    Returns:
+        A `numpy.ndarray` in float64 with shape [dim, dim].
+    """
+    if backend == 'torch':
+        matrix = torch.as_tensor(matrix, dtype=torch.float64,
+                                 device=_get_torch_device())
+        eigvals, eigvecs = torch.linalg.eigh(matrix)
+        sqrt = (eigvecs * eigvals.clamp(min=0).sqrt()) @ eigvecs.T
+        return sqrt.cpu().numpy()
+    if backend == 'numpy':
+        eigvals, eigvecs = np.linalg.eigh(np.asarray(matrix, dtype=np.float64))
+        return (eigvecs * np.sqrt(np.maximum(eigvals, 0))) @ eigvecs.T
+    raise ValueError(f'Invalid backend: `{backend}`!\n'
+                     f'Types allowed: {_FID_BACKENDS_ALLOWED[1:]}.')
+
+
+def compute_fid(fake_mean,
+                fake_cov,
+                real_mean,
+                real_cov,
+                backend='scipy',
+                real_cov_sqrt=None):
     """Computes FID based on the statistics of fake and real data.
 
     FID metric is introduced in paper https://arxiv.org/pdf/1706.08500.pdf,
@@ -40,22 +155,63 @@ def compute_fid(fake_mean, fake_cov, real_mean, real_cov):
     d^2 = ||fake_mean - real_mean||_2^2 +
           Trace(fake_cov + real_cov - 2(fake_cov @ real_cov)^0.5)
 
+    With backend `scipy`, the matrix square root is computed by
+    `scipy.linalg.sqrtm()`. With backend `numpy` or `torch`, the trace term is
+    computed with symmetric eigendecomposition instead, which is much faster.
+    Concretely, letting S = real_cov^0.5, `fake_cov @ real_cov` shares the
+    eigenvalues with the symmetric matrix `S @ fake_cov @ S`, hence
+
+    Trace((fake_cov @ real_cov)^0.5) = sum(eigvals(S @ fake_cov @ S)^0.5)
+
+    where `S` only depends on the real data and can be computed once and
+    reused via `real_cov_sqrt`.
+
     Args:
         fake_mean: The mean of features extracted from fake data.
         fake_cov: The covariance of features extracted from fake data.
         real_mean: The mean of features extracted from real data.
         real_cov: The covariance of features extracted from real data.
+        backend: Backend to compute the trace term, among `scipy`, `numpy`,
+            and `torch`. (default: `scipy`)
+        real_cov_sqrt: The pre-computed square root of `real_cov`, which only
+            takes effect for the `numpy` and `torch` backends. If not provided,
+            it will be computed with `compute_matrix_sqrt()`. (default: None)
 
     Returns:
         A real number, suggesting the FID value.
+
+    Raises:
+        ValueError: If the `backend` is not supported.
     """
+    if backend not in _FID_BACKENDS_ALLOWED:
+        raise ValueError(f'Invalid backend: `{backend}`!\n'
+                         f'Types allowed: {_FID_BACKENDS_ALLOWED}.')
+
     fid = np.square(fake_mean - real_mean).sum()
-    temp = scipy.linalg.sqrtm(np.dot(fake_cov, real_cov))
-    fid += np.real(np.trace(fake_cov + real_cov - 2 * temp))
+    if backend == 'scipy':
+        temp = scipy.linalg.sqrtm(np.dot(fake_cov, real_cov))
+        fid += np.real(np.trace(fake_cov + real_cov - 2 * temp))
+        return float(fid)
+
+    if real_cov_sqrt is None:
+        real_cov_sqrt = compute_matrix_sqrt(real_cov, backend=backend)
+    if backend == 'torch':
+        device = _get_torch_device()
+        sqrt = torch.as_tensor(real_cov_sqrt, dtype=torch.float64,
+                               device=device)
+        cov = torch.as_tensor(fake_cov, dtype=torch.float64, device=device)
+        eigvals = torch.linalg.eigvalsh(sqrt @ cov @ sqrt)
+        trace_sqrt = float(eigvals.clamp(min=0).sqrt().sum())
+    else:
+        sqrt = np.asarray(real_cov_sqrt, dtype=np.float64)
+        cov = np.asarray(fake_cov, dtype=np.float64)
+        eigvals = np.linalg.eigvalsh(sqrt @ cov @ sqrt)
+        trace_sqrt = float(np.sqrt(np.maximum(eigvals, 0)).sum())
+    fid += np.trace(fake_cov) + np.trace(real_cov) - 2 * trace_sqrt
     return float(fid)
 
 
-def compute_fid_from_feature(fake_features, real_features):
+def compute_fid_from_feature(fake_features, real_features, backend='scipy'):
     """Computes FID based on the features extracted from fake and real data.
 
     FID metric is introduced in paper https://arxiv.org/pdf/1706.08500.pdf,
@@ -65,6 +221,8 @@ def compute_fid_from_feature(fake_features, real_features):
     Args:
         fake_features: The features extracted from fake data.
         real_features: The features extracted from real data.
+        backend: Backend to compute FID. Please see `compute_fid()` for
+            details. (default: `scipy`)
 
     Returns:
         A real number, suggesting the FID value.
@@ -74,7 +232,8 @@ def compute_fid_from_feature(fake_features, real_features):
     real_mean = np.mean(real_features, axis=0)
     real_cov = np.cov(real_features, rowvar=False)
 
-    return compute_fid(fake_mean, fake_cov, real_mean, real_cov)
+    return compute_fid(fake_mean, fake_cov, real_mean, real_cov,
+                       backend=backend)
 
 
 def kid_kernel(x, y):
@@ -129,6 +288,111 @@ def compute_kid_from_feature(fake_features,
     return float(kid)
 
 
+_KID_BACKENDS_ALLOWED = ['numpy', 'torch']
+
+
+def compute_kid_batched(fake_features,
+                        real_features,
+                        num_subsets=100,
+                        max_subset_size=1000,
+                        seed=0,
+                        backend='numpy',
+                        max_memory=512 * 1024 ** 2):
+    """Computes KID with all subsets evaluated in batches.
+
+    This function is equivalent to `compute_kid_from_feature()`, but draws the
+    indices of all subsets up front with a seeded generator, and evaluates the
+    polynomial kernels of multiple subsets with stacked (batched) matrix
+    multiplications. The diagonals of k(x, x) and k(y, y) are computed from the
+    row norms of the subsets instead of the kernel matrices. All computation is
+    executed in float64.
+
+    Args:
+        fake_features: `numpy.ndarray`, the features extracted from fake data.
+        real_features: `numpy.ndarray`, the features extracted from real data.
+        num_subsets: Number of subsets. (default: 100)
+        max_subset_size: The maximum size of a subset. (default: 1000)
+        seed: Seed for drawing subsets, which makes the result reproducible.
+            (default: 0)
+        backend: Backend for the computation, `numpy` or `torch`. The `torch`
+            backend runs on GPU if available. (default: `numpy`)
+        max_memory: Memory budget (in bytes) for the subsets processed in one
+            batch. At least one subset is processed in each batch.
+            (default: 512 MB)
+
+    Returns:
+        A real number, suggesting the KID value.
+
+    Raises:
+        ValueError: If the `backend` is not supported.
+    """
+    if backend not in _KID_BACKENDS_ALLOWED:
+        raise ValueError(f'Invalid backend: `{backend}`!\n'
+                         f'Types allowed: {_KID_BACKENDS_ALLOWED}.')
+
+    num_samples = min(fake_features.shape[0], real_features.shape[0],
+                      max_subset_size)
+    ndim = fake_features.shape[1]
+
+    # Draw all subsets in advance.
+    rng = np.random.default_rng(seed)
+    fake_indices = np.stack([
+        rng.choice(fake_features.shape[0], size=num_samples, replace=False)
+        for _ in range(num_subsets)
+    ])
+    real_indices = np.stack([
+        rng.choice(real_features.shape[0], size=num_samples, replace=False)
+        for _ in range(num_subsets)
+    ])
+
+    # Each subset takes two feature blocks and three kernel matrices.
+    subset_bytes = 8 * (2 * num_samples * ndim + 3 * num_samples ** 2)
+    chunk_size = max(1, min(num_subsets, max_memory // subset_bytes))
+
+    if backend == 'torch':
+        device = _get_torch_device()
+        fake_features = torch.as_tensor(np.asarray(fake_features),
+                                        dtype=torch.float64, device=device)
+        real_features = torch.as_tensor(np.asarray(real_features),
+                                        dtype=torch.float64, device=device)
+        fake_indices = torch.as_tensor(fake_indices, device=device)
+        real_indices = torch.as_tensor(real_indices, device=device)
+
+    total = 0
+    for start in range(0, num_subsets, chunk_size):
+        end = min(start + chunk_size, num_subsets)
+        if backend == 'torch':
+            x = fake_features[fake_indices[start:end]]  # [C, N, D]
+            y = real_features[real_indices[start:end]]  # [C, N, D]
+            kxx = (torch.bmm(x, x.transpose(1, 2)) / ndim + 1) ** 3
+            kyy = (torch.bmm(y, y.transpose(1, 2)) / ndim + 1) ** 3
+            kxy = (torch.bmm(x, y.transpose(1, 2)) / ndim + 1) ** 3
+            diag_x = (x.square().sum(dim=2) / ndim + 1) ** 3
+            diag_y = (y.square().sum(dim=2) / ndim + 1) ** 3
+            sum_kxx_kyy = (kxx.sum(dim=(1, 2)) + kyy.sum(dim=(1, 2)) -
+                           diag_x.sum(dim=1) - diag_y.sum(dim=1))
+            mmd = (sum_kxx_kyy / (num_samples - 1) -
+                   2 * kxy.sum(dim=(1, 2)) / num_samples)
+            total += float(mmd.sum())
+        else:
+            x = np.asarray(fake_features[fake_indices[start:end]],
+                           dtype=np.float64)
+            y = np.asarray(real_features[real_indices[start:end]],
+                           dtype=np.float64)
+            kxx = (np.matmul(x, x.transpose(0, 2, 1)) / ndim + 1) ** 3
+            kyy = (np.matmul(y, y.transpose(0, 2, 1)) / ndim + 1) ** 3
+            kxy = (np.matmul(x, y.transpose(0, 2, 1)) / ndim + 1) ** 3
+            diag_x = (np.square(x).sum(axis=2) / ndim + 1) ** 3
+            diag_y = (np.square(y).sum(axis=2) / ndim + 1) ** 3
+            sum_kxx_kyy = (kxx.sum(axis=(1, 2)) + kyy.sum(axis=(1, 2)) -
+                           diag_x.sum(axis=1) - diag_y.sum(axis=1))
+            mmd = (sum_kxx_kyy / (num_samples - 1) -
+                   2 * kxy.sum(axis=(1, 2)) / num_samples)
+            total += float(mmd.sum())
+    kid = total / num_subsets / num_samples
+    return float(kid)
+
+
 def compute_is(probs, num_splits):
     """Computes Inception Score (IS) based on inception prediction.
 
@@ -308,3 +572,138 @@ def compute_gan_precision_recall(fake_features,
     recall = predictions.astype(np.float32).mean()
 
     return float(precision), float(recall)
+
+
+def _load_chunk(features, start, end, device):
+    """Loads a chunk of features onto the device as a float32 tensor."""
+    return torch.as_tensor(np.asarray(features[start:end]),
+                           dtype=torch.float32, device=device)
+
+
+def _compute_l2_distance(rows, cols):
+    """Computes squared L2 distance between two chunks of features on device."""
+    row_square_sum = rows.square().sum(1, keepdim=True)
+    col_square_sum = cols.square().sum(1, keepdim=True)
+    distance = row_square_sum + col_square_sum.T - 2 * rows.matmul(cols.T)
+    return distance.clamp(0)
+
+
+def compute_knn_radii(features, top_k=3, chunk_size=10000):
+    """Computes the k-NN radius of each sample within a feature manifold.
+
+    The radius of a sample is its distance to the `top_k`-th nearest neighbor
+    within `features` (excluding itself), which is the same as the threshold
+    computed in `compute_gan_precision_recall()`. Instead of concatenating the
+    distances to all samples, this function keeps a running top-k over column
+    chunks, hence the memory footprint is linear to `chunk_size`.
+
+    Args:
+        features: The features forming the manifold, with shape [N, dim].
+        top_k: Number of neighbors. (default: 3)
+        chunk_size: Chunk size for distance computation. (default: 10000)
+
+    Returns:
+        A `numpy.ndarray` with shape [N].
+    """
+    device = _get_torch_device()
+    num = features.shape[0]
+    assert num > top_k
+    radii = []
+    for row_idx in range(0, num, chunk_size):
+        rows = _load_chunk(features, row_idx, row_idx + chunk_size, device)
+        nearest = None  # Running top-(k+1) smallest distances, including self.
+        for col_idx in range(0, num, chunk_size):
+            cols = _load_chunk(features, col_idx, col_idx + chunk_size, device)
+            distances = _compute_l2_distance(rows, cols)
+            if nearest is not None:
+                distances = torch.cat([nearest, distances], dim=1)
+            k = min(top_k + 1, distances.shape[1])
+            nearest = distances.topk(k, dim=1, largest=False).values
+        radii.append(nearest[:, top_k].cpu().numpy())
+    return np.concatenate(radii, axis=0)
+
+
+def compute_manifold_membership(probes, manifold, radii, chunk_size=10000):
+    """Checks whether each probe falls into the given feature manifold.
+
+    A probe is within the manifold if its distance to any manifold sample is
+    no larger than the k-NN radius of that sample. The manifold is scanned
+    chunk by chunk, and probes that have already been found within the
+    manifold are skipped in the following chunks (i.e., early exit).
+
+    Args:
+        probes: The features to check, with shape [P, dim].
+        manifold: The features forming the manifold, with shape [N, dim].
+        radii: The k-NN radii of the manifold, with shape [N]. Please refer to
+            `compute_knn_radii()`.
+        chunk_size: Chunk size for distance computation. (default: 10000)
+
+    Returns:
+        A boolean `numpy.ndarray` with shape [P].
+    """
+    device = _get_torch_device()
+    num = manifold.shape[0]
+    assert radii.shape == (num,)
+    radii = torch.as_tensor(np.asarray(radii), dtype=torch.float32,
+                            device=device)
+    predictions = []
+    for row_idx in range(0, probes.shape[0], chunk_size):
+        rows = _load_chunk(probes, row_idx, row_idx + chunk_size, device)
+        found = torch.zeros(rows.shape[0], dtype=torch.bool, device=device)
+        for col_idx in range(0, num, chunk_size):
+            pending = (~found).nonzero(as_tuple=True)[0]
+            if pending.numel() == 0:
+                break
+            cols = _load_chunk(manifold, col_idx, col_idx + chunk_size, device)
+            distances = _compute_l2_distance(rows[pending], cols)
+            col_radii = radii[col_idx:col_idx + chunk_size]
+            found[pending] = (distances <= col_radii[None, :]).any(dim=1)
+        predictions.append(found.cpu().numpy())
+    return np.concatenate(predictions, axis=0)
+
+
+def compute_gan_precision_recall_knn(fake_features,
+                                     real_features,
+                                     chunk_size=10000,
+                                     top_k=3,
+                                     real_radii=None):
+    """Computes precision and recall for GAN evaluation with k-NN radii.
+
+    This function produces the same results as `compute_gan_precision_recall()`
+    but never materializes full rows of pair-wise distances. Please refer to
+    `compute_knn_radii()` and `compute_manifold_membership()` for details.
+
+    Args:
+        fake_features: The features extracted from fake data.
+        real_features: The features extracted from real data.
+        chunk_size: Chunk size for distance computation, which will save memory.
+            (default: 10000)
+        top_k: This field determines the maximum distance that will be treated
+            as positive. (default: 3)
+        real_radii: The pre-computed k-NN radii of the real manifold, which can
+            be reused across evaluations since the real data does not change.
+            If not provided, it will be computed. (default: None)
+
+    Returns:
+        A two-element tuple, suggesting the precision and recall respectively.
+    """
+    real_num = real_features.shape[0]
+    fake_num = fake_features.shape[0]
+    assert real_num > top_k and fake_num > top_k
+
+    # Compute precision.
+    if real_radii is None:
+        real_radii = compute_knn_radii(real_features, top_k, chunk_size)
+    predictions = compute_manifold_membership(
+        fake_features, real_features, real_radii, chunk_size)
+    assert predictions.shape == (fake_num,)
+    precision = predictions.astype(np.float32).mean()
+
+    # Compute recall.
+    fake_radii = compute_knn_radii(fake_features, top_k, chunk_size)
+    predictions = compute_manifold_membership(
+        real_features, fake_features, fake_radii, chunk_size)
+    assert predictions.shape == (real_num,)
+    recall = predictions.astype(np.float32).mean()
+
+    return float(precision), float(recall)
@@ -92,6 +92,10 @@ class InceptionModel(object):
             (default: False)
         - output_predictions: Whether to output the final predictions, i.e.,
             `softmax(logits)`. (default: False)
+        - output_features_and_predictions: Whether to output both the features
+            and the final predictions as a tuple, within one forward pass.
+            `remove_logits_bias` still takes effect on the predictions.
+            (default: False)
         """
         if align_tf:
             num_classes = 1008
@@ -212,7 +216,8 @@ class Inception3(nn.Module):
                  x,
                  output_logits=False,
                  remove_logits_bias=False,
-                 output_predictions=False):
+                 output_predictions=False,
+                 output_features_and_predictions=False):
         # Upsample if necessary.
         if x.shape[2] != 299 or x.shape[3] != 299:
             if self.align_tf:
@@ -285,6 +290,11 @@ class Inception3(nn.Module):
         # N x 2048 x 1 x 1
         x = torch.flatten(x, 1)
         # N x 2048
+        if output_features_and_predictions:
+            logits = self.fc(x)
+            if remove_logits_bias:
+                logits = logits - self.fc.bias.view(1, -1)
+            return (x, F.softmax(logits, dim=1)), aux
         if output_logits or output_predictions:
             x = self.fc(x)
             # N x 1000 (num_classes)
@@ -299,10 +309,12 @@ class Inception3(nn.Module):
                 transform_input=False,
                 output_logits=False,
                 remove_logits_bias=False,
-                output_predictions=False):
+                output_predictions=False,
+                output_features_and_predictions=False):
         x = self._transform_input(x, transform_input)
         x, aux = self._forward(
-            x, output_logits, remove_logits_bias, output_predictions)
+            x, output_logits, remove_logits_bias, output_predictions,
+            output_features_and_predictions)
         if self.training and self.aux_logits:
             return x, aux
         else:
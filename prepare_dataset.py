@@ -1,23 +1,50 @@
 # python3.7
-"""Script to prepare dataset in `zip` format."""
+"""Script to prepare dataset in `zip` (or packed `shard`) format.
+
+Images are encoded by multiple worker processes (see `--num_workers`), and then
+appended to the archive by the main process in order. The progress is
+checkpointed periodically (see `--checkpoint_interval`), hence an interrupted
+packing can be resumed with `--resume`.
+
+Example:
+
+python prepare_dataset.py data/ffhq data/ffhq256.zip --num_workers 32 \
+    --codec png --resolution 256
+"""
 
 import os
 import io
 import warnings
 import argparse
 import json
+import multiprocessing
 import zipfile
 from tqdm import tqdm
 from packaging import version
+from PIL import Image
 
 import torchvision
 import torchvision.datasets as torch_datasets
 
+from datasets.file_readers.shard_reader import ShardWriter
+from utils.parsing_utils import parse_bool
+
 _ALLOWED_DATASETS = [
     'folder', 'cifar10', 'cifar100', 'mnist', 'imagenet1k', 'lsun',
     'inaturalist'
 ]
 
+_ALLOWED_SAVE_FORMATS = ['zip', 'shard']
+
+# `raw` means to store the source file bytes as they are, without re-encoding.
+_ALLOWED_CODECS = ['png', 'jpg', 'webp', 'raw']
+
+# Default compression level of PNG, and default quality of JPEG and WEBP.
+_DEFAULT_COMPRESS_LEVELS = {'png': 0, 'jpg': 95, 'webp': 95}
+
+# Settings used by `encode_item()`, which are set up in each worker process.
+_WORKER_SETTINGS = dict()
+
 
 def adapt_stylegan2ada_dataset(dataset_path, annotation_meta='annotation.json'):
     """Adapts a dataset created by official StyleGAN2-ADA.
@@ -185,46 +212,390 @@ def parse_meta(dataset_obj):
     return None
 
 
-def save_dataset(src, save_path, dataset, portion):
-    """Makes and saves a dataset in `zip` format.
+def get_source_path(dataset_obj, idx):
+    """Gets the path to the source file of the `idx`-th item if available.
+
+    Args:
+        dataset_obj: a `torch.utils.data.Dataset` object, returned by function
+            `open_dataset()`.
+        idx: `int`, index of the item.
+
+    Returns:
+        A two-element tuple, i.e., the source path and the target, or `None` if
+            the dataset does not read items from individual files.
+    """
+    if isinstance(dataset_obj, torch_datasets.ImageFolder):
+        return dataset_obj.samples[idx]
+    return None
+
+
+def encode_image(image, codec='png', compress_level=None, resolution=None):
+    """Encodes an image to bytes.
+
+    Args:
+        image: `PIL.Image.Image`, the image to encode.
+        codec: `str`, codec used for encoding, among `png`, `jpg`, and `webp`.
+            (default: `png`)
+        compress_level: `int`, compression level for `png`, or quality for
+            `jpg` and `webp`. If not specified, a default value will be used.
+            (default: None)
+        resolution: `int`, if specified, the image will be resized such that
+            the short side equals to `resolution`, with the aspect ratio kept.
+            Images smaller than `resolution` are not resized. (default: None)
+
+    Returns:
+        The encoded `bytes`.
+    """
+    if compress_level is None:
+        compress_level = _DEFAULT_COMPRESS_LEVELS[codec]
+    if resolution and min(image.size) > resolution:
+        scale = resolution / min(image.size)
+        size = (max(round(image.size[0] * scale), 1),
+                max(round(image.size[1] * scale), 1))
+        image = image.resize(size, resample=Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    if codec == 'png':
+        image.save(buffer, format='png', compress_level=compress_level,
+                   optimize=False)
+    elif codec == 'jpg':
+        if image.mode not in ['L', 'RGB']:
+            image = image.convert('RGB')
+        image.save(buffer, format='jpeg', quality=compress_level)
+    elif codec == 'webp':
+        image.save(buffer, format='webp', quality=compress_level)
+    else:
+        raise ValueError(f'Invalid codec: `{codec}`!\n'
+                         f'Supported codecs: {_ALLOWED_CODECS}.')
+    return buffer.getvalue()
+
+
+def init_worker(dataset_obj, codec, compress_level, resolution):
+    """Sets up the settings used by `encode_item()` in the current process."""
+    _WORKER_SETTINGS.update(dataset_obj=dataset_obj,
+                            codec=codec,
+                            compress_level=compress_level,
+                            resolution=resolution)
+
+
+def encode_item(idx):
+    """Encodes the `idx`-th item of the dataset set up by `init_worker()`.
+
+    Returns:
+        A three-element tuple, i.e., the relative path inside the archive, the
+            encoded bytes, and the target.
+    """
+    dataset_obj = _WORKER_SETTINGS['dataset_obj']
+    codec = _WORKER_SETTINGS['codec']
+    if codec == 'raw':
+        src_path, target = get_source_path(dataset_obj, idx)
+        ext = os.path.splitext(src_path)[1].lower()
+        with open(src_path, 'rb') as f:
+            return f'{target}/img{idx:08d}{ext}', f.read(), target
+
+    img, target = dataset_obj[idx]
+    buffer = encode_image(img,
+                          codec=codec,
+                          compress_level=_WORKER_SETTINGS['compress_level'],
+                          resolution=_WORKER_SETTINGS['resolution'])
+    return f'{target}/img{idx:08d}.{codec}', buffer, target
+
+
+def get_archive_path(save_path, archive_idx, num_archives):
+    """Gets the path of the `archive_idx`-th archive.
+
+    For example, with `save_path` as `data/ffhq.zip` and `num_archives` as 4,
+    the first archive is saved to `data/ffhq-00000-of-00004.zip`.
+    """
+    if num_archives == 1:
+        return save_path
+    stem, ext = os.path.splitext(save_path.rstrip('/'))
+    return f'{stem}-{archive_idx:05d}-of-{num_archives:05d}{ext}'
+
+
+def save_progress(progress_path, progress):
+    """Saves the packing progress atomically."""
+    temp_path = f'{progress_path}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(progress, f)
+    os.replace(temp_path, progress_path)
+
+
+# Attributes of `zipfile.ZipInfo` required to write the central directory.
+_ZIP_INFO_ATTRS = [
+    'filename', 'date_time', 'compress_type', 'comment', 'extra',
+    'create_system', 'create_version', 'extract_version', 'reserved',
+    'flag_bits', 'volume', 'internal_attr', 'external_attr', 'header_offset',
+    'CRC', 'compress_size', 'file_size'
+]
+
+
+def zip_info_to_dict(zip_info):
+    """Converts a `zipfile.ZipInfo` to a JSON-serializable dictionary."""
+    info = {attr: getattr(zip_info, attr) for attr in _ZIP_INFO_ATTRS}
+    info['comment'] = info['comment'].hex()
+    info['extra'] = info['extra'].hex()
+    return info
+
+
+def dict_to_zip_info(info):
+    """Converts a dictionary from `zip_info_to_dict()` back to `ZipInfo`."""
+    zip_info = zipfile.ZipInfo(info['filename'], tuple(info['date_time']))
+    for attr in _ZIP_INFO_ATTRS[2:]:
+        setattr(zip_info, attr, info[attr])
+    zip_info.comment = bytes.fromhex(info['comment'])
+    zip_info.extra = bytes.fromhex(info['extra'])
+    return zip_info
+
+
+def pack_archive(archive_path,
+                 indices,
+                 encoded_items,
+                 save_format,
+                 shard_size,
+                 meta_info,
+                 options,
+                 resume=False,
+                 checkpoint_interval=10000):
+    """Packs encoded items into one archive, with progress checkpointed.
+
+    Args:
+        archive_path: `str`, path to the archive.
+        indices: `range`, indices of the dataset items packed into the archive.
+        encoded_items: `callable`, which takes the indices to encode and
+            returns an iterator over the results of `encode_item()` in order.
+        save_format: `str`, format of the archive, either `zip` or `shard`.
+        shard_size: `int`, maximum size of each shard in MB.
+        meta_info: `dict`, meta information saved as `meta.json`.
+        options: `dict`, packing options, which should be the same as the
+            checkpointed ones to resume.
+        resume: `bool`, whether to resume from the checkpointed progress. The
+            progress file is created before packing the first item, and
+            removed only after the archive is finished, hence an archive
+            without progress is treated as completed. (default: False)
+        checkpoint_interval: `int`, number of items packed between two
+            checkpoints. Non-positive means no checkpoint. (default: 10000)
+    """
+    progress_path = f'{archive_path.rstrip("/")}.progress.json'
+    # Packed items are appended to a side file one line per item, with the
+    # label and (for `zip`) the entry information, such that each checkpoint
+    # only records the file size instead of re-dumping all items.
+    items_path = f'{archive_path.rstrip("/")}.items.jsonl'
+    progress = dict(options=options, num_packed=0, archive_size=0,
+                    items_size=0)
+    if resume:
+        if os.path.isfile(progress_path):
+            with open(progress_path, 'r') as f:
+                progress = json.load(f)
+            if progress['options'] != options:
+                raise ValueError(f'Packing options in `{progress_path}` are '
+                                 f'different from the current ones!\n'
+                                 f'Checkpointed: {progress["options"]}\n'
+                                 f'Current: {options}')
+        elif os.path.exists(archive_path):
+            print(f'Skip completed archive `{archive_path}`.')
+            return
+    num_packed = progress['num_packed']
+
+    labels = []
+    zip_infos = []
+    if num_packed > 0:
+        # Discard items written after the checkpoint.
+        os.truncate(items_path, progress['items_size'])
+        with open(items_path, 'r') as f:
+            for line in f:
+                img_relative_path, target, zip_info = json.loads(line)
+                labels.append([img_relative_path, target])
+                if zip_info is not None:
+                    zip_infos.append(dict_to_zip_info(zip_info))
+        assert len(labels) == num_packed
+    else:
+        # Mark the archive as unfinished before packing anything.
+        save_progress(progress_path, progress)
+    # File will be closed after the function execution.
+    items_file = open(items_path, 'a' if num_packed > 0 else 'w')  # pylint: disable=consider-using-with
+
+    # File will be closed after the function execution.
+    archive_file = None
+    if save_format == 'shard':
+        writer = ShardWriter(archive_path,
+                             shard_size=shard_size * 1024 ** 2,
+                             num_resumed=num_packed)
+    elif num_packed > 0:
+        # The central directory is only written when the archive is closed,
+        # hence the entries before the checkpoint are restored from the saved
+        # information, and everything after the checkpoint is discarded. New
+        # entries are written from the checkpointed offset, and the central
+        # directory of all entries is written when closing.
+        archive_file = open(archive_path, 'r+b')  # pylint: disable=consider-using-with
+        archive_file.truncate(progress['archive_size'])
+        archive_file.seek(progress['archive_size'])
+        writer = zipfile.ZipFile(archive_file, 'w')
+        for zip_info in zip_infos:
+            writer.filelist.append(zip_info)
+            writer.NameToInfo[zip_info.filename] = zip_info
+    else:
+        writer = zipfile.ZipFile(archive_path, 'w')  # pylint: disable=consider-using-with
+
+    progress_bar = tqdm(encoded_items(indices[num_packed:]),
+                        total=len(indices),
+                        initial=num_packed,
+                        desc=os.path.basename(archive_path.rstrip('/')))
+    for img_relative_path, buffer, target in progress_bar:
+        writer.writestr(img_relative_path, buffer)
+        labels.append([img_relative_path, target])
+        if save_format == 'shard':
+            zip_info = None
+        else:
+            zip_info = zip_info_to_dict(writer.getinfo(img_relative_path))
+        items_file.write(
+            json.dumps([img_relative_path, target, zip_info]) + '\n')
+        num_packed += 1
+        if (checkpoint_interval > 0 and num_packed % checkpoint_interval == 0
+                and num_packed < len(indices)):
+            if save_format == 'shard':
+                writer.checkpoint()
+            else:
+                # Entries are valid up to the current offset, which is where
+                # the next entry (or the central directory) starts.
+                writer.fp.flush()
+                os.fsync(writer.fp.fileno())
+                progress['archive_size'] = writer.fp.tell()
+            items_file.flush()
+            os.fsync(items_file.fileno())
+            progress['items_size'] = items_file.tell()
+            progress['num_packed'] = num_packed
+            save_progress(progress_path, progress)
+    writer.writestr('annotation.json', data=json.dumps(labels))
+
+    # Save meta info if exists.
+    if meta_info:
+        writer.writestr('meta.json', data=json.dumps(meta_info))
+
+    writer.close()
+    if archive_file is not None:
+        archive_file.close()
+    items_file.close()
+    if os.path.isfile(progress_path):
+        os.remove(progress_path)
+    if os.path.isfile(items_path):
+        os.remove(items_path)
+
+
+def save_dataset(src,
+                 save_path,
+                 dataset,
+                 portion,
+                 save_format='zip',
+                 shard_size=4096,
+                 num_workers=1,
+                 codec='png',
+                 compress_level=None,
+                 resolution=None,
+                 num_archives=1,
+                 resume=False,
+                 checkpoint_interval=10000):
+    """Makes and saves a dataset in `zip` or `shard` format.
 
     Args:
         src: `str`, directory to the raw data.
-        save_path: `str`, filename of the processed zipfile.
+        save_path: `str`, filename of the processed zipfile, or directory of
+            the packed shards.
         dataset: `str`, name of the dataset.
         portion: `str`, the portion of dataset to be used.
+        save_format: `str`, format of the processed dataset, either `zip` or
+            `shard`. Please refer to `datasets/file_readers/shard_reader.py`
+            for details of the `shard` format. (default: `zip`)
+        shard_size: `int`, maximum size of each shard in MB. This field only
+            takes effect when `save_format` is `shard`. (default: 4096)
+        num_workers: `int`, number of processes to encode images. `1` means to
+            encode in the main process. (default: 1)
+        codec: `str`, codec used for encoding images, among `png`, `jpg`,
+            `webp`, and `raw`. `raw` stores the source files as they are, which
+            requires the dataset to read items from individual files (e.g.,
+            `folder` and `imagenet1k`). (default: `png`)
+        compress_level: `int`, compression level for `png`, or quality for
+            `jpg` and `webp`. (default: None)
+        resolution: `int`, if specified, images will be resized in advance
+            such that the short side equals to `resolution`. (default: None)
+        num_archives: `int`, number of archives to split the dataset into. Each
+            archive is a self-contained dataset with its own annotation.
+            (default: 1)
+        resume: `bool`, whether to resume from the checkpointed progress.
+            (default: False)
+        checkpoint_interval: `int`, number of items packed between two
+            checkpoints. (default: 10000)
     """
+    save_format = save_format.lower()
+    if save_format not in _ALLOWED_SAVE_FORMATS:
+        raise ValueError(f'Invalid save format: `{save_format}`!\n'
+                         f'Supported formats: {_ALLOWED_SAVE_FORMATS}.')
+    codec = codec.lower()
+    if codec not in _ALLOWED_CODECS:
+        raise ValueError(f'Invalid codec: `{codec}`!\n'
+                         f'Supported codecs: {_ALLOWED_CODECS}.')
+
     # Open the source dataset, parse items and annotation.
     data = open_dataset(path=src, dataset=dataset, portion=portion)
-    labels = []
+    if codec == 'raw':
+        assert get_source_path(data, 0) is not None, (
+            f'Codec `raw` requires items read from individual files, which is '
+            f'not supported by dataset `{dataset}`!')
+        assert not resolution, 'Codec `raw` does not support resizing!'
+    meta_info = parse_meta(data)
+    options = dict(src=os.path.abspath(src),
+                   dataset=dataset,
+                   portion=portion,
+                   save_format=save_format,
+                   codec=codec,
+                   compress_level=compress_level,
+                   resolution=resolution,
+                   num_archives=num_archives,
+                   num_samples=len(data))
 
     save_dir = os.path.dirname(save_path)
     if save_dir and not os.path.exists(save_dir):
         os.makedirs(save_dir, exist_ok=False)
-    # File will be closed after the function execution.
-    zip_file = zipfile.ZipFile(save_path, 'w')  # pylint: disable=consider-using-with
-
-    # TODO: parallelize the following iteration.
-    progress_bar = tqdm(enumerate(data), total=len(data), desc='Data')
-    for idx, (img, target) in progress_bar:
-        img_relative_path = f'{target}/img{idx:08d}.png'
-        byte_img = io.BytesIO()
-        img.save(byte_img, format='png', compress_level=0, optimize=False)
-        zip_file.writestr(img_relative_path, byte_img.getbuffer())
-        labels.append([img_relative_path, target])
-    zip_file.writestr('annotation.json', data=json.dumps(labels))
 
-    # Save meta info if exists.
-    meta_info = parse_meta(data)
-    if meta_info:
-        zip_file.writestr('meta.json', data=json.dumps(meta_info))
-
-    zip_file.close()
+    worker_settings = (data, codec, compress_level, resolution)
+    if num_workers > 1:
+        # The dataset is inherited by (or pickled to) worker processes once.
+        pool = multiprocessing.Pool(num_workers,  # pylint: disable=consider-using-with
+                                    initializer=init_worker,
+                                    initargs=worker_settings)
+        # Results are yielded in order, hence the archive is deterministic.
+        encoded_items = lambda indices: pool.imap(encode_item, indices,
+                                                  chunksize=16)
+    else:
+        pool = None
+        init_worker(*worker_settings)
+        encoded_items = lambda indices: map(encode_item, indices)
+
+    try:
+        for archive_idx in range(num_archives):
+            start = len(data) * archive_idx // num_archives
+            end = len(data) * (archive_idx + 1) // num_archives
+            pack_archive(
+                archive_path=get_archive_path(save_path, archive_idx,
+                                              num_archives),
+                indices=range(start, end),
+                encoded_items=encoded_items,
+                save_format=save_format,
+                shard_size=shard_size,
+                meta_info=meta_info,
+                options=dict(options, archive_idx=archive_idx),
+                resume=resume,
+                checkpoint_interval=checkpoint_interval)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 
 def parse_args():
     """Parses arguments."""
-    parser = argparse.ArgumentParser(description='Prepare a `zip` dataset.')
+    parser = argparse.ArgumentParser(
+        description='Prepare a `zip` (or `shard`) dataset.')
     parser.add_argument('src', type=str,
                         help='Path to the input dataset, can be a filename or '
                              'a directory name. If the given path does not '
@@ -246,6 +617,53 @@ def parse_args():
                              'dataset created by other projects (i.e., '
                              'StyleGAN2-ADA with `--dataset stylegan2ada`). '
                              '(default: %(default)s)')
+    parser.add_argument('--save_format', type=str, default='zip',
+                        choices=_ALLOWED_SAVE_FORMATS,
+                        help='Format of the saved dataset. `shard` packs all '
+                             'files into contiguous binary blobs with an '
+                             'offset index, which are memory-mapped for '
+                             'reading. (default: %(default)s)')
+    parser.add_argument('--shard_size', type=int, default=4096,
+                        help='Maximum size (in MB) of each shard. This field '
+                             'only takes effect when `--save_format` is '
+                             '`shard`. (default: %(default)s)')
+    parser.add_argument('--num_workers', type=int, default=1,
+                        help='Number of processes to decode and encode '
+                             'images. The archive is still written by the '
+                             'main process in order. (default: %(default)s)')
+    parser.add_argument('--codec', type=str, default='png',
+                        choices=_ALLOWED_CODECS,
+                        help='Codec used for encoding images. `raw` stores '
+                             'the source files as they are, without decoding, '
+                             'which is only available for datasets reading '
+                             'from individual files. (default: %(default)s)')
+    parser.add_argument('--compress_level', type=int, default=None,
+                        help='Compression level for `png` (0 to 9), or '
+                             'quality for `jpg` and `webp` (0 to 100). If not '
+                             'provided, 0 is used for `png`, and 95 for `jpg` '
+                             'and `webp`. (default: %(default)s)')
+    parser.add_argument('--resolution', type=int, default=None,
+                        help='If provided, images are resized in advance such '
+                             'that the short side equals to this field, with '
+                             'the aspect ratio kept. This is recommended to '
+                             'be the training resolution. '
+                             '(default: %(default)s)')
+    parser.add_argument('--num_archives', type=int, default=1,
+                        help='Number of archives to split the dataset into, '
+                             'each of which is named as '
+                             '`${save_path}-${idx}-of-${num}`. '
+                             '(default: %(default)s)')
+    parser.add_argument('--resume', type=parse_bool, default=False,
+                        help='Whether to resume an interrupted packing from '
+                             'the checkpointed progress. Progress files are '
+                             'created before packing and removed once the '
+                             'archive is finished, hence archives without '
+                             'progress files are treated as completed. '
+                             '(default: %(default)s)')
+    parser.add_argument('--checkpoint_interval', type=int, default=10000,
+                        help='Number of images packed between two progress '
+                             'checkpoints. Non-positive means no checkpoint. '
+                             '(default: %(default)s)')
     return parser.parse_args()
 
 
@@ -263,7 +681,16 @@ def main():
     save_dataset(src=args.src,
                  save_path=args.save_path,
                  dataset=args.dataset,
-                 portion=args.portion)
+                 portion=args.portion,
+                 save_format=args.save_format,
+                 shard_size=args.shard_size,
+                 num_workers=args.num_workers,
+                 codec=args.codec,
+                 compress_level=args.compress_level,
+                 resolution=args.resolution,
+                 num_archives=args.num_archives,
+                 resume=args.resume,
+                 checkpoint_interval=args.checkpoint_interval)
 
 
 if __name__ == '__main__':
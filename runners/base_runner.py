@@ -21,6 +21,8 @@ from metrics import build_metric
 from utils.file_transmitters import build_file_transmitter
 from utils.loggers import build_logger
 from utils.dist_utils import ddp_sync
+from utils.checkpoint_utils import load_checkpoint
+from utils.checkpoint_utils import save_checkpoint
 from utils.formatting_utils import format_time
 from utils.tf_utils import import_tb_writer
 from .augmentations import build_aug
@@ -30,6 +32,8 @@ from .utils.optimizer import build_optimizer
 from .utils.running_stats import RunningStats
 from .utils.profiler import Profiler
 from .utils.freezer import Freezer
+from .utils.prefetcher import DevicePrefetcher
+from .utils.ema import ModelEMA
 
 SummaryWriter = import_tb_writer()
 
@@ -71,6 +75,12 @@ class BaseRunner(object):
 
         # Set up basic configurations, like batch size, training iters, etc.
         self.batch_size = self.config.batch_size
+        self.batch_gpu = self.config.get('batch_gpu', 0) or self.batch_size
+        if self.batch_size % self.batch_gpu != 0:
+            raise ValueError(f'Batch size `{self.batch_size}` is not '
+                             f'divisible by micro-batch size '
+                             f'`{self.batch_gpu}`!')
+        self.num_accum_rounds = self.batch_size // self.batch_gpu
         self.val_batch_size = self.config.val_batch_size
         self._iter = 0
         self._start_iter = 0
@@ -126,8 +136,30 @@ class BaseRunner(object):
         else:
             self.logger.info('Disable automatic mixed-precision training.\n')
 
+        # Engines updating the moving average of models, keyed by the ids of
+        # the source model and the averaged model.
+        self.ema_engines = dict()
+
+        # Set up prefetching data onto the device.
+        self.prefetcher = None
+        self.prefetch_depth = self.config.data.get('device_prefetch_depth', 0)
+        self.running_stats.add('Misc/Data Wait Time',
+                               log_format='time',
+                               log_name='data_wait',
+                               requires_sync=False)
+
         # Build data loaders, augmentation, and convert epoch to iteration.
         self.build_train_loader()
+        self.data_profiler = getattr(self.train_loader.dataset, 'profiler',
+                                     None)
+        if self.data_profiler is not None:
+            for stage in self.data_profiler.stages:
+                for key in ['mean', 'p50', 'p95']:
+                    self.running_stats.add(f'Data Profile/{stage} {key} (ms)',
+                                           log_format=None,
+                                           log_strategy='CURRENT',
+                                           requires_sync=False,
+                                           keep_previous=True)
         if len(self.config.metrics) != 0:
             self.build_val_loader()
         self.build_augment()
@@ -784,6 +816,21 @@ class BaseRunner(object):
                                  indent_level=2)
         self.logger.info('Finish building metrics.\n')
 
+    def update_data_profile(self):
+        """Updates the running stats with the latency of data pre-processing.
+
+        Each stage reports the latency of the calls since the last update, and
+        stages without any call keep the previous values.
+        """
+        if self.data_profiler is None:
+            return
+        for stage, results in self.data_profiler.summarize().items():
+            if results['count'] == 0:
+                continue
+            for key in ['mean', 'p50', 'p95']:
+                self.running_stats.update(
+                    {f'Data Profile/{stage} {key} (ms)': results[f'{key}_ms']})
+
     def build_train_loader(self):
         """Builds training data loader."""
         self.logger.info('Building `train` data loader ...')
@@ -866,12 +913,79 @@ class BaseRunner(object):
             self.clip_model_gradient(name, **clip_kwargs)
         self.amp_scaler.step(self.optimizers[name])
 
-    @staticmethod
-    def smooth_model(src, avg, beta=0.999):
+    def split_batch(self, data):
+        """Splits a batch into `self.num_accum_rounds` micro-batches.
+
+        Tensors whose first dimension is the batch size are split into chunks
+        of `self.batch_gpu` samples, while other values are shared by all
+        micro-batches.
+
+        Args:
+            data: The batch to split, i.e., a dictionary.
+
+        Returns:
+            A list of dictionaries, each of which is a micro-batch.
+        """
+        if self.num_accum_rounds == 1:
+            return [data]
+        micro_batches = [dict() for _ in range(self.num_accum_rounds)]
+        for key, val in data.items():
+            if (isinstance(val, torch.Tensor) and val.ndim > 0 and
+                    val.shape[0] == self.batch_size):
+                chunks = val.split(self.batch_gpu)
+            else:
+                chunks = [val] * self.num_accum_rounds
+            for micro_batch, chunk in zip(micro_batches, chunks):
+                micro_batch[key] = chunk
+        return micro_batches
+
+    def accumulate_gradients(self, loss_fns, data, sync=True):
+        """Accumulates gradients of losses over micro-batches.
+
+        The batch is split with `self.split_batch()`. For each micro-batch,
+        every function in `loss_fns` is called with `(runner, data, sync)`, and
+        the returned loss, scaled by `1 / self.num_accum_rounds`, is
+        back-propagated right away, such that only one micro-batch is kept in
+        memory. Gradients are synchronized across replicas only by the last
+        loss of the last round, hence the accumulated gradients are the same as
+        those computed with the full batch at once.
+
+        NOTE: Gradients are NOT cleared in advance. Besides, a loss function
+        may return `None` to skip the phase (e.g., lazy regularization), which
+        should be decided consistently across rounds.
+
+        Args:
+            loss_fns: A list of loss functions, e.g., `self.loss.d_fake_loss`.
+            data: The batch of data.
+            sync: Whether to synchronize gradients on the last round.
+                (default: True)
+
+        Returns:
+            Whether any loss is back-propagated, i.e., whether the optimizer
+                should be stepped.
+        """
+        micro_batches = self.split_batch(data)
+        has_loss = False
+        for round_idx, micro_batch in enumerate(micro_batches):
+            is_last_round = round_idx == len(micro_batches) - 1
+            for fn_idx, loss_fn in enumerate(loss_fns):
+                is_last_loss = is_last_round and fn_idx == len(loss_fns) - 1
+                loss = loss_fn(self, micro_batch, sync=sync and is_last_loss)
+                if loss is None:
+                    continue
+                if self.num_accum_rounds > 1:
+                    loss = loss / self.num_accum_rounds
+                loss.backward()
+                has_loss = True
+        return has_loss
+
+    def smooth_model(self, src, avg, beta=0.999, interval=1):
         """Smooths model weights with moving average.
 
         This trick is commonly used in GAN training, where the weight of the
-        generator is life-long averaged.
+        generator is life-long averaged. The update is fused across parameters,
+        and unchanged buffers are skipped. Please refer to
+        `runners/utils/ema.py` for details.
 
         NOTE: `src` and `avg` are assumed to be with exactly the same structure.
 
@@ -879,14 +993,24 @@ class BaseRunner(object):
             src: The source model used to update the averaged weights.
             avg: The averaged model weights.
             beta: Hyper-parameter used for moving average. (default: 0.999)
+            interval: Interval (in number of calls) to actually update the
+                averaged model, where the betas of the skipped calls are
+                accumulated. Pending calls are flushed before saving
+                checkpoints and evaluation. (default: 1)
         """
-        with torch.no_grad(), ddp_sync(src, False), ddp_sync(avg, False):
-            # Update parameters with moving average.
-            for src_p, avg_p in zip(src.parameters(), avg.parameters()):
-                avg_p.copy_(src_p.lerp(avg_p, beta))
-            # Directly copy buffers.
-            for src_b, avg_b in zip(src.buffers(), avg.buffers()):
-                avg_b.copy_(src_b)
+        key = (id(src), id(avg))
+        if key not in self.ema_engines:
+            self.ema_engines[key] = ModelEMA(src, avg, interval=interval)
+        engine = self.ema_engines[key]
+        engine.interval = max(int(interval), 1)
+        with ddp_sync(src, False), ddp_sync(avg, False):
+            engine.update(beta)
+
+    def flush_smooth_models(self):
+        """Applies the pending updates of all averaged models."""
+        for engine in self.ema_engines.values():
+            if engine.pending_beta != 1.0:
+                engine.flush()
 
     def pre_execute_controllers(self):
         """Pre-executes all controllers in order of priority."""
@@ -919,6 +1043,9 @@ class BaseRunner(object):
     def train(self):
         """Training function."""
         self.logger.info('Start training.\n')
+        self.prefetcher = DevicePrefetcher(self.train_loader,
+                                           device=self.device,
+                                           depth=self.prefetch_depth)
         self.start()
 
         with Profiler(enable=self.config.enable_profiler,
@@ -931,21 +1058,18 @@ class BaseRunner(object):
                 # Pre-execute all controllers before each training step.
                 self.pre_execute_controllers()
 
-                # Fetch a batch of samples.
-                batch_data = next(self.train_loader)
-                if not isinstance(batch_data, dict):
-                    batch_data = {'data': batch_data}
+                # Fetch a batch of samples, which has already been moved to GPU
+                # by the prefetcher.
+                batch_data = next(self.prefetcher)
+                for key in batch_data:
+                    if isinstance(batch_data[key], torch.Tensor):
+                        assert batch_data[key].shape[0] == self.batch_size
+                self.running_stats.update(
+                    {'Misc/Data Wait Time': self.prefetcher.wait_time})
 
                 # Start timer before each training step. (Computing `data_time`)
                 self.timer.pre_execute(self)
 
-                # Move data to GPU if needed.
-                for key in batch_data:
-                    if not isinstance(batch_data[key], torch.Tensor):
-                        continue
-                    assert batch_data[key].shape[0] == self.batch_size
-                    batch_data[key] = batch_data[key].cuda()
-
                 # Execute training step.
                 self.batch_data = batch_data  # For viz ONLY.
                 self.train_step(batch_data)
@@ -976,33 +1100,110 @@ class BaseRunner(object):
             self.logger.info(f'Best `{metric_name}`: {best_result} at iter '
                              f'{best_iter:06d}.', indent_level=1)
 
-    def check_ddp_consistency(self):
+    def _all_gather(self, tensor):
+        """Gathers a tensor from all replicas with ONE collective.
+
+        Returns:
+            A tensor with shape [world_size, *tensor.shape].
+        """
+        if self.world_size == 1:
+            return tensor.unsqueeze(0)
+        gathered = [torch.empty_like(tensor) for _ in range(self.world_size)]
+        dist.all_gather(gathered, tensor)
+        return torch.stack(gathered)
+
+    def check_ddp_consistency(self, bucket_cap_mb=25):
         """Checks model consistency across multiple replicas.
 
         This function is used to make sure that all replicas have the same
-        parameters.
+        parameters. Instead of broadcasting parameters one by one, parameters
+        are grouped into buckets (never across models), and each bucket is
+        summarized by a fingerprint, i.e., the float64 sum, the sum of squares,
+        and the sum weighted by the parameter index within the bucket (which
+        catches values swapped between parameters). Fingerprints of all buckets
+        are compared with ONE `all_gather()`. Only if any bucket mismatches,
+        the per-parameter checksums within the mismatched buckets are gathered
+        with one more `all_gather()` to report the mismatched parameters.
+
+        Args:
+            bucket_cap_mb: Maximum size (in MB) of each bucket, which trades
+                the granularity of the first check against the size of the
+                communication. (default: 25)
         """
+        bucket_cap = bucket_cap_mb * 1024 * 1024
+        names = []  # Items as (model_name, param_name).
+        checksums = []  # Items as [sum, sum of squares] per parameter.
+        bucket_ids = []
+        weights = []  # Index of each parameter within its bucket, from 1.
+        num_buckets = 0
         for model_name, model in self.models.items():
+            bucket_size, weight = None, 0  # Always start a new bucket.
             for param_name, param in model.named_parameters():
-                src = param.detach()
-                other = src.clone()
-                dist.broadcast(tensor=other, src=0)  # Broadcast 0 to others.
-                if not (src == other).all():
-                    raise SystemExit(f'Parameter `{param_name}` from '
-                                     f'model `{model_name}` mismatch between '
-                                     f'rank 0 and rank {self.rank}.')
+                nbytes = param.numel() * param.element_size()
+                if bucket_size is None or (
+                        bucket_size > 0 and bucket_size + nbytes > bucket_cap):
+                    num_buckets += 1
+                    bucket_size, weight = 0, 0
+                bucket_size += nbytes
+                weight += 1
+                data = param.detach().reshape(-1).to(torch.float64)
+                names.append((model_name, param_name))
+                checksums.append(torch.stack([data.sum(), data.square().sum()]))
+                bucket_ids.append(num_buckets - 1)
+                weights.append(weight)
+        if not checksums:
+            return
+
+        checksums = torch.stack(checksums).to(self.device)
+        bucket_ids = torch.as_tensor(bucket_ids, device=checksums.device)
+        weights = torch.as_tensor(weights, dtype=torch.float64,
+                                  device=checksums.device)
+        fingerprints = torch.zeros((num_buckets, 3), dtype=torch.float64,
+                                   device=checksums.device)
+        fingerprints.index_add_(
+            0, bucket_ids,
+            torch.cat([checksums, (checksums[:, 0] * weights)[:, None]], 1))
+        fingerprints = self._all_gather(fingerprints)
+        bucket_mismatch = fingerprints.ne(fingerprints[:1]).any(dim=2)
+        bucket_mismatch = bucket_mismatch.any(dim=0)
+        if not bucket_mismatch.any().item():
+            return
+
+        # Detailed diff, only within the mismatched buckets. All replicas reach
+        # here together since they see the same gathered fingerprints.
+        param_indices = bucket_mismatch[bucket_ids].nonzero().view(-1)
+        gathered = self._all_gather(checksums[param_indices])
+        param_mismatch = gathered.ne(gathered[:1]).any(dim=2)  # [world, P]
+        messages = []
+        for idx, param_idx in enumerate(param_indices.cpu().tolist()):
+            ranks = param_mismatch[:, idx].nonzero().view(-1).cpu().tolist()
+            if ranks:
+                model_name, param_name = names[param_idx]
+                messages.append(f'`{param_name}` from model `{model_name}` '
+                                f'(rank 0 vs. rank(s) {ranks})')
+        if not messages:  # Only the bucket fingerprints differ.
+            buckets = bucket_mismatch.nonzero().view(-1).cpu().tolist()
+            messages.append(f'bucket(s) {buckets} with swapped values')
+        raise SystemExit(f'Parameters mismatch across replicas: '
+                         f'{"; ".join(messages)}.')
+
+    def get_checkpoint(self,
+                       running_metadata=True,
+                       optimizer=True,
+                       learning_rate=True,
+                       loss=True,
+                       augment=True,
+                       running_stats=False):
+        """Collects the current running status into a checkpoint.
+
+        NOTE: Tensors within the returned checkpoint are NOT copied, i.e., they
+        share memory with the models, optimizers, etc.
+
+        NOTE: Pending updates of averaged models are NOT applied here, since
+        this function may only be called on the chief. Please call
+        `self.flush_smooth_models()` on all replicas in advance.
 
-    def save(self,
-             filepath,
-             running_metadata=True,
-             optimizer=True,
-             learning_rate=True,
-             loss=True,
-             augment=True,
-             running_stats=False):
-        """Saves the current running status.
         Args:
-            filepath: File path to save the checkpoint.
             running_metadata: Whether to save the running metadata, such as
                 batch size, current iteration, etc. (default: True)
             optimizer: Whether to save the optimizer. (default: True)
@@ -1011,10 +1212,10 @@ class BaseRunner(object):
             augment: Whether to save the augmentation, especially the adaptive
                 augmentation probability. (default: True)
             running_stats: Whether to save the running stats. (default: False)
+
+        Returns:
+            A dictionary, which is the checkpoint.
         """
-        if os.path.isfile(filepath):
-            self.logger.warning(f'{filepath} already exists, this will '
-                                f'overwrite the previous one.')
         checkpoint = dict()
         # Models.
         checkpoint['models'] = dict()
@@ -1031,6 +1232,13 @@ class BaseRunner(object):
                 'iter': self.iter,
                 'seen_img': self.seen_img,
             }
+            if hasattr(self.train_loader, 'state_dict'):
+                # Batches staged by the prefetcher are not used yet.
+                num_pending = 0
+                if self.prefetcher is not None:
+                    num_pending = len(self.prefetcher.queue)
+                checkpoint['running_metadata']['train_loader'] = (
+                    self.train_loader.state_dict(num_pending))
         # Optimizers.
         if optimizer:
             checkpoint['optimizers'] = dict()
@@ -1052,9 +1260,57 @@ class BaseRunner(object):
         # Running stats (only save `stats_pool`).
         if running_stats:
             checkpoint['running_stats'] = self.running_stats.stats_pool
-        # Save checkpoint.
-        torch.save(checkpoint, filepath)
-        self.logger.info(f'Successfully saved checkpoint to `{filepath}`.')
+        return checkpoint
+
+    def save(self,
+             filepath,
+             running_metadata=True,
+             optimizer=True,
+             learning_rate=True,
+             loss=True,
+             augment=True,
+             running_stats=False,
+             writer=None):
+        """Saves the current running status.
+
+        The checkpoint is first written to a temporary file, and then renamed to
+        `filepath`, such that an interrupted saving never leaves a broken
+        checkpoint behind. If `config.ckpt_lazy_layout` is set, the checkpoint
+        is saved with the lazy layout, where each component can be loaded
+        separately. Please refer to `utils/checkpoint_utils.py` for details.
+
+        Args:
+            filepath: File path to save the checkpoint.
+            running_metadata: Whether to save the running metadata, such as
+                batch size, current iteration, etc. (default: True)
+            optimizer: Whether to save the optimizer. (default: True)
+            learning_rate: Whether to save the learning rate. (default: True)
+            loss: Whether to save the loss. (default: True)
+            augment: Whether to save the augmentation, especially the adaptive
+                augmentation probability. (default: True)
+            running_stats: Whether to save the running stats. (default: False)
+            writer: An `AsyncCheckpointWriter`. If provided, this function
+                returns right after the checkpoint is copied to CPU memory, and
+                the file is written in background. (default: None)
+        """
+        if os.path.isfile(filepath):
+            self.logger.warning(f'{filepath} already exists, this will '
+                                f'overwrite the previous one.')
+        checkpoint = self.get_checkpoint(running_metadata=running_metadata,
+                                         optimizer=optimizer,
+                                         learning_rate=learning_rate,
+                                         loss=loss,
+                                         augment=augment,
+                                         running_stats=running_stats)
+        lazy = self.config.get('ckpt_lazy_layout', False)
+        if writer is None:
+            save_checkpoint(checkpoint, filepath, lazy=lazy)
+            self.logger.info(f'Successfully saved checkpoint to `{filepath}`.')
+            return
+        writer.save(checkpoint, filepath, lazy=lazy)
+        self.logger.info(f'Snapshotted checkpoint ({writer.num_copied} tensors '
+                         f'copied, {writer.num_skipped} unchanged), which is '
+                         f'being written to `{filepath}` in background.')
 
     def load(self,
              filepath,
@@ -1067,6 +1323,10 @@ class BaseRunner(object):
              map_location='cpu'):
         """Loads previous running status.
 
+        Checkpoints saved with the lazy layout are loaded component by
+        component, i.e., components that are not requested (e.g., optimizers
+        when fine-tuning) are never read from the file.
+
         Args:
             filepath: File path to load the checkpoint.
             running_metadata: Whether to load the running metadata, such as
@@ -1086,7 +1346,7 @@ class BaseRunner(object):
         assert map_location in ['cpu', 'gpu']
         if map_location == 'gpu':
             map_location = lambda storage, location: storage.cuda(self.device)
-        checkpoint = torch.load(filepath, map_location=map_location)
+        checkpoint = load_checkpoint(filepath, map_location=map_location)
         # Load models.
         if 'models' not in checkpoint:
             checkpoint = {'models': checkpoint}
@@ -1107,9 +1367,18 @@ class BaseRunner(object):
                                     'checkpoint, and hence will NOT be '
                                     'loaded!', indent_level=1)
             else:
-                self._iter = checkpoint['running_metadata']['iter']
+                metadata = checkpoint['running_metadata']
+                self._iter = metadata['iter']
                 self._start_iter = self._iter
-                self.seen_img = checkpoint['running_metadata']['seen_img']
+                self.seen_img = metadata['seen_img']
+                loader_state = metadata.get('train_loader', None)
+                if (loader_state is not None and
+                        hasattr(self.train_loader, 'load_state_dict')):
+                    self.train_loader.load_state_dict(loader_state)
+                    self.logger.info(
+                        f'Successfully loaded data loader state, skipping '
+                        f'{loader_state["sampler"]["num_consumed"]} samples '
+                        f'consumed in the current pass.', indent_level=1)
         # Load optimizers.
         if optimizer:
             if 'optimizers' not in checkpoint:
@@ -4,6 +4,7 @@
 import os.path
 from collections import deque
 
+from ..utils.checkpoint_writer import AsyncCheckpointWriter
 from .base_controller import BaseController
 
 __all__ = ['Checkpointer']
@@ -25,6 +26,13 @@ class Checkpointer(BaseController):
     - save_loss: Whether to save the loss. (default: True)
     - save_augment: Whether to save the augmentation. (default: True)
     - save_running_stats: Whether to save the running stats. (default: False)
+    - async_save: Whether to write checkpoints in a background thread. If
+        enabled, the training resumes right after the checkpoint is copied to
+        (pinned) CPU memory. (default: False)
+    - skip_unchanged: Whether to skip copying the tensors unchanged since the
+        last checkpoint (e.g., those of frozen models), detected by content
+        checksum. This field only takes effect when `async_save` is enabled.
+        (default: True)
 
     Checkpoint clean-up settings:
 
@@ -44,6 +52,9 @@ class Checkpointer(BaseController):
         self._save_loss = config.get('save_loss', True)
         self._save_augment = config.get('save_augment', True)
         self._save_running_stats = config.get('save_running_stats', False)
+        self._async_save = config.get('async_save', False)
+        self._skip_unchanged = config.get('skip_unchanged', True)
+        self._writer = None  # Created in `self.setup()` on the chief only.
 
         # Checkpoint clean-up options.
         self._keep_ckpt_num = config.get('keep_ckpt_num', 20)
@@ -71,6 +82,15 @@ class Checkpointer(BaseController):
         runner.logger.info(
             f'Saving running stats: {self._save_running_stats}',
             indent_level=3)
+        runner.logger.info(
+            f'Saving asynchronously: {self._async_save}', indent_level=3)
+        if self._async_save:
+            runner.logger.info(
+                f'Skip unchanged tensors: {self._skip_unchanged}',
+                indent_level=3)
+            if runner.is_chief:
+                self._writer = AsyncCheckpointWriter(
+                    skip_unchanged=self._skip_unchanged)
         if self.ckpt_queue.maxlen > 0:
             runner.logger.info(
                 f'Keep at most {self._keep_ckpt_num} checkpoints',
@@ -79,6 +99,11 @@ class Checkpointer(BaseController):
             runner.logger.info('Keep all checkpoints', indent_level=3)
         super().setup(runner)
 
+    def close(self, runner):
+        if self._writer is not None:
+            self._writer.close()  # Wait for the last checkpoint.
+            self._writer = None
+
     def require_clean_up(self, runner):
         """Returns whether the outdated checkpoint should be removed."""
         if not runner.is_chief:
@@ -93,6 +118,8 @@ class Checkpointer(BaseController):
         if not runner.is_chief:  # Only the chief executes clean-up.
             return
 
+        if self._writer is not None:
+            self._writer.wait()  # The outdated checkpoint may be in writing.
         filepath = self.ckpt_queue.popleft()  # Pop out the outdated checkpoint.
         if os.path.isfile(filepath):
             # May have already been deleted by other controllers.
@@ -102,6 +129,9 @@ class Checkpointer(BaseController):
 
     def save(self, runner):
         """Saves a checkpoint."""
+        # Pending updates of averaged models are applied on all replicas, to
+        # keep them consistent, before the chief saves them.
+        runner.flush_smooth_models()
         runner.check_ddp_consistency()  # Ensure consistency across replicas.
         if not runner.is_chief:  # Only the chief will save the checkpoint.
             return
@@ -114,7 +144,8 @@ class Checkpointer(BaseController):
                     learning_rate=self._save_learning_rate,
                     loss=self._save_loss,
                     augment=self._save_augment,
-                    running_stats=self._save_running_stats)
+                    running_stats=self._save_running_stats,
+                    writer=self._writer)
         self.ckpt_queue.append(filepath)
 
     def execute_after_iteration(self, runner):
@@ -165,6 +165,7 @@ class Evaluator(BaseController):
                 continue
 
             # Set evaluation arguments.
+            runner.flush_smooth_models()
             eval_args = [runner.val_loader]
             for model_name, model_kwargs in metric['kwargs'].items():
                 eval_args.append(runner.models[model_name])
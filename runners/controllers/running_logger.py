@@ -83,6 +83,7 @@ class RunningLogger(BaseController):
         super().setup(runner)
 
     def execute_after_iteration(self, runner):
+        runner.update_data_profile()
         runner.running_stats.summarize()
 
         # Prepare progress log.
@@ -105,7 +105,7 @@ class StyleGAN2Loss(BaseLoss):
             retain the computation graph.
         """
         # Prepare latent codes and labels.
-        batch_size = batch_size or runner.batch_size
+        batch_size = batch_size or runner.batch_gpu  # Micro-batch size.
         latent_dim = runner.models['generator'].latent_dim
         label_dim = runner.models['generator'].label_dim
         latents = torch.randn((batch_size, *latent_dim),
@@ -182,7 +182,7 @@ class StyleGAN2Loss(BaseLoss):
         if runner.iter % self.pl_interval != 1 or self.pl_weight == 0.0:
             return None
 
-        batch_size = max(runner.batch_size // self.pl_batch_shrink, 1)
+        batch_size = max(runner.batch_gpu // self.pl_batch_shrink, 1)
         fake_results = self.run_G(runner,
                                   batch_size=batch_size,
                                   sync=sync,
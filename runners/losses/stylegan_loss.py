@@ -82,7 +82,7 @@ class StyleGANLoss(BaseLoss):
     def run_G(runner, latent_requires_grad=False, sync=True):
         """Forwards generator."""
         # Prepare latents and labels.
-        batch_size = runner.batch_size
+        batch_size = runner.batch_gpu  # Micro-batch size.
         latent_dim = runner.models['generator'].latent_dim
         label_dim = runner.models['generator'].label_dim
         latents = torch.randn((batch_size, *latent_dim), device=runner.device)
@@ -18,6 +18,8 @@ class StyleGAN2Runner(BaseRunner):
             'g_ema_img', 10_000)
         self.g_ema_rampup = self.config.models['generator'].get(
             'g_ema_rampup', 0)
+        self.g_ema_interval = self.config.models['generator'].get(
+            'g_ema_interval', 1)
         if 'generator_smooth' not in self.models:
             self.models['generator_smooth'] = deepcopy(self.models['generator'])
             self.model_kwargs_init['generator_smooth'] = deepcopy(
@@ -34,42 +36,37 @@ class StyleGAN2Runner(BaseRunner):
                                log_strategy='CURRENT')
 
     def train_step(self, data):
+        # Each phase is split into `self.num_accum_rounds` micro-batches, with
+        # gradients synchronized across replicas only on the last round.
+
         # Update generator.
         self.models['discriminator'].requires_grad_(False)
         self.models['generator'].requires_grad_(True)
 
         # Update with adversarial loss.
-        g_loss = self.loss.g_loss(self, data, sync=True)
         self.zero_grad_optimizer('generator')
-        g_loss.backward()
+        self.accumulate_gradients([self.loss.g_loss], data)
         self.step_optimizer('generator')
 
         # Update with perceptual path length regularization if needed.
-        pl_penalty = self.loss.g_reg(self, data, sync=True)
-        if pl_penalty is not None:
-            self.zero_grad_optimizer('generator')
-            pl_penalty.backward()
+        self.zero_grad_optimizer('generator')
+        if self.accumulate_gradients([self.loss.g_reg], data):
             self.step_optimizer('generator')
 
         # Update discriminator.
         self.models['discriminator'].requires_grad_(True)
         self.models['generator'].requires_grad_(False)
 
-        # Update with adversarial loss.
+        # Update with adversarial loss, where the loss on fake images gets
+        # synchronized together with the loss on real images.
         self.zero_grad_optimizer('discriminator')
-        # Update with fake images (get synchronized together with real loss).
-        d_fake_loss = self.loss.d_fake_loss(self, data, sync=False)
-        d_fake_loss.backward()
-        # Update with real images.
-        d_real_loss = self.loss.d_real_loss(self, data, sync=True)
-        d_real_loss.backward()
+        self.accumulate_gradients(
+            [self.loss.d_fake_loss, self.loss.d_real_loss], data)
         self.step_optimizer('discriminator')
 
         # Update with gradient penalty.
-        r1_penalty = self.loss.d_reg(self, data, sync=True)
-        if r1_penalty is not None:
-            self.zero_grad_optimizer('discriminator')
-            r1_penalty.backward()
+        self.zero_grad_optimizer('discriminator')
+        if self.accumulate_gradients([self.loss.d_reg], data):
             self.step_optimizer('discriminator')
 
         # Life-long update generator.
@@ -81,4 +78,5 @@ class StyleGAN2Runner(BaseRunner):
         self.running_stats.update({'Misc/Gs Beta': beta})
         self.smooth_model(src=self.models['generator'],
                           avg=self.models['generator_smooth'],
-                          beta=beta)
+                          beta=beta,
+                          interval=self.g_ema_interval)
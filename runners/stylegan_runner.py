@@ -20,6 +20,8 @@ class StyleGANRunner(BaseRunner):
         super().build_models()
         self.g_ema_img = self.config.models['generator'].get(
             'g_ema_img', 10_000)
+        self.g_ema_interval = self.config.models['generator'].get(
+            'g_ema_interval', 1)
         if 'generator_smooth' not in self.models:
             self.models['generator_smooth'] = deepcopy(self.models['generator'])
             self.model_kwargs_init['generator_smooth'] = deepcopy(
@@ -47,9 +49,9 @@ class StyleGANRunner(BaseRunner):
         # Update discriminator.
         self.models['discriminator'].requires_grad_(True)
         self.models['generator'].requires_grad_(False)
-        d_loss = self.loss.d_loss(self, data, sync=True)
+        # Gradients are accumulated over `self.num_accum_rounds` micro-batches.
         self.zero_grad_optimizer('discriminator')
-        d_loss.backward()
+        self.accumulate_gradients([self.loss.d_loss], data)
         self.step_optimizer('discriminator')
 
         # Life-long update for generator.
@@ -57,15 +59,15 @@ class StyleGANRunner(BaseRunner):
         self.running_stats.update({'Misc/Gs Beta': beta})
         self.smooth_model(src=self.models['generator'],
                           avg=self.models['generator_smooth'],
-                          beta=beta)
+                          beta=beta,
+                          interval=self.g_ema_interval)
 
         # Update generator.
         if self.iter % self.D_repeats == 0:
             self.models['discriminator'].requires_grad_(False)
             self.models['generator'].requires_grad_(True)
-            g_loss = self.loss.g_loss(self, data, sync=True)
             self.zero_grad_optimizer('generator')
-            g_loss.backward()
+            self.accumulate_gradients([self.loss.g_loss], data)
             self.step_optimizer('generator')
 
         # Update automatic mixed-precision scaler.
@@ -0,0 +1,217 @@
+# python3.7
+"""Contains the class for writing checkpoints asynchronously.
+
+Saving a checkpoint synchronously blocks the training (on all replicas, since
+the other replicas wait at the next collective) until `torch.save()` finishes,
+which can take tens of seconds for large models on network file systems.
+`AsyncCheckpointWriter` splits saving into two steps:
+
+(1) Snapshot: Tensors in the checkpoint are copied to (pinned) CPU memory, with
+    non-blocking copies followed by ONE synchronization. The CPU buffers are
+    reused across checkpoints. Optionally, tensors whose content is unchanged
+    since the last snapshot (e.g., those of frozen models) are not copied
+    again, which is detected by comparing the fingerprints of the tensors,
+    computed on the device and fetched with ONE transfer.
+(2) Write: The snapshot is saved by a background thread to a temporary file,
+    which is renamed to the target path atomically. Hence, a checkpoint file
+    is either complete or absent, even if the job is killed while writing.
+
+At most one checkpoint is being written at any time. Taking a new snapshot
+waits for the previous write, since the CPU buffers are reused.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from utils.checkpoint_utils import save_checkpoint
+
+__all__ = ['AsyncCheckpointWriter', 'get_fingerprints']
+
+
+def get_fingerprints(tensors):
+    """Gets the fingerprints of a list of tensors on their own devices.
+
+    The fingerprint of a tensor consists of the sum, the sum of squares, and
+    the sum weighted by the position (from 1) of its elements in float64. The
+    first two are invariant to the order of the elements, hence the last one
+    is required to detect permuted (or swapped) elements.
+
+    Args:
+        tensors: A list of tensors.
+
+    Returns:
+        A float64 tensor with shape [len(tensors), 3], on the device of the
+            first tensor (or CPU if the list is empty).
+    """
+    if not tensors:
+        return torch.zeros((0, 3), dtype=torch.float64)
+    device = tensors[0].device
+    fingerprints = []
+    for tensor in tensors:
+        data = tensor.detach().reshape(-1).to(torch.float64)
+        positions = torch.arange(1, data.numel() + 1, dtype=torch.float64,
+                                 device=data.device)
+        fingerprints.append(torch.stack(
+            [data.sum(), data.square().sum(), (data * positions).sum()]
+        ).to(device))
+    return torch.stack(fingerprints)
+
+
+class AsyncCheckpointWriter(object):
+    """Defines the writer saving checkpoints in a background thread.
+
+    Usage:
+
+    ```
+    writer = AsyncCheckpointWriter(skip_unchanged=True)
+    writer.save(checkpoint, filepath)  # Returns right after the snapshot.
+    writer.wait()  # Waits until the checkpoint is written.
+    ```
+
+    Args:
+        skip_unchanged: Whether to skip copying the tensors whose fingerprints
+            are unchanged since the last snapshot. (default: True)
+        pin_memory: Whether to snapshot into pinned memory, which only takes
+            effect if CUDA is available. (default: True)
+    """
+
+    def __init__(self, skip_unchanged=True, pin_memory=True):
+        self.skip_unchanged = skip_unchanged
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='CheckpointWriter')
+        self._future = None
+        # CPU buffers and fingerprints from the last snapshot, keyed by the
+        # path of each tensor within the checkpoint.
+        self._buffers = dict()
+        self._fingerprints = dict()
+        self.num_copied = 0  # Number of tensors copied by the last snapshot.
+        self.num_skipped = 0  # Number of tensors skipped by the last snapshot.
+
+    @property
+    def is_busy(self):
+        """Whether a checkpoint is being written."""
+        return self._future is not None and not self._future.done()
+
+    def wait(self):
+        """Waits for the previous write, and re-raises its exception if any.
+
+        Returns:
+            The path of the previously written checkpoint, or `None` if there
+                is no previous write.
+        """
+        if self._future is None:
+            return None
+        future = self._future
+        self._future = None
+        return future.result()
+
+    def _collect(self, obj, path, tensors):
+        """Collects all tensors within `obj` recursively, with their paths."""
+        if isinstance(obj, torch.Tensor):
+            tensors.append((path, obj))
+        elif isinstance(obj, dict):
+            for key, val in obj.items():
+                self._collect(val, path + (key,), tensors)
+        elif isinstance(obj, (list, tuple)):
+            for idx, val in enumerate(obj):
+                self._collect(val, path + (idx,), tensors)
+
+    def _replace(self, obj, path, snapshots):
+        """Replaces all tensors within `obj` with their snapshots."""
+        if isinstance(obj, torch.Tensor):
+            return snapshots[path]
+        if isinstance(obj, dict):
+            return obj.__class__(
+                (key, self._replace(val, path + (key,), snapshots))
+                for key, val in obj.items())
+        if isinstance(obj, list):
+            return [self._replace(val, path + (idx,), snapshots)
+                    for idx, val in enumerate(obj)]
+        if isinstance(obj, tuple) and not hasattr(obj, '_fields'):
+            return tuple(self._replace(val, path + (idx,), snapshots)
+                         for idx, val in enumerate(obj))
+        return obj
+
+    def snapshot(self, checkpoint):
+        """Copies the checkpoint to CPU memory.
+
+        NOTE: Non-tensor values are shallowly referenced, hence should not be
+        modified in place before the write finishes.
+
+        Returns:
+            The checkpoint with all tensors replaced by their CPU copies.
+        """
+        self.wait()  # The buffers may still be in use.
+        tensors = []
+        self._collect(checkpoint, (), tensors)
+
+        # Fingerprints of all tensors on each device are fetched at once.
+        fingerprints = dict()
+        if self.skip_unchanged:
+            devices = dict()
+            for path, tensor in tensors:
+                devices.setdefault(tensor.device, []).append((path, tensor))
+            for device_tensors in devices.values():
+                values = get_fingerprints([t for _, t in device_tensors])
+                values = values.cpu().tolist()
+                for (path, _), value in zip(device_tensors, values):
+                    fingerprints[path] = tuple(value)
+
+        snapshots = dict()
+        self.num_copied = 0
+        self.num_skipped = 0
+        has_async_copy = False
+        for path, tensor in tensors:
+            tensor = tensor.detach()
+            buffer = self._buffers.get(path)
+            if (buffer is None or buffer.shape != tensor.shape or
+                    buffer.dtype != tensor.dtype):
+                buffer = torch.empty(tensor.shape,
+                                     dtype=tensor.dtype,
+                                     pin_memory=self.pin_memory)
+                self._fingerprints.pop(path, None)
+            elif (path in fingerprints and
+                  self._fingerprints.get(path) == fingerprints[path]):
+                snapshots[path] = buffer
+                self.num_skipped += 1
+                continue
+            non_blocking = tensor.is_cuda and self.pin_memory
+            buffer.copy_(tensor, non_blocking=non_blocking)
+            has_async_copy = has_async_copy or non_blocking
+            self._buffers[path] = buffer
+            if path in fingerprints:
+                self._fingerprints[path] = fingerprints[path]
+            snapshots[path] = buffer
+            self.num_copied += 1
+        if has_async_copy:
+            torch.cuda.synchronize()
+
+        # Drop buffers of tensors no longer in the checkpoint.
+        for path in list(self._buffers):
+            if path not in snapshots:
+                self._buffers.pop(path)
+                self._fingerprints.pop(path, None)
+        return self._replace(checkpoint, (), snapshots)
+
+    def save(self, checkpoint, filepath, lazy=False):
+        """Snapshots the checkpoint, and writes it in background.
+
+        Please refer to `utils.checkpoint_utils.save_checkpoint()` for the
+        description of `lazy`.
+        """
+        snapshot = self.snapshot(checkpoint)
+
+        def _write():
+            save_checkpoint(snapshot, filepath, lazy=lazy)
+            return filepath
+
+        self._future = self._executor.submit(_write)
+
+    def close(self):
+        """Waits for the pending write, and shuts down the thread."""
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
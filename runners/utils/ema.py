@@ -0,0 +1,146 @@
+# python3.7
+"""Contains the class for updating the exponential moving average of a model.
+
+Updating the moving average (EMA) of a model parameter by parameter launches
+hundreds of tiny kernels every step, each of which allocates a temporary
+tensor. Instead, `ModelEMA` updates all parameters with as few kernels as
+possible:
+
+(1) With `torch._foreach_lerp_()` (if available), all parameters sharing the
+    same device and dtype are updated in place with ONE multi-tensor kernel.
+(2) Otherwise, parameters of the averaged model are re-pointed to contiguous
+    views of a flat buffer ONCE, and the source parameters are gathered into a
+    pre-allocated flat buffer, such that the update is ONE in-place `lerp_()`.
+
+Buffers are copied only if they have been modified since the last copy, which
+is tracked with the version counter of the tensor. Please note that in-place
+operations through `tensor.data` do NOT bump the version counter, hence buffers
+modified in that way should be copied manually.
+
+The structure of both models is re-validated at every update, and the engine
+is rebuilt automatically if any parameter or buffer is replaced.
+
+Besides, the moving average can be updated every N steps, where the betas of
+the skipped steps are multiplied together, i.e., the averaged model after the
+update is exactly the same as the one updated at every step if the source model
+were frozen in between.
+"""
+
+import torch
+
+__all__ = ['ModelEMA']
+
+
+class ModelEMA(object):
+    """Defines the engine to update the moving average of a model.
+
+    Usage:
+
+    ```
+    ema = ModelEMA(src=G, avg=G_smooth, interval=1)
+    ema.update(beta=0.999)  # Call after each step.
+    ```
+
+    Args:
+        src: The source model used to update the averaged weights.
+        avg: The averaged model, which should be with exactly the same
+            structure as `src`.
+        interval: Interval (in number of calls of `self.update()`) to execute
+            the update. (default: 1)
+        use_foreach: Whether to use `torch._foreach_lerp_()` if available.
+            (default: True)
+    """
+
+    def __init__(self, src, avg, interval=1, use_foreach=True):
+        self.src = src
+        self.avg = avg
+        self.interval = max(int(interval), 1)
+        self.use_foreach = use_foreach and hasattr(torch, '_foreach_lerp_')
+
+        self.num_calls = 0
+        self.pending_beta = 1.0  # Product of the betas since the last update.
+
+        self._signature = None
+        self._groups = []  # Items as (src_params, avg_params, flat, src_flat).
+        self._buffers = []  # Items as (src_buffer, avg_buffer).
+        self._buffer_versions = []  # Items as (src_version, avg_version).
+
+    def _get_signature(self):
+        """Gets the signature identifying the structure of both models."""
+        return (tuple((id(p), p.data_ptr()) for p in self.src.parameters()),
+                tuple((id(p), p.data_ptr()) for p in self.avg.parameters()),
+                tuple(id(b) for b in self.src.buffers()),
+                tuple(id(b) for b in self.avg.buffers()))
+
+    def _build(self):
+        """Pairs and groups the tensors of both models, and flattens them."""
+        src_params = list(self.src.parameters())
+        avg_params = list(self.avg.parameters())
+        assert len(src_params) == len(avg_params), 'Mismatched parameters!'
+        groups = dict()
+        for src_p, avg_p in zip(src_params, avg_params):
+            assert src_p.shape == avg_p.shape, 'Mismatched parameter shape!'
+            key = (avg_p.device, avg_p.dtype)
+            groups.setdefault(key, ([], []))
+            groups[key][0].append(src_p)
+            groups[key][1].append(avg_p)
+
+        self._groups = []
+        for src_group, avg_group in groups.values():
+            if self.use_foreach:
+                self._groups.append((src_group, avg_group, None, None))
+                continue
+            flat = torch.cat([p.detach().reshape(-1) for p in avg_group])
+            offset = 0
+            for avg_p in avg_group:
+                avg_p.data = flat[offset:offset + avg_p.numel()].view_as(avg_p)
+                offset += avg_p.numel()
+            self._groups.append((src_group, avg_group, flat,
+                                 torch.empty_like(flat)))
+
+        src_buffers = list(self.src.buffers())
+        avg_buffers = list(self.avg.buffers())
+        assert len(src_buffers) == len(avg_buffers), 'Mismatched buffers!'
+        self._buffers = list(zip(src_buffers, avg_buffers))
+        self._buffer_versions = [None] * len(self._buffers)  # Copy all.
+        self._signature = self._get_signature()
+
+    def update(self, beta=0.999):
+        """Updates the averaged model, i.e., `avg = lerp(src, avg, beta)`.
+
+        Args:
+            beta: Hyper-parameter used for moving average at this step.
+                (default: 0.999)
+
+        Returns:
+            Whether the averaged model is updated by this call.
+        """
+        self.num_calls += 1
+        self.pending_beta *= beta
+        if self.num_calls % self.interval != 0:
+            return False
+        self.flush()
+        return True
+
+    def flush(self):
+        """Applies the pending update to the averaged model immediately."""
+        beta = self.pending_beta
+        self.pending_beta = 1.0
+        with torch.no_grad():
+            if self._get_signature() != self._signature:
+                self._build()
+            # Update parameters with moving average.
+            for src_group, avg_group, flat, src_flat in self._groups:
+                if flat is None:
+                    torch._foreach_lerp_(avg_group, src_group, 1 - beta)  # pylint: disable=protected-access
+                else:
+                    torch.cat([p.detach().reshape(-1) for p in src_group],
+                              out=src_flat)
+                    flat.lerp_(src_flat, 1 - beta)
+            # Copy buffers modified since the last copy.
+            for idx, (src_b, avg_b) in enumerate(self._buffers):
+                versions = (src_b._version, avg_b._version)  # pylint: disable=protected-access
+                if versions == self._buffer_versions[idx]:
+                    continue
+                avg_b.copy_(src_b)
+                self._buffer_versions[idx] = (src_b._version, avg_b._version)  # pylint: disable=protected-access
@@ -0,0 +1,114 @@
+# python3.7
+"""Contains the class for prefetching data onto the running device.
+
+The prefetcher wraps a data loader (i.e., an endless iterator producing batches
+in dictionary) and stages the next few batches onto the target device ahead of
+time. On GPU, the copies are issued on a side CUDA stream with
+`non_blocking=True`, hence they overlap with the computation on the main stream
+if the source tensors are in pinned memory (see `--data_pin_memory`). On CPU,
+the prefetcher degrades to a simple queue, which is convenient for testing.
+"""
+
+import time
+from collections import deque
+
+import torch
+
+__all__ = ['DevicePrefetcher']
+
+
+class DevicePrefetcher(object):
+    """Defines the prefetcher which moves batches to the device in advance.
+
+    Usage:
+
+    ```
+    prefetcher = DevicePrefetcher(data_loader, device='cuda', depth=1)
+    batch_data = next(prefetcher)  # Tensors are already on the device.
+    ```
+
+    NOTE: Only `torch.Tensor` values of the batch are moved to the device,
+    while other values are returned as they are. Non-dictionary batches are
+    wrapped as `{'data': batch}`.
+    """
+
+    def __init__(self, data_loader, device=None, depth=1):
+        """Initializes the prefetcher.
+
+        Args:
+            data_loader: The data loader to fetch batches from, which should
+                support `next()` endlessly.
+            device: The target device. If not specified, the current CUDA
+                device will be used if available, otherwise CPU.
+                (default: None)
+            depth: Number of batches staged on the device ahead of the one
+                being consumed. `0` means to copy each batch synchronously
+                when requested. (default: 1)
+        """
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        if isinstance(device, int):
+            device = torch.device('cuda', device)
+        self.data_loader = data_loader
+        self.device = torch.device(device)
+        self.depth = max(int(depth), 0)
+        self.use_cuda = self.device.type == 'cuda'
+        if self.use_cuda and self.depth > 0:
+            self.stream = torch.cuda.Stream(device=self.device)
+        else:
+            self.stream = None
+        self.queue = deque()  # Items as (batch_data, ready_event).
+        self.wait_time = 0.0  # Host time spent on the latest `next()`.
+
+    def __iter__(self):
+        return self
+
+    def _to_device(self, batch_data):
+        """Moves all tensors within the batch to the target device."""
+        for key, val in batch_data.items():
+            if isinstance(val, torch.Tensor):
+                batch_data[key] = val.to(self.device, non_blocking=True)
+        return batch_data
+
+    def _preload(self):
+        """Fetches a batch from the data loader and issues the copy."""
+        batch_data = next(self.data_loader)
+        if not isinstance(batch_data, dict):
+            batch_data = {'data': batch_data}
+        if self.stream is None:
+            self.queue.append((self._to_device(batch_data), None))
+            return
+        with torch.cuda.stream(self.stream):
+            batch_data = self._to_device(batch_data)
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        self.queue.append((batch_data, event))
+
+    def __next__(self):
+        start_time = time.time()
+        # Keep `self.depth` batches staged after popping the current one.
+        while len(self.queue) <= self.depth:
+            self._preload()
+        batch_data, event = self.queue.popleft()
+        if event is not None:
+            # Make the main stream wait for the copy without blocking the host,
+            # and prevent the memory from being reused by the side stream.
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_event(event)
+            for val in batch_data.values():
+                if isinstance(val, torch.Tensor) and val.is_cuda:
+                    val.record_stream(current_stream)
+        self.wait_time = time.time() - start_time
+        return batch_data
+
+    def reset(self):
+        """Drops all staged batches."""
+        self.queue.clear()
+
+    def info(self):
+        """Collects the information of the prefetcher."""
+        return {
+            'Device': str(self.device),
+            'Prefetch depth': self.depth,
+            'Use side stream': self.stream is not None
+        }
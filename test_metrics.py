@@ -16,6 +16,7 @@ from models import build_model
 from metrics import build_metric
 from utils.loggers import build_logger
 from utils.parsing_utils import parse_bool
+from utils.checkpoint_utils import load_checkpoint
 from utils.parsing_utils import parse_json
 from utils.dist_utils import init_dist
 from utils.dist_utils import exit_dist
@@ -91,7 +92,8 @@ def main():
     torch.backends.cudnn.benchmark = True
     torch.backends.cudnn.deterministic = False
 
-    state = torch.load(args.model)
+    # Only the smoothed generator is read from checkpoints in the lazy layout.
+    state = load_checkpoint(args.model, map_location='cpu')
     G = build_model(**state['model_kwargs_init']['generator_smooth'])
     G.load_state_dict(state['models']['generator_smooth'])
     G.eval().cuda()
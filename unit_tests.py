@@ -3,6 +3,9 @@
 
 import argparse
 
+from datasets.data_loaders.test import test_sampler
+from datasets.file_readers.test import test_pack_archive
+from metrics.test import test_metric_utils
 from models.test import test_model
 from utils.loggers.test import test_logger
 from utils.visualizers.test import test_visualizer
@@ -28,6 +31,15 @@ def parse_args():
     parser.add_argument('--test_visualizer', type=parse_bool, default=False,
                         help='Whether to do unit test on visualizers. '
                              '(default: %(default)s)')
+    parser.add_argument('--test_sampler', type=parse_bool, default=False,
+                        help='Whether to run unit test on the distributed '
+                             'sampler. (default: %(default)s)')
+    parser.add_argument('--test_metric_utils', type=parse_bool, default=False,
+                        help='Whether to run unit test on metric utility '
+                             'functions. (default: %(default)s)')
+    parser.add_argument('--test_pack_archive', type=parse_bool, default=False,
+                        help='Whether to run unit test on packing archives '
+                             'with resuming. (default: %(default)s)')
     return parser.parse_args()
 
 
@@ -44,6 +56,15 @@ def main():
     if args.test_all or args.test_visualizer:
         test_visualizer(args.result_dir)
 
+    if args.test_all or args.test_sampler:
+        test_sampler()
+
+    if args.test_all or args.test_metric_utils:
+        test_metric_utils()
+
+    if args.test_all or args.test_pack_archive:
+        test_pack_archive(args.result_dir)
+
 
 if __name__ == '__main__':
     main()
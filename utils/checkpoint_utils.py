@@ -0,0 +1,181 @@
+# python3.7
+"""Contains utility functions to save and load checkpoints component-wise.
+
+A checkpoint saved by `torch.save()` is a single pickle, which has to be loaded
+as a whole, even if only one model (e.g., `generator_smooth`) is needed. This
+file defines a lazy layout, where the checkpoint is a ZIP archive (without
+compression) containing an index, and one entry for each component, i.e.,
+
+- `hammer_checkpoint/index.pkl`: the structure of the checkpoint.
+- `hammer_checkpoint/models/{model_name}.pth`: state dict of each model.
+- `hammer_checkpoint/optimizers/{opt_name}.pth`: state of each optimizer.
+- `hammer_checkpoint/learning_rates/{lr_name}.pth`: state of each scheduler.
+- `hammer_checkpoint/{key}.pth`: any other top-level value, e.g., `loss`.
+
+`load_checkpoint()` returns a read-only mapping, where each entry is read from
+the archive (and mapped to the target device) only when it is accessed, hence
+components that are not requested are never read. Checkpoints in the legacy
+format (i.e., a dictionary saved by `torch.save()`) are loaded as before.
+
+Usage:
+
+```
+checkpoint = load_checkpoint(filepath, map_location='cpu')
+state_dict = checkpoint['models']['generator_smooth']  # Only reads this one.
+```
+"""
+
+import io
+import os
+import pickle
+import zipfile
+from collections.abc import Mapping
+
+import torch
+
+__all__ = ['save_checkpoint', 'load_checkpoint', 'is_lazy_checkpoint',
+           'LazyCheckpoint']
+
+_PREFIX = 'hammer_checkpoint'
+_INDEX_NAME = f'{_PREFIX}/index.pkl'
+_FORMAT_VERSION = 1
+# Top-level keys whose values are dictionaries of components, each of which is
+# saved as a separate entry.
+_GROUP_KEYS = ('models', 'optimizers', 'learning_rates')
+
+
+def _save_entry(archive, name, obj):
+    """Saves an object as an entry of the archive."""
+    buffer = io.BytesIO()
+    torch.save(obj, buffer)
+    archive.writestr(name, buffer.getvalue())
+
+
+def save_checkpoint(checkpoint, filepath, lazy=False):
+    """Saves a checkpoint.
+
+    The checkpoint is first written to a temporary file within the same
+    directory, and then renamed to `filepath` atomically. Hence, a checkpoint
+    file is either complete or absent, even if the saving is interrupted.
+
+    Args:
+        checkpoint: The checkpoint to save, i.e., a dictionary.
+        filepath: Path to save the checkpoint.
+        lazy: Whether to save the checkpoint with the lazy layout, where each
+            component can be loaded separately. If `False`, the checkpoint is
+            saved with `torch.save()` directly. (default: False)
+    """
+    temp_path = f'{filepath}.{os.getpid()}.tmp'
+    try:
+        if not lazy:
+            torch.save(checkpoint, temp_path)
+        else:
+            index = dict()
+            with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_STORED) as archive:
+                for key, val in checkpoint.items():
+                    if key in _GROUP_KEYS and isinstance(val, dict):
+                        index[key] = dict()
+                        for sub_key, sub_val in val.items():
+                            name = f'{_PREFIX}/{key}/{sub_key}.pth'
+                            _save_entry(archive, name, sub_val)
+                            index[key][sub_key] = name
+                    else:
+                        name = f'{_PREFIX}/{key}.pth'
+                        _save_entry(archive, name, val)
+                        index[key] = name
+                archive.writestr(_INDEX_NAME, pickle.dumps(
+                    dict(version=_FORMAT_VERSION, entries=index)))
+        os.replace(temp_path, filepath)
+    finally:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+
+def is_lazy_checkpoint(filepath):
+    """Checks whether a checkpoint is saved with the lazy layout."""
+    if not zipfile.is_zipfile(filepath):
+        return False
+    with zipfile.ZipFile(filepath, 'r') as archive:
+        return _INDEX_NAME in archive.namelist()
+
+
+class _LazyGroup(Mapping):
+    """Defines a read-only mapping whose values are loaded on access."""
+
+    def __init__(self, checkpoint, entries):
+        self._checkpoint = checkpoint
+        self._entries = entries
+
+    def __getitem__(self, key):
+        return self._checkpoint.load_entry(self._entries[key])
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LazyCheckpoint(Mapping):
+    """Defines a checkpoint saved with the lazy layout.
+
+    The checkpoint behaves as a read-only dictionary. Groups (e.g., `models`)
+    are returned as read-only dictionaries as well. Each entry is read from the
+    archive every time it is accessed, without caching, such that it can be
+    released as soon as it is consumed.
+
+    Args:
+        filepath: Path to the checkpoint.
+        map_location: Map location passed to `torch.load()`, with which the
+            tensors can be loaded directly to the target device.
+            (default: 'cpu')
+    """
+
+    def __init__(self, filepath, map_location='cpu'):
+        self.filepath = filepath
+        self.map_location = map_location
+        with zipfile.ZipFile(filepath, 'r') as archive:
+            index = pickle.loads(archive.read(_INDEX_NAME))
+        if index['version'] != _FORMAT_VERSION:
+            raise ValueError(f'Invalid checkpoint version '
+                             f'`{index["version"]}`!\n'
+                             f'Versions allowed: {[_FORMAT_VERSION]}.')
+        self.entries = index['entries']
+
+    def load_entry(self, name):
+        """Loads an entry from the archive.
+
+        NOTE: Entries are stored without compression, hence are streamed from
+        the file region directly, without reading other entries.
+        """
+        with zipfile.ZipFile(self.filepath, 'r') as archive:
+            with archive.open(name, 'r') as f:
+                return torch.load(f, map_location=self.map_location)
+
+    def __getitem__(self, key):
+        entry = self.entries[key]
+        if isinstance(entry, dict):
+            return _LazyGroup(self, entry)
+        return self.load_entry(entry)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def load_checkpoint(filepath, map_location='cpu'):
+    """Loads a checkpoint, in either the lazy layout or the legacy format.
+
+    Args:
+        filepath: Path to the checkpoint.
+        map_location: Map location passed to `torch.load()`. (default: 'cpu')
+
+    Returns:
+        A `LazyCheckpoint` if the checkpoint is saved with the lazy layout, or
+            the object loaded by `torch.load()` otherwise.
+    """
+    if is_lazy_checkpoint(filepath):
+        return LazyCheckpoint(filepath, map_location=map_location)
+    return torch.load(filepath, map_location=map_location)
@@ -108,6 +108,7 @@ def parse_file_format(path):
     - zip: with `.zip` extension.
     - tar: with `.tar` / `.tgz` / `.tar.gz` extension.
     - lmdb: a folder ending with `lmdb`.
+    - shard: a folder ending with `shard` or `shards`.
     - txt: with `.txt` / `.text` extension, OR without extension (e.g. LICENSE).
     - json: with `.json` extension.
     - jpg: with `.jpeg` / `jpg` / `jpe` extension.
@@ -124,6 +125,8 @@ def parse_file_format(path):
     if os.path.isdir(path) or path.endswith('/'):
         if path.rstrip('/').lower().endswith('lmdb'):
             return 'lmdb'
+        if path.rstrip('/').lower().endswith(('shard', 'shards')):
+            return 'shard'
         return 'dir'
     # Handle file.
     if os.path.isfile(path) and os.path.splitext(path)[1] == '':